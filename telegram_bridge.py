@@ -13,266 +13,2987 @@ Features:
 
 import os
 import re
+import time
+import codecs
 import asyncio
 import logging
-import glob
 import sys
 import threading
-from typing import Optional, List
+import ctypes
+import ctypes.util
+import struct
+import hashlib
+import json
+import tempfile
+import zipfile
+import gzip
+import sqlite3
+import importlib
+import signal
+import itertools
+import html
+import hmac
+import secrets
+import stat
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
+from collections import deque, OrderedDict
+from typing import Optional, List, Dict, Tuple, Callable, Awaitable, Iterable, Iterator, AsyncIterator
 from pathlib import Path
-from queue import Queue
 
 from dotenv import load_dotenv
-from telegram import Update, InputFile
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+
+try:
+    import tiktoken  # Optional: exact token counts for the context budget
+except ImportError:
+    tiktoken = None
+try:
+    import termios  # POSIX terminals: line editing in the terminal front end
+    import tty
+except ImportError:
+    termios = tty = None
+from telegram import Update, InputFile, InputMediaPhoto, InputMediaDocument, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import RetryAfter, BadRequest
+from telegram.ext import Application, ApplicationHandlerStop, CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler, filters, ContextTypes
 
 # Load environment variables
 load_dotenv()
 
-# Global message queue for terminal input
-terminal_input_queue = Queue()
-
 # Configuration
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 AUTHORIZED_USER_ID = int(os.getenv("AUTHORIZED_USER_ID", "0"))
 
+# Access control, checked once per update before any handler runs
+AUTHORIZED_USER_IDS = {user_id for user_id in {AUTHORIZED_USER_ID} | {
+    int(value) for value in os.getenv("AUTHORIZED_USER_IDS", "").split(",") if value.strip()
+} if user_id}  # Users allowed in any chat
+AUTHORIZED_CHAT_IDS = {
+    int(value) for value in os.getenv("AUTHORIZED_CHAT_IDS", "").split(",") if value.strip()
+}  # Chats (e.g. a private group) whose members are all allowed
+UNAUTHORIZED_REPLY = os.getenv("UNAUTHORIZED_REPLY", "false").lower() == "true"  # Tell strangers they are not allowed; silent by default
+UNAUTHORIZED_REPLY_INTERVAL = float(os.getenv("UNAUTHORIZED_REPLY_INTERVAL", "3600"))  # Min seconds between replies to one stranger
+SENDER_RATE = float(os.getenv("SENDER_RATE", "1.0"))  # Updates per second accepted from one allowed sender
+SENDER_BURST = int(os.getenv("SENDER_BURST", "10"))  # Short bursts allowed per sender
+AUTH_TRACKED_SENDERS = 10000  # Senders whose buckets are remembered, least recent dropped first
+
+# Telegram rate budgets (Bot API allows ~1 msg/s per chat and ~30 msg/s overall)
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1.0"))  # Calls per second per chat
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "3"))  # Short bursts allowed per chat
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))  # Calls per second for the bot
+TELEGRAM_EDIT_MIN_INTERVAL = float(os.getenv("TELEGRAM_EDIT_MIN_INTERVAL", "1.0"))  # Fastest preview edits
+TELEGRAM_EDIT_MAX_INTERVAL = float(os.getenv("TELEGRAM_EDIT_MAX_INTERVAL", "6.0"))  # Slowest preview edits
+TELEGRAM_UPLOAD_LIMIT = 50 * 1024 * 1024  # Bot API upload size limit
+TELEGRAM_MEDIA_GROUP_SIZE = 10  # Max items per media group
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "3"))  # Uploads in flight at once
+BUNDLE_MIN_FILES = int(os.getenv("BUNDLE_MIN_FILES", "10"))  # Zip changed files when there are more than this
+BUNDLE_MIN_BYTES = int(os.getenv("BUNDLE_MIN_BYTES", str(20 * 1024 * 1024)))  # ...or when they total more
+BUNDLE_SPOOL_BYTES = 8 * 1024 * 1024  # Archive size kept in memory before spilling to a temp file
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))  # Attempts after flood waits
+
 # Cline configuration
 CLINE_TIMEOUT = int(os.getenv("CLINE_TIMEOUT", "120"))
-CLINE_WORKING_DIR = os.getenv("CLINE_WORKING_DIR", os.getcwd())
+CLINE_WORKING_DIR = os.path.realpath(os.path.expanduser(os.getenv("CLINE_WORKING_DIR", os.getcwd())))
 CLINE_MODEL = os.getenv("CLINE_MODEL", "z-ai/glm-5")
 CLINE_YOLO = os.getenv("CLINE_YOLO", "true").lower() == "true"
 CLINE_PATH = os.getenv("CLINE_PATH", "cline")  # Full path to cline executable if not in PATH
 
-# Logging setup - reduce noise from httpx
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO
-)
-logger = logging.getLogger(__name__)
+# Persistent session: keep one interactive Cline process alive across turns
+CLINE_PERSISTENT = os.getenv("CLINE_PERSISTENT", "true").lower() == "true"
+CLINE_PROMPT_PATTERN = os.getenv("CLINE_PROMPT_PATTERN", r"(?:^|\n)\s*[>❯]\s*$")  # End-of-turn prompt
+CLINE_CANCEL_GRACE = float(os.getenv("CLINE_CANCEL_GRACE", "5"))  # Seconds to wait after SIGINT and SIGTERM before escalating
+CLINE_STARTUP_TIMEOUT = float(os.getenv("CLINE_STARTUP_TIMEOUT", "15"))  # Max wait for the first prompt
+CLINE_MULTILINE = os.getenv("CLINE_MULTILINE", "paste").lower()  # Multi-line prompts: "paste" (bracketed paste to the live process) or "oneshot"
+
+# Context preamble assembled from CLINE_MEMORY.md / CLINE_AGENTS.md
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1000"))  # Max preamble tokens per turn
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "auto")  # auto, approx, tiktoken or module:function
+CONTEXT_TIKTOKEN_ENCODING = os.getenv("CONTEXT_TIKTOKEN_ENCODING", "cl100k_base")
+
+# Bridge state (caches, logs) survives restarts here
+BRIDGE_STATE_DIR = os.path.expanduser(os.getenv("BRIDGE_STATE_DIR", "~/.cline-telegram-bridge"))
+FILE_ID_CACHE_PATH = os.path.join(BRIDGE_STATE_DIR, "file_ids.json")  # Content hash -> Telegram file_id
+FILE_ID_CACHE_SIZE = int(os.getenv("FILE_ID_CACHE_SIZE", "2000"))  # file_ids kept, least recently sent dropped first
+OUTPUT_SPILL_CHARS = int(os.getenv("OUTPUT_SPILL_CHARS", str(1024 * 1024)))  # Transcript kept in memory before moving to a gzip log
+OUTPUT_LOG_KEEP = int(os.getenv("OUTPUT_LOG_KEEP", "20"))  # Transcript logs kept in BRIDGE_STATE_DIR/logs
+TURN_DB_PATH = os.path.join(BRIDGE_STATE_DIR, "turns.db")  # SQLite history of every Cline turn
+TURN_OUTPUT_CHARS = int(os.getenv("TURN_OUTPUT_CHARS", str(256 * 1024)))  # Longer outputs are stored as head and tail
+TERMINAL_HISTORY_PATH = os.path.join(BRIDGE_STATE_DIR, "terminal_history")
+TERMINAL_HISTORY_SIZE = int(os.getenv("TERMINAL_HISTORY_SIZE", "500"))  # Terminal lines remembered across restarts
+
+# Virtual terminal that Cline output is rendered through
+CLINE_VT = os.getenv("CLINE_VT", "true").lower() == "true"
+CLINE_VT_ROWS = int(os.getenv("CLINE_VT_ROWS", "50"))  # Screen height used for cursor movement
+CLINE_VT_SCROLLBACK = int(os.getenv("CLINE_VT_SCROLLBACK", "10000"))  # Lines kept above the screen
+
+# Workspace file index
+FILE_INDEX_WATCH = os.getenv("FILE_INDEX_WATCH", "true").lower() == "true"  # Use inotify when available
+FILE_INDEX_POLL_INTERVAL = float(os.getenv("FILE_INDEX_POLL_INTERVAL", "2"))  # Min seconds between polling rescans
+FILE_INDEX_IGNORE = set(filter(None, os.getenv(
+    "FILE_INDEX_IGNORE", "node_modules,venv,__pycache__"
+).split(",")))  # Directory names never scanned or watched (hidden ones are always skipped)
+FILE_INDEX_MAX_DEPTH = int(os.getenv("FILE_INDEX_MAX_DEPTH", "12"))  # Deepest directory level scanned
+FILE_INDEX_MAX_ENTRIES = int(os.getenv("FILE_INDEX_MAX_ENTRIES", "100000"))  # Entries visited per scan
+DEFAULT_EXTENSIONS = ['.html', '.css', '.js', '.py', '.json', '.md', '.txt', '.png', '.jpg', '.gif']
+IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.gif', '.webp']  # Sent as photos
+CODE_EXTENSIONS = ['.html', '.css', '.js', '.py', '.json', '.md', '.txt', '.xml', '.yaml', '.yml']
+
+# Sessions: one Cline session per workspace, running in parallel
+SESSION_SCOPE = os.getenv("SESSION_SCOPE", "workspace")  # workspace (shared by all chats) or chat (one per chat and workspace)
+CLINE_MAX_RUNNING = int(os.getenv("CLINE_MAX_RUNNING", str(os.cpu_count() or 2)))  # Cline turns running at once across sessions
+CLINE_MAX_PROCESSES = int(os.getenv("CLINE_MAX_PROCESSES", str(max(CLINE_MAX_RUNNING, 2))))  # Live persistent processes; idle ones are stopped, least recently used first
+
+# Job queue
+QUEUE_PRIORITY = os.getenv("QUEUE_PRIORITY", "telegram")  # telegram, terminal or fifo: which source goes first
+QUEUE_MAX_JOBS = int(os.getenv("QUEUE_MAX_JOBS", "20"))  # Waiting jobs per session before new ones are refused
+
+# Local control API: scripts on this host submit to the same session queues
+CONTROL_SOCKET = os.path.expanduser(os.getenv("CONTROL_SOCKET", os.path.join(BRIDGE_STATE_DIR, "control.sock")))  # Unix socket, empty disables
+CONTROL_HTTP_PORT = int(os.getenv("CONTROL_HTTP_PORT", "0"))  # HTTP + server-sent events on 127.0.0.1, 0 disables
+CONTROL_TOKEN = os.getenv("CONTROL_TOKEN", "")  # Bearer token HTTP clients must send; HTTP stays off without it
+HTTP_MAX_BODY = 1024 * 1024  # Largest request body accepted by the embedded HTTP servers
+
+# Update delivery: long polling, or a webhook when TELEGRAM_WEBHOOK_URL is set
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL", "")  # Public HTTPS URL Telegram posts updates to
+TELEGRAM_WEBHOOK_LISTEN = os.getenv("TELEGRAM_WEBHOOK_LISTEN", "127.0.0.1")  # Where the embedded server binds (behind a TLS proxy)
+TELEGRAM_WEBHOOK_PORT = int(os.getenv("TELEGRAM_WEBHOOK_PORT", "8443"))
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET") or secrets.token_urlsafe(32)  # Random per run when unset
+TELEGRAM_WEBHOOK_MAX_CONNECTIONS = int(os.getenv("TELEGRAM_WEBHOOK_MAX_CONNECTIONS", "40"))  # Parallel deliveries Telegram may open
+TELEGRAM_CONCURRENT_UPDATES = int(os.getenv("TELEGRAM_CONCURRENT_UPDATES", "4"))  # Updates handled at once
+WEBHOOK_IDLE_TIMEOUT = 75  # Seconds a kept-alive webhook connection may sit idle
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]  # All the registered handlers consume
+
+# Warm standby pool: pre-spawned processes keyed by (working_dir, model)
+CLINE_POOL_SIZE = int(os.getenv("CLINE_POOL_SIZE", "2"))  # Max standby processes, 0 disables the pool
+CLINE_POOL_TTL = int(os.getenv("CLINE_POOL_TTL", "600"))  # Seconds an unused standby is kept
+
+# Logging setup - reduce noise from httpx
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Silence httpx INFO logs (they're very verbose)
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("httpcore").setLevel(logging.WARNING)
+logging.getLogger("telegram.ext.Application").setLevel(logging.WARNING)
+logging.getLogger("telegram.ext.Updater").setLevel(logging.WARNING)
+
+
+# Terminal output cleaning (compiled once)
+ANSI_ESCAPE_RE = re.compile(r'\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)|\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+ANSI_PARTIAL_RE = re.compile(r'\x1b(?:\][^\x07\x1b]*|\[[0-?]*[ -/]*)?\Z')  # Sequence cut off at chunk end
+CONTROL_CHARS_RE = re.compile(r'[\x00-\x09\x0b\x0c\x0e-\x1f]')
+UI_BORDER_CHARS = frozenset('─│┌┐└┘├┤┬┴┼═║╔╗╚╝╠╣╦╩╬─━│┃┄┅┆┇┈┉┊┋')
+TELEGRAM_TEXT_LIMIT = 4000
+TASK_STARTED_RE = re.compile(r'Task started:\s*(\d+)')
+
+# Subprocess pipe reads grow while the pipe stays full and shrink when it goes quiet
+PUMP_MIN_READ = 4 * 1024
+PUMP_MAX_READ = 64 * 1024
+STDERR_TAIL_CHARS = 4000  # Stderr kept for error logging
+RAW_CONTEXT_CHARS = 1024  # Raw output kept before each chunk for prompt and task ID matching
+
+# Transcripts: first and last lines stay in memory, the full text spills to a gzip log
+OUTPUT_HEAD_CHARS = 16 * 1024
+OUTPUT_TAIL_CHARS = 16 * 1024
+
+# Reply pagination
+PAGE_CHARS = 3500  # Page body, leaving room for status lines in the same message
+PAGER_CACHE_SIZE = 20  # Transcripts kept for "More" buttons
+FENCE_RE = re.compile(r'^\s*```\s*([\w+#.-]*)')
+INLINE_CODE_RE = re.compile(r'`([^`\n]+)`')
+BOLD_RE = re.compile(r'\*\*([^*\n]+)\*\*')
+
+
+class OutputStore:
+    """Cleaned transcript of one Cline turn in bounded memory.
+    
+    The first and last lines are kept for the reply and previews. Every line
+    is also kept until the transcript outgrows OUTPUT_SPILL_CHARS; from then
+    on it is written to a gzip log under BRIDGE_STATE_DIR/logs instead.
+    """
+    
+    def __init__(self):
+        self.head_lines: List[str] = []
+        self.head_size = 0
+        self.tail_lines: deque = deque()
+        self.tail_size = 0
+        self.size = 0  # Characters, newlines included
+        self.line_count = 0
+        self.memory: Optional[List[str]] = []  # Every line until spilled, None once dropped
+        self.path: Optional[str] = None  # Gzip log once spilled
+        self.log = None
+        self.name = time.strftime("%Y%m%d-%H%M%S")
+    
+    def append(self, line: str):
+        size = len(line) + 1
+        self.size += size
+        self.line_count += 1
+        if self.head_size < OUTPUT_HEAD_CHARS:
+            self.head_lines.append(line)
+            self.head_size += size
+        self.tail_lines.append(line)
+        self.tail_size += size
+        while self.tail_size > OUTPUT_TAIL_CHARS and len(self.tail_lines) > 1:
+            self.tail_size -= len(self.tail_lines.popleft()) + 1
+        
+        if self.log:
+            self.log.write(line + "\n")
+        elif self.memory is not None:
+            self.memory.append(line)
+            if self.size > OUTPUT_SPILL_CHARS:
+                self._spill()
+    
+    def extend(self, lines: List[str]):
+        for line in lines:
+            self.append(line)
+    
+    def _spill(self):
+        """Move the transcript to a gzip log and keep writing there."""
+        log_dir = os.path.join(BRIDGE_STATE_DIR, "logs")
+        try:
+            os.makedirs(log_dir, exist_ok=True)
+            self.path = os.path.join(log_dir, f"cline-{self.name}-{os.getpid()}-{id(self):x}.log.gz")
+            # Fast compression: this runs on the event loop as output arrives
+            self.log = gzip.open(self.path, 'wt', encoding='utf-8', compresslevel=1)
+            self.log.write("\n".join(self.memory) + "\n")
+            logger.info(f"Transcript spilled to {self.path}")
+        except OSError as e:
+            logger.warning(f"Could not write transcript log, keeping only head and tail: {e}")
+            self.path = None
+            self.log = None
+        self.memory = None
+        self.prune_logs(log_dir)
+    
+    @staticmethod
+    def prune_logs(log_dir: str):
+        """Delete all but the newest OUTPUT_LOG_KEEP logs."""
+        try:
+            logs = sorted((entry.stat().st_mtime, entry.path) for entry in os.scandir(log_dir) if entry.name.endswith(".log.gz"))
+        except OSError:
+            return
+        for _, path in logs[:-OUTPUT_LOG_KEEP] if OUTPUT_LOG_KEEP > 0 else logs:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    
+    def close(self):
+        if self.log:
+            self.log.close()
+            self.log = None
+    
+    @property
+    def complete(self) -> bool:
+        """Whether the full transcript is available (in memory or on disk)."""
+        return self.memory is not None or self.path is not None
+    
+    def text(self) -> str:
+        """The full transcript while it is still in memory."""
+        return "\n".join(self.memory or [])
+    
+    def head(self, max_chars: int, more: List[str] = ()) -> str:
+        """First max_chars characters, followed by more lines if nothing was cut in between."""
+        lines = self.head_lines
+        if self.line_count == len(self.head_lines):
+            lines = lines + list(more)
+        out = []
+        size = 0
+        for line in lines:
+            out.append(line)
+            size += len(line) + 1
+            if size > max_chars:
+                break
+        return '\n'.join(out)[:max_chars]
+    
+    def tail(self, max_chars: int, more: List[str] = ()) -> str:
+        """Last max_chars characters, with more lines appended after the stored ones."""
+        out = []
+        size = 0
+        for line in itertools.chain(reversed(list(more)), reversed(self.tail_lines)):
+            out.append(line)
+            size += len(line) + 1
+            if size > max_chars:
+                break
+        return '\n'.join(reversed(out))[-max_chars:]
+
+
+class OutputCleaner:
+    """Incremental terminal output sanitizer.
+    
+    Each chunk is scanned once: escape sequences are removed (including ones
+    split across chunks), control characters dropped, and completed lines
+    kept unless they are pure UI borders. Runs of blank lines collapse to one,
+    so paragraph breaks survive for pagination. The preview and the final
+    reply read from the kept lines without re-scanning the whole output.
+    """
+    
+    def __init__(self):
+        self.carry = ""  # Incomplete escape sequence from the previous chunk
+        self.pending = ""  # Current line, not yet terminated
+        self.store = OutputStore()  # Kept, completed lines
+        self.after_blank = True  # Last kept line was blank, or none kept yet
+        self.version = 0  # Bumped whenever the visible text changes
+    
+    @staticmethod
+    def keep_line(line: str) -> bool:
+        """Skip blank lines and lines that are only UI borders."""
+        stripped = line.strip()
+        return bool(stripped) and not all(c in UI_BORDER_CHARS for c in stripped)
+    
+    @staticmethod
+    def collapse(lines: Iterable[str], after_blank: bool = True) -> Tuple[List[str], bool]:
+        """(kept lines, whether the last one is blank) with blank runs collapsed to one empty line.
+        
+        after_blank says whether the previous kept line was blank, so no
+        blank line is kept at the start or twice across calls.
+        """
+        kept = []
+        for line in lines:
+            if OutputCleaner.keep_line(line):
+                kept.append(line)
+                after_blank = False
+            elif not line.strip() and not after_blank:
+                kept.append("")
+                after_blank = True
+        return kept, after_blank
+    
+    def feed(self, chunk: str) -> str:
+        """Consume a chunk of raw output and return the newly completed kept lines."""
+        text = self.carry + chunk
+        self.carry = ""
+        partial = ANSI_PARTIAL_RE.search(text)
+        if partial:
+            self.carry = text[partial.start():]
+            text = text[:partial.start()]
+        
+        text = ANSI_ESCAPE_RE.sub('', text)
+        text = CONTROL_CHARS_RE.sub('', text)
+        if not text:
+            return ""
+        
+        self.version += 1
+        parts = (self.pending + text).split('\n')
+        self.pending = parts.pop()
+        completed, self.after_blank = self.collapse(parts, self.after_blank)
+        self.store.extend(completed)
+        return '\n'.join(completed)
+    
+    def finish(self) -> str:
+        """Flush the last unterminated line at end of output."""
+        self.carry = ""
+        line, self.pending = self.pending, ""
+        if self.keep_line(line):
+            self.store.append(line)
+            self.version += 1
+            return line
+        return ""
+    
+    def _pending_lines(self) -> List[str]:
+        return [self.pending] if self.keep_line(self.pending) else []
+    
+    def head(self, max_chars: int) -> str:
+        """First max_chars characters of the cleaned text."""
+        return self.store.head(max_chars, self._pending_lines())
+    
+    def tail(self, max_chars: int) -> str:
+        """Last max_chars characters of the cleaned text."""
+        return self.store.tail(max_chars, self._pending_lines())
+    
+    def render(self, limit: int = TELEGRAM_TEXT_LIMIT) -> str:
+        """Cleaned text truncated to fit one Telegram message."""
+        text = self.head(limit + 1)
+        if len(text) > limit:
+            text = text[:limit - 3] + "..."
+        return text.strip()
+
+
+VT_TOKEN_RE = re.compile(
+    r'\x1b\[([0-?]*)[ -/]*([@-~])'          # CSI: params, final byte
+    r'|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)'    # OSC (titles etc.)
+    r'|\x1b[()*+].'                         # Charset designation
+    r'|\x1b(.)'                             # Two-character escape
+    r'|([\r\n\b\t])'                        # Cursor control characters
+    r'|[\x00-\x1f\x7f]'                     # Other control characters
+    r'|([^\x00-\x1f\x1b\x7f]+)',            # Printable text
+    re.DOTALL
+)
+VT_PARTIAL_RE = re.compile(r'\x1b(?:\][^\x07\x1b]*|\[[0-?]*[ -/]*|[()*+])?\Z')
+
+
+class VirtualTerminal:
+    """Minimal in-process terminal: a screen grid plus scrollback.
+    
+    Carriage-return spinners and cursor-up redraws overwrite screen cells
+    instead of piling up as duplicate lines. Rows are rendered lazily and
+    cached, so a preview only re-renders the rows that changed. Exposes the
+    same reading interface as OutputCleaner.
+    """
+    
+    def __init__(self, rows: int = None, scrollback: int = None):
+        self.rows = rows or CLINE_VT_ROWS
+        self.screen: List[List[str]] = [[] for _ in range(self.rows)]
+        self.row_cache: List[Optional[str]] = [""] * self.rows  # Rendered rows, None when dirty
+        self.scrollback = deque(maxlen=scrollback or CLINE_VT_SCROLLBACK)  # Kept lines only
+        self.store = OutputStore()  # Lines that scrolled off, then the final screen
+        self.dropped = False  # Scrollback overflowed, so the head comes from the store
+        self.after_blank = True  # Last line kept from scrolling was blank, or none yet
+        self.cx = 0
+        self.cy = 0
+        self.saved = (0, 0)
+        self.carry = ""
+        self.version = 0
+    
+    def _row(self, y: int) -> str:
+        if self.row_cache[y] is None:
+            self.row_cache[y] = ''.join(self.screen[y]).rstrip()
+        return self.row_cache[y]
+    
+    def _touch(self, y: int):
+        self.row_cache[y] = None
+    
+    def _line_feed(self, completed: List[str]):
+        """Move to the next line, scrolling the top row into scrollback."""
+        line = self._row(self.cy)
+        if OutputCleaner.keep_line(line):
+            completed.append(line)
+        self.cx = 0
+        if self.cy < self.rows - 1:
+            self.cy += 1
+            return
+        kept, self.after_blank = OutputCleaner.collapse([self._row(0)], self.after_blank)
+        for top in kept:
+            self.dropped = self.dropped or len(self.scrollback) == self.scrollback.maxlen
+            self.scrollback.append(top)
+            self.store.append(top)
+        self.screen.pop(0)
+        self.row_cache.pop(0)
+        self.screen.append([])
+        self.row_cache.append("")
+    
+    def _write(self, text: str):
+        row = self.screen[self.cy]
+        if self.cx > len(row):
+            row.extend(' ' * (self.cx - len(row)))
+        row[self.cx:self.cx + len(text)] = text
+        self.cx += len(text)
+        self._touch(self.cy)
+    
+    def _erase_rows(self, start: int, end: int):
+        for y in range(start, end):
+            if self.screen[y]:
+                self.screen[y] = []
+                self._touch(y)
+    
+    def _csi(self, params: str, final: str):
+        args = [int(p) if p.isdigit() else 0 for p in params.lstrip('?').split(';')] if params else []
+        n = max(args[0], 1) if args else 1
+        row = self.screen[self.cy]
+        
+        if final == 'A':
+            self.cy = max(self.cy - n, 0)
+        elif final in 'Be':
+            self.cy = min(self.cy + n, self.rows - 1)
+        elif final in 'Ca':
+            self.cx += n
+        elif final == 'D':
+            self.cx = max(self.cx - n, 0)
+        elif final == 'E':
+            self.cy, self.cx = min(self.cy + n, self.rows - 1), 0
+        elif final == 'F':
+            self.cy, self.cx = max(self.cy - n, 0), 0
+        elif final in 'G`':
+            self.cx = n - 1
+        elif final == 'd':
+            self.cy = min(n, self.rows) - 1
+        elif final in 'Hf':
+            y = max(args[0], 1) if args else 1
+            x = max(args[1], 1) if len(args) > 1 else 1
+            self.cy, self.cx = min(y, self.rows) - 1, x - 1
+        elif final == 'K':
+            mode = args[0] if args else 0
+            if mode == 0:
+                del row[self.cx:]
+            elif mode == 1:
+                row[:self.cx + 1] = ' ' * min(self.cx + 1, len(row))
+            else:
+                row.clear()
+            self._touch(self.cy)
+        elif final == 'J':
+            mode = args[0] if args else 0
+            if mode == 0:
+                del row[self.cx:]
+                self._touch(self.cy)
+                self._erase_rows(self.cy + 1, self.rows)
+            elif mode == 1:
+                row[:self.cx + 1] = ' ' * min(self.cx + 1, len(row))
+                self._touch(self.cy)
+                self._erase_rows(0, self.cy)
+            else:
+                self._erase_rows(0, self.rows)
+        elif final == 's':
+            self.saved = (self.cx, self.cy)
+        elif final == 'u':
+            self.cx, self.cy = self.saved
+        # Colors (m) and other modes do not affect the text
+    
+    def feed(self, chunk: str) -> str:
+        """Apply a chunk of raw output and return lines completed by it."""
+        text = self.carry + chunk
+        self.carry = ""
+        partial = VT_PARTIAL_RE.search(text)
+        if partial:
+            self.carry = text[partial.start():]
+            text = text[:partial.start()]
+        if not text:
+            return ""
+        
+        completed: List[str] = []
+        for match in VT_TOKEN_RE.finditer(text):
+            printable = match.group(5)
+            if printable:
+                self._write(printable)
+                continue
+            final = match.group(2)
+            if final:
+                self._csi(match.group(1), final)
+                continue
+            control = match.group(4)
+            if control == '\n':
+                self._line_feed(completed)
+            elif control == '\r':
+                self.cx = 0
+            elif control == '\b':
+                self.cx = max(self.cx - 1, 0)
+            elif control == '\t':
+                self.cx = (self.cx // 8 + 1) * 8
+            elif match.group(3):
+                esc = match.group(3)
+                if esc == '7':
+                    self.saved = (self.cx, self.cy)
+                elif esc == '8':
+                    self.cx, self.cy = self.saved
+                elif esc in 'DE':
+                    self._line_feed(completed)
+                elif esc == 'M':
+                    self.cy = max(self.cy - 1, 0)
+        
+        self.version += 1
+        return '\n'.join(completed)
+    
+    def finish(self) -> str:
+        """Drop any incomplete escape sequence and record the final screen."""
+        self.carry = ""
+        self.store.extend(self._visible_lines())
+        return ""
+    
+    def _visible_lines(self) -> List[str]:
+        lines, _ = OutputCleaner.collapse((self._row(y) for y in range(self.rows)), self.after_blank)
+        while lines and not lines[-1]:
+            lines.pop()  # Unused rows below the cursor
+        return lines
+    
+    def head(self, max_chars: int) -> str:
+        """First max_chars characters of the rendered scrollback and screen."""
+        if self.dropped:
+            return self.store.head(max_chars)
+        out = []
+        size = 0
+        for line in list(self.scrollback) + self._visible_lines():
+            out.append(line)
+            size += len(line) + 1
+            if size > max_chars:
+                break
+        return '\n'.join(out)[:max_chars]
+    
+    def tail(self, max_chars: int) -> str:
+        """Last max_chars characters of the rendered scrollback and screen."""
+        out = []
+        size = 0
+        for line in reversed(self._visible_lines()):
+            out.append(line)
+            size += len(line) + 1
+            if size > max_chars:
+                break
+        else:
+            for line in reversed(self.scrollback):
+                out.append(line)
+                size += len(line) + 1
+                if size > max_chars:
+                    break
+        return '\n'.join(reversed(out))[-max_chars:]
+    
+    def render(self, limit: int = TELEGRAM_TEXT_LIMIT) -> str:
+        """Rendered text truncated to fit one Telegram message."""
+        return OutputCleaner.render(self, limit)
+
+
+def paginate_lines(lines: Iterable[str], limit: int = PAGE_CHARS,
+                   fence: Optional[str] = None) -> Tuple[str, int, Optional[str], bool]:
+    """Fill one page of at most limit characters from lines.
+    
+    Prefers to break after a closing code fence, then at a blank line, then
+    at any line, but never in the first half of the page. A fence still open
+    at the break is closed on this page and reopened on the next.
+    
+    Returns (text, lines used, fence language open at the break, more left).
+    """
+    taken: List[str] = []
+    size = len(f"```{fence}\n") if fence is not None else 0
+    state = fence
+    best = None  # (score, lines used, fence state) of the best break so far
+    more = False
+    
+    for line in lines:
+        match = FENCE_RE.match(line)
+        after = state
+        if match:
+            after = None if state is not None else match.group(1)
+        closing = len("\n```") if after is not None else 0
+        if taken and size + len(line) + 1 + closing > limit:
+            more = True
+            break
+        
+        taken.append(line)
+        size += len(line) + 1
+        closed_fence = match is not None and state is not None
+        state = after
+        if size >= limit // 2:
+            if closed_fence:
+                score = 3
+            elif state is None:
+                score = 2 if not line.strip() else 1
+            else:
+                score = 0
+            if best is None or score >= best[0]:
+                best = (score, len(taken), state)
+    
+    used, end_state = len(taken), state
+    if more and best:
+        _, used, end_state = best
+        
+    text = "\n".join(taken[:used])
+    if fence is not None:
+        text = f"```{fence}\n{text}"
+    if end_state is not None:
+        text += "\n```"
+    return text, used, end_state, more
+
+
+def render_html(text: str) -> str:
+    """Cleaned output as Telegram HTML, in one pass over the lines.
+    
+    Fenced blocks become <pre><code>, `inline code` becomes <code> and
+    **bold** becomes <b>; everything else is escaped, so stray Markdown
+    characters in Cline's output can never break parsing.
+    """
+    out: List[str] = []
+    block: List[str] = []
+    fence = None  # Language of the open fence
+    
+    def close_block():
+        code = html.escape("\n".join(block), quote=False)
+        if fence:
+            out.append(f'<pre><code class="language-{html.escape(fence)}">{code}</code></pre>')
+        else:
+            out.append(f"<pre>{code}</pre>")
+    
+    for line in text.split("\n"):
+        match = FENCE_RE.match(line)
+        if match:
+            if fence is None:
+                fence, block = match.group(1), []
+            else:
+                close_block()
+                fence = None
+            continue
+        if fence is not None:
+            block.append(line)
+            continue
+        
+        parts = INLINE_CODE_RE.split(line)  # Odd indexes are code spans
+        rendered = [
+            f"<code>{html.escape(part, quote=False)}</code>" if i % 2
+            else BOLD_RE.sub(r"<b>\1</b>", html.escape(part, quote=False))
+            for i, part in enumerate(parts)
+        ]
+        out.append("".join(rendered))
+    
+    if fence is not None:
+        close_block()
+    return "\n".join(out)
+
+
+class Pager:
+    """Serves a transcript one page at a time, read from its OutputStore on demand.
+    
+    Pages are addressed by their first line, so a "More" button always
+    produces the same page no matter how often it is pressed.
+    """
+    
+    def __init__(self, store: OutputStore, strip: re.Pattern = None, limit: int = PAGE_CHARS):
+        self.store = store
+        self.strip = strip  # Removed from the last page (the interactive prompt)
+        self.limit = limit
+        self.fences: Dict[int, Optional[str]] = {0: None}  # Page start -> fence open there
+        self.numbers: Dict[int, int] = {0: 1}  # Page start -> page number
+    
+    def _source(self) -> Iterator[str]:
+        store = self.store
+        if store.memory is not None:
+            yield from store.memory
+        elif store.path:
+            with gzip.open(store.path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    yield line.rstrip("\n")
+        else:
+            yield from store.head_lines
+    
+    def _lines(self, start: int) -> Iterator[str]:
+        """Lines from start on, long lines wrapped so each fits on a page."""
+        width = self.limit // 2  # Half a page, so a wrapped piece fits after a half-full page
+        source = self._source()
+        index = 0
+        try:
+            for line in source:
+                for i in range(0, max(len(line), 1), width):
+                    if index >= start:
+                        yield line[i:i + width]
+                    index += 1
+        finally:
+            source.close()
+    
+    def page(self, start: int = 0) -> Tuple[str, Optional[int]]:
+        """(text, start of the next page or None) for the page starting at line start.
+        
+        Blocking when the transcript is on disk - run in a worker thread.
+        """
+        if start not in self.fences:
+            # Unknown start: walk the pages before it to learn the open fence
+            position = 0
+            while position < start:
+                _, position = self.page(position)
+                if position is None:
+                    return "", None
+        
+        lines = self._lines(start)
+        try:
+            text, used, fence, more = paginate_lines(lines, self.limit, self.fences[start])
+        finally:
+            lines.close()
+        
+        if not more:
+            if self.strip:
+                text = self.strip.sub('', text).rstrip()
+            return text, None
+        following = start + used
+        self.fences[following] = fence
+        self.numbers[following] = self.numbers[start] + 1
+        return text, following
+
+
+class Job:
+    """One message waiting for or being processed by Cline."""
+    
+    def __init__(self, job_id: int, source: str, text: str, runner: Callable[["Job"], Awaitable[None]]):
+        self.id = job_id
+        self.source = source  # "telegram", "terminal" or "control"
+        self.text = text
+        self.runner = runner
+        self.created_at = time.time()
+        self.started_at = None
+        self.task: Optional[asyncio.Task] = None
+        self.result: Optional[dict] = None  # Final event for control API listeners
+        self.listeners: List[asyncio.Queue] = []  # Control API clients following this job
+    
+    def subscribe(self) -> asyncio.Queue:
+        """Queue of this job's events, ending with None once it finishes."""
+        listener = asyncio.Queue()
+        self.listeners.append(listener)
+        return listener
+    
+    def unsubscribe(self, listener: asyncio.Queue):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+    
+    def publish(self, event: dict):
+        for listener in self.listeners:
+            listener.put_nowait(event)
+    
+    def finish(self, event: dict):
+        """Send the final event and end every listener's stream."""
+        self.publish(event)
+        self.publish(None)
+        self.listeners = []
+    
+    def describe(self) -> str:
+        preview = " ".join(self.text.split())[:40]
+        return f"#{self.id} {self.source}: {preview}"
+
+
+class JobQueue:
+    """Per-session backlog of messages for Cline.
+    
+    Jobs run one at a time in a worker task, ordered by source priority
+    (QUEUE_PRIORITY) and then arrival. Positions and ETAs use a moving
+    average of recent job durations.
+    """
+    
+    ids = itertools.count(1)  # Job IDs are unique across sessions
+    
+    def __init__(self):
+        self.pending: List[Job] = []
+        self.running: Optional[Job] = None
+        self.wakeup = asyncio.Event()
+        self.worker: Optional[asyncio.Task] = None
+        self.avg_duration = 30.0  # Seconds, updated as jobs finish
+    
+    @staticmethod
+    def priority(job: Job) -> int:
+        if QUEUE_PRIORITY == "fifo" or job.source == QUEUE_PRIORITY:
+            return 0
+        return 1
+    
+    def submit(self, source: str, text: str, runner: Callable[[Job], Awaitable[None]]) -> Optional[Job]:
+        """Queue a job; returns None when the queue is full."""
+        if len(self.pending) >= QUEUE_MAX_JOBS:
+            return None
+        job = Job(next(self.ids), source, text, runner)
+        
+        # After every job of the same or higher priority
+        index = len(self.pending)
+        for i, other in enumerate(self.pending):
+            if self.priority(job) < self.priority(other):
+                index = i
+                break
+        self.pending.insert(index, job)
+        
+        self.wakeup.set()
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self._worker())
+        return job
+    
+    def get(self, job_id: int) -> Optional[Job]:
+        if self.running and self.running.id == job_id:
+            return self.running
+        return next((job for job in self.pending if job.id == job_id), None)
+    
+    def position(self, job: Job) -> int:
+        """1-based place in line, 0 while running."""
+        if job is self.running:
+            return 0
+        return self.pending.index(job) + 1
+    
+    def eta(self, job: Job) -> float:
+        """Estimated seconds until the job starts."""
+        if job is self.running:
+            return 0.0
+        wait = 0.0
+        if self.running and self.running.started_at:
+            wait = max(self.avg_duration - (time.time() - self.running.started_at), 0.0)
+        return wait + self.avg_duration * self.pending.index(job)
+    
+    def cancel(self, job_id: int) -> Optional[Job]:
+        """Remove a waiting job."""
+        job = next((job for job in self.pending if job.id == job_id), None)
+        if job:
+            self.pending.remove(job)
+            job.finish({"event": "cancelled", "job": job.id})
+        return job
+    
+    async def _worker(self):
+        """Run queued jobs one after another."""
+        while True:
+            if not self.pending:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            
+            job = self.pending.pop(0)
+            self.running = job
+            job.started_at = time.time()
+            job.task = asyncio.create_task(job.runner(job))
+            try:
+                # wait() so a cancelled job does not cancel the worker
+                await asyncio.wait([job.task])
+                if not job.task.cancelled() and job.task.exception():
+                    logger.error(f"Job #{job.id} failed: {job.task.exception()}")
+            finally:
+                if not job.task.done() or job.task.cancelled():
+                    job.finish({"event": "cancelled", "job": job.id})
+                elif job.task.exception():
+                    job.finish({"event": "error", "job": job.id, "error": str(job.task.exception())})
+                else:
+                    job.finish(job.result or {"event": "done", "job": job.id})
+                duration = time.time() - job.started_at
+                self.avg_duration = 0.7 * self.avg_duration + 0.3 * duration
+                self.running = None
+    
+    async def stop(self):
+        """Stop the worker and drop waiting jobs."""
+        for job in self.pending:
+            job.finish({"event": "cancelled", "job": job.id})
+        self.pending.clear()
+        if self.worker:
+            self.worker.cancel()
+            self.worker = None
+
+
+def format_duration(seconds: float) -> str:
+    """Short human duration like 45s or 3m."""
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    return f"{seconds // 60}m {seconds % 60}s" if seconds < 600 else f"{seconds // 60}m"
+
+
+class OutputPump:
+    """Drains a subprocess's stdout and stderr concurrently.
+    
+    Stdout is decoded incrementally and queued as text, with None marking EOF.
+    Stderr is read alongside so a chatty child can never block on a full
+    pipe; only its tail is kept, for logging.
+    """
+    
+    def __init__(self, process, queue: asyncio.Queue = None):
+        self.process = process
+        self.queue = queue or asyncio.Queue()
+        self.stderr = ""
+        self.task: Optional[asyncio.Task] = None
+    
+    def start(self) -> asyncio.Task:
+        self.task = asyncio.create_task(self._run())
+        return self.task
+    
+    async def _run(self):
+        readers = [self._pump(self.process.stdout, self.queue.put_nowait)]
+        if self.process.stderr:
+            readers.append(self._pump(self.process.stderr, self._keep_stderr))
+        try:
+            await asyncio.gather(*readers)
+        finally:
+            self.queue.put_nowait(None)
+    
+    def _keep_stderr(self, text: str):
+        self.stderr = (self.stderr + text)[-STDERR_TAIL_CHARS:]
+    
+    @staticmethod
+    async def _pump(stream: asyncio.StreamReader, sink: Callable[[str], None]):
+        """Read a pipe until EOF, adapting the read size to how full it is."""
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        size = PUMP_MIN_READ
+        try:
+            while True:
+                chunk = await stream.read(size)
+                if not chunk:
+                    break
+                if len(chunk) == size:
+                    size = min(size * 2, PUMP_MAX_READ)
+                elif len(chunk) < size // 4:
+                    size = max(size // 2, PUMP_MIN_READ)
+                text = decoder.decode(chunk)
+                if text:
+                    sink(text)
+        except Exception as e:
+            logger.error(f"Error reading Cline output: {e}")
+        finally:
+            tail = decoder.decode(b'', final=True)
+            if tail:
+                sink(tail)
+
+
+def signal_process_group(process, sig: int):
+    """Signal a Cline process and its children; Cline runs as its own process group."""
+    if process is None or process.returncode is not None:
+        return
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(process.pid, sig)
+        else:
+            process.send_signal(sig)
+    except ProcessLookupError:
+        pass
+
+
+class ClineSession:
+    """Manages Cline execution with persistent session support."""
+    
+    no_prompt: set = set()  # (CLINE_PATH, CLINE_PROMPT_PATTERN) pairs whose prompt never appeared
+    
+    @classmethod
+    def prompt_unmatched(cls) -> bool:
+        """Whether interactive startup already failed to find the prompt with this binary and pattern.
+        
+        Remembered for the life of the bridge, so /reset and standbys do not
+        wait CLINE_STARTUP_TIMEOUT again for a prompt that will not match.
+        """
+        return (CLINE_PATH, CLINE_PROMPT_PATTERN) in cls.no_prompt
+    
+    def __init__(self, working_dir: str = None, model: str = None, pool: "ClinePool" = None):
+        self.lock = asyncio.Lock()
+        self.pool = pool  # Warm standby processes to swap in
+        self.queue = JobQueue()  # Messages waiting for this session
+        self.file_index: Optional["FileIndex"] = None  # Live index of the working directory
+        self.working_dir = working_dir or CLINE_WORKING_DIR
+        self.model = model or CLINE_MODEL
+        self.task_id = None  # For resuming tasks
+        self.process = None  # Persistent Cline process
+        self.process_task_id = None  # Task the persistent process is working in, once known
+        self.reader_task = None
+        self.pump: Optional[OutputPump] = None  # Reads the persistent process; keeps its stderr tail
+        self.oneshot_process = None  # Per-message process while one runs
+        self.idle = asyncio.Event()  # Cleared while a turn runs
+        self.idle.set()
+        self.cancel_requested = False  # Set by cancel() for the turn in progress
+        self.timed_out = False  # Set when the turn in progress outlived CLINE_TIMEOUT and was interrupted
+        self.interrupt_task: Optional[asyncio.Task] = None
+        self.output_queue: asyncio.Queue = asyncio.Queue()  # Decoded stdout chunks, None marks EOF
+        self.output_buffer = ""  # Recent raw output of the turn in progress
+        self.last_output: Optional[OutputStore] = None  # Transcript of the latest turn, for /log
+        self.last_pager: Optional[Tuple[Pager, int]] = None  # Latest reply's pager and next page start, if it has more
+        self.session_active = False
+        self.context_sent: Optional[tuple] = None  # Context file keys already given to this process
+        self.task_context: Optional[tuple] = None  # (task_id, context file keys) given to that task
+        self.persistent_failed = False  # Interactive mode unusable, fall back to one process per message
+        self.prompt_pattern = re.compile(CLINE_PROMPT_PATTERN)
+        self.total_tokens = 0
+        self.messages_sent = 0
+        self.session_start_time = None
+        self.last_used = time.time()  # Start of the latest turn, for evicting idle processes
+    
+    def is_alive(self) -> bool:
+        """Check if Cline process is running."""
+        return self.process is not None and self.process.returncode is None
+    
+    def get_stats(self) -> dict:
+        """Get session statistics."""
+        uptime = 0
+        if self.session_start_time:
+            uptime = int(time.time() - self.session_start_time)
+        
+        return {
+            "active": self.is_alive(),
+            "task_id": self.task_id,
+            "tokens": self.total_tokens,
+            "messages": self.messages_sent,
+            "uptime_seconds": uptime,
+            "model": self.model,
+            "working_dir": self.working_dir
+        }
+    
+    async def start_interactive(self) -> bool:
+        """Start Cline in interactive mode for persistent session."""
+        try:
+            cmd = [CLINE_PATH]
+            if CLINE_YOLO:
+                cmd.append("--yolo")
+            # Continue the session's task, so /resume and restarts keep the conversation
+            if self.task_id:
+                cmd.extend(["--taskId", self.task_id])
+            else:
+                cmd.extend(["--model", self.model])
+            cmd.extend(["--cwd", self.working_dir])
+            
+            logger.info(f"Starting Cline interactive: {' '.join(cmd[:4])}")
+            
+            # stderr is drained separately and only logged, as in per-message mode
+            self.process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=self.working_dir,
+                start_new_session=True  # Own process group, so cancel() reaches its children
+            )
+            self.output_queue = asyncio.Queue()
+            self.pump = OutputPump(self.process, self.output_queue)
+            self.reader_task = self.pump.start()
+            self.session_active = True
+            self.process_task_id = self.task_id
+            # A resumed task already holds the context it was given
+            self.context_sent = None
+            if self.task_id and self.task_context and self.task_context[0] == self.task_id:
+                self.context_sent = self.task_context[1]
+            self.session_start_time = time.time()
+            
+            # Swallow the startup banner and wait for the first prompt
+            banner = await self._collect_turn(timeout=CLINE_STARTUP_TIMEOUT, interrupt=False)
+            if not self.is_alive():
+                logger.error(f"Cline exited during startup: {self.stderr_tail()}")
+                self.session_active = False
+                return False
+            if banner is None:
+                # Without a recognisable prompt the end of a turn cannot be detected
+                logger.error(f"No Cline prompt within {CLINE_STARTUP_TIMEOUT}s, check CLINE_PROMPT_PATTERN")
+                ClineSession.no_prompt.add((CLINE_PATH, CLINE_PROMPT_PATTERN))
+                self.session_active = False
+                return False
+            
+            logger.info("Cline interactive session started")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to start Cline: {e}")
+            return False
+        except BaseException:
+            # Cancelled mid-startup: never leave the half-started process running
+            await self.stop()
+            raise
+    
+    async def ensure_interactive(self) -> bool:
+        """Make sure a persistent process is running, starting one if needed."""
+        if not CLINE_PERSISTENT or self.persistent_failed or self.prompt_unmatched():
+            return False
+        if self.is_alive() and self.task_id and self.task_id != self.process_task_id:
+            # /resume picked another task, or a per-message run moved this one on
+            logger.info(f"Restarting Cline to continue task {self.task_id}")
+            await self.stop()
+        if self.is_alive():
+            return True
+        if self.session_active:
+            logger.warning(f"Cline process exited, restarting interactive session: {self.stderr_tail()}")
+            await self.stop()
+        if self.pool and not self.task_id:
+            # Standbys are keyed by (working_dir, model) and carry no task
+            standby = self.pool.acquire(self.working_dir, self.model)
+            if standby:
+                self.adopt(standby)
+                logger.info("Swapped in warm standby Cline process")
+                return True
+        if await self.start_interactive():
+            return True
+        if self.cancel_requested:
+            # /cancel killed the process mid-startup; that says nothing about interactive mode
+            await self.stop()
+            return False
+        logger.warning("Interactive mode unavailable, falling back to one process per message")
+        self.persistent_failed = True
+        await self.stop()
+        return False
+    
+    def stderr_tail(self) -> str:
+        """Last of the persistent process's stderr, for logging."""
+        return self.pump.stderr.strip() if self.pump and self.pump.stderr else "no stderr"
+    
+    def expected_context(self) -> Optional[tuple]:
+        """Context keys the persistent process has seen, or will have once (re)started."""
+        if self.is_alive() and not (self.task_id and self.task_id != self.process_task_id):
+            return self.context_sent
+        if self.task_id and self.task_context and self.task_context[0] == self.task_id:
+            return self.task_context[1]
+        return None
+    
+    def adopt(self, standby: "ClineSession"):
+        """Take over the running process of a warm standby session."""
+        self.process = standby.process
+        self.reader_task = standby.reader_task
+        self.pump = standby.pump
+        self.output_queue = standby.output_queue
+        self.session_start_time = standby.session_start_time
+        self.session_active = True
+        self.process_task_id = None
+        self.context_sent = None
+        standby.process = None
+        standby.reader_task = None
+        standby.pump = None
+        standby.session_active = False
+    
+    def _turn_finished(self, output: str) -> bool:
+        """Check whether the prompt has reappeared at the end of the output."""
+        tail = self.clean_output(output[-512:])
+        return bool(tail) and bool(self.prompt_pattern.search(tail))
+    
+    async def _collect_turn(self, on_output: Callable[[str, str], Awaitable[None]] = None,
+                            timeout: float = None, interrupt: bool = True) -> Optional[str]:
+        """Read output until the prompt reappears or the process exits.
+        
+        A turn that outlives the timeout is interrupted the way cancel() does
+        it, and its remaining output is still collected. Without interrupt
+        (startup) None is returned at the timeout instead. Returns the last
+        raw output; the full text goes through on_output.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or CLINE_TIMEOUT)
+        self.output_buffer = ""
+        
+        while True:
+            try:
+                if self.timed_out:
+                    chunk = await self.output_queue.get()
+                else:
+                    chunk = await asyncio.wait_for(self.output_queue.get(), timeout=max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                if not interrupt:
+                    return None
+                logger.warning(f"Cline turn still running after {timeout or CLINE_TIMEOUT}s, interrupting it")
+                self.timed_out = True
+                self.interrupt_task = asyncio.create_task(self.interrupt())
+                continue
+            
+            if chunk is None:
+                # Process exited
+                self.session_active = False
+                break
+            
+            self.output_buffer = self.output_buffer[-RAW_CONTEXT_CHARS:] + chunk
+            if on_output:
+                await on_output(chunk, self.output_buffer)
+            if self._turn_finished(self.output_buffer):
+                break
+        
+        return self.output_buffer
+    
+    async def send_interactive(self, message: str,
+                               on_output: Callable[[str, str], Awaitable[None]] = None) -> Optional[str]:
+        """Write a message to the persistent process and return its output for this turn.
+        
+        Returns None if the process could not take the message, so the caller can fall back.
+        Input is line based, so multi-line messages (pasted code, the context preamble)
+        are wrapped in bracketed paste markers, or refused with CLINE_MULTILINE=oneshot.
+        """
+        text = message.strip()
+        if "\n" in text:
+            if CLINE_MULTILINE != "paste":
+                return None
+            # The newlines are part of the message, not Enter presses
+            text = f"\x1b[200~{text}\x1b[201~"
+        if not self.is_alive():
+            return None
+        
+        # Output that trailed the previous turn's prompt is shown with this turn,
+        # but does not count towards its end
+        late = []
+        exited = False
+        while not self.output_queue.empty():
+            chunk = self.output_queue.get_nowait()
+            if chunk is None:
+                exited = True
+                break
+            late.append(chunk)
+        if late and on_output:
+            text = "".join(late)
+            await on_output(text, text[-RAW_CONTEXT_CHARS:])
+        if exited:
+            self.session_active = False
+            return None
+        
+        try:
+            self.process.stdin.write((text + "\n").encode('utf-8'))
+            await self.process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError) as e:
+            logger.error(f"Cline stdin closed: {e}")
+            self.session_active = False
+            return None
+        
+        self.messages_sent += 1
+        return await self._collect_turn(on_output)
+    
+    async def cancel(self) -> bool:
+        """Interrupt the turn in progress with SIGINT, then SIGTERM, then SIGKILL.
+        
+        Waits CLINE_CANCEL_GRACE seconds for the turn to end after each signal.
+        Returns False when no turn is running.
+        """
+        if self.idle.is_set():
+            return False
+        self.cancel_requested = True
+        await self.interrupt()
+        return True
+    
+    async def interrupt(self):
+        """Signal the running process until the turn ends, escalating every CLINE_CANCEL_GRACE seconds."""
+        for sig in (signal.SIGINT, signal.SIGTERM, getattr(signal, "SIGKILL", signal.SIGTERM)):
+            signal_process_group(self.oneshot_process or self.process, sig)
+            try:
+                await asyncio.wait_for(self.idle.wait(), timeout=CLINE_CANCEL_GRACE)
+                return
+            except asyncio.TimeoutError:
+                logger.warning(f"Cline turn still running after {signal.Signals(sig).name}")
+    
+    async def stop(self):
+        """Stop the Cline process."""
+        if self.process:
+            try:
+                signal_process_group(self.process, signal.SIGTERM)
+                await asyncio.wait_for(self.process.wait(), timeout=5)
+            except:
+                try:
+                    signal_process_group(self.process, getattr(signal, "SIGKILL", signal.SIGTERM))
+                except:
+                    pass
+        if self.reader_task:
+            self.reader_task.cancel()
+            self.reader_task = None
+        self.pump = None
+        self.process = None
+        self.process_task_id = None
+        self.session_active = False
+        self.context_sent = None
+    
+    def restart(self) -> str:
+        """Reset session state."""
+        self.task_id = None
+        self.persistent_failed = False  # Give interactive mode another try, unless the prompt never matched
+        self.total_tokens = 0
+        self.messages_sent = 0
+        return "Cline session reset. Next message will start fresh."
+    
+    @staticmethod
+    def clean_output(text: str) -> str:
+        """Remove ANSI escape sequences and clean up output."""
+        if not text:
+            return ""
+        
+        cleaner = OutputCleaner()
+        cleaner.feed(text)
+        cleaner.finish()
+        
+        # Truncate if too long for Telegram (4000 char limit)
+        return cleaner.render()
+
+
+class ClinePool:
+    """Warm standby Cline processes keyed by (working_dir, model).
+    
+    Standby processes are started ahead of time so a session can swap one in
+    right after /reset, /cd or /model instead of paying process startup on
+    the next message.
+    """
+    
+    def __init__(self, size: int = None, ttl: int = None):
+        self.size = CLINE_POOL_SIZE if size is None else size
+        self.ttl = CLINE_POOL_TTL if ttl is None else ttl
+        self.standby: Dict[Tuple[str, str], List[Tuple[float, ClineSession]]] = {}
+        self.warming: Dict[Tuple[str, str], asyncio.Task] = {}
+        self.maintenance_task = None
+    
+    def count(self) -> int:
+        """Number of standby processes, including ones still starting."""
+        return sum(len(entries) for entries in self.standby.values()) + len(self.warming)
+    
+    def acquire(self, working_dir: str, model: str) -> Optional[ClineSession]:
+        """Pop a live standby session for this key, if one is ready."""
+        entries = self.standby.get((working_dir, model), [])
+        while entries:
+            _, session = entries.pop(0)
+            if session.is_alive():
+                return session
+            asyncio.create_task(session.stop())
+        return None
+    
+    def prewarm(self, working_dir: str, model: str):
+        """Start a standby process for this key in the background."""
+        if not CLINE_PERSISTENT or self.size <= 0 or ClineSession.prompt_unmatched():
+            return
+        key = (working_dir, model)
+        if key in self.warming or self.standby.get(key):
+            return
+        if self.count() >= self.size and not self._evict_oldest():
+            return
+        self.warming[key] = asyncio.create_task(self._spawn(key))
+    
+    async def _spawn(self, key: Tuple[str, str]):
+        """Start one standby session and park it in the pool."""
+        session = ClineSession(working_dir=key[0], model=key[1])
+        try:
+            if await session.start_interactive():
+                self.standby.setdefault(key, []).append((time.time(), session))
+                logger.info(f"Warm standby ready: {key[0]} ({key[1]})")
+            else:
+                await session.stop()
+        except asyncio.CancelledError:
+            await session.stop()
+            raise
+        except Exception as e:
+            logger.error(f"Failed to prewarm Cline: {e}")
+        finally:
+            self.warming.pop(key, None)
+    
+    def _evict_oldest(self) -> bool:
+        """Stop the least recently parked standby to make room."""
+        oldest = None
+        for key, entries in self.standby.items():
+            if entries and (oldest is None or entries[0][0] < oldest[1]):
+                oldest = (key, entries[0][0])
+        if oldest is None:
+            return False
+        _, session = self.standby[oldest[0]].pop(0)
+        asyncio.create_task(session.stop())
+        return True
+    
+    def evict_expired(self):
+        """Stop standbys idle for longer than the TTL or whose process died."""
+        now = time.time()
+        for key in list(self.standby):
+            keep = []
+            for parked_at, session in self.standby[key]:
+                if session.is_alive() and now - parked_at < self.ttl:
+                    keep.append((parked_at, session))
+                else:
+                    asyncio.create_task(session.stop())
+            if keep:
+                self.standby[key] = keep
+            else:
+                del self.standby[key]
+    
+    async def _maintenance_loop(self):
+        """Periodically evict expired standbys."""
+        while True:
+            await asyncio.sleep(max(5, self.ttl / 4))
+            self.evict_expired()
+    
+    def start(self):
+        """Start the background eviction task."""
+        if self.size > 0 and not self.maintenance_task:
+            self.maintenance_task = asyncio.create_task(self._maintenance_loop())
+    
+    async def stop(self):
+        """Stop all standby processes."""
+        if self.maintenance_task:
+            self.maintenance_task.cancel()
+            self.maintenance_task = None
+        warming = list(self.warming.values())
+        for task in warming:
+            task.cancel()
+        # Let cancelled spawns stop the processes they were starting
+        await asyncio.gather(*warming, return_exceptions=True)
+        self.warming.clear()
+        for entries in self.standby.values():
+            for _, session in entries:
+                await session.stop()
+        self.standby.clear()
+
+
+class SessionRegistry:
+    """Cline sessions keyed by workspace, and by chat when SESSION_SCOPE=chat.
+    
+    Every session has its own lock, task, queue, process and file index, so
+    workspaces progress in parallel. The slots semaphore caps how many Cline
+    turns run at once across all of them.
+    """
+    
+    def __init__(self, pool: ClinePool = None):
+        self.pool = pool
+        self.sessions: Dict[tuple, ClineSession] = {}
+        self.current: Dict[Optional[int], str] = {}  # Chat ID (None for the terminal) -> working dir
+        self.slots = asyncio.Semaphore(max(CLINE_MAX_RUNNING, 1))
+    
+    @staticmethod
+    def key(working_dir: str, chat_id: Optional[int]) -> tuple:
+        return (working_dir, chat_id if SESSION_SCOPE == "chat" else None)
+    
+    def get(self, chat_id: Optional[int] = None, working_dir: str = None, model: str = None) -> ClineSession:
+        """Session for the chat's current (or the given) workspace, created on first use."""
+        # One session per directory, however the path was spelled
+        working_dir = os.path.realpath(working_dir or self.current.get(chat_id, CLINE_WORKING_DIR))
+        key = self.key(working_dir, chat_id)
+        session = self.sessions.get(key)
+        if session is None:
+            session = ClineSession(working_dir, model, pool=self.pool)
+            self.sessions[key] = session
+            logger.info(f"New Cline session for {working_dir}")
+        return session
+    
+    def switch(self, chat_id: Optional[int], working_dir: str) -> ClineSession:
+        """Point a chat at another workspace; the previous session keeps running."""
+        model = self.get(chat_id).model
+        self.current[chat_id] = os.path.realpath(working_dir)
+        return self.get(chat_id, model=model)
+    
+    def all(self) -> List[ClineSession]:
+        return list(self.sessions.values())
+    
+    def find_job(self, job_id: int) -> Tuple[Optional[ClineSession], Optional[Job]]:
+        """The session holding a running or queued job."""
+        for session in self.all():
+            job = session.queue.get(job_id)
+            if job:
+                return session, job
+        return None, None
+    
+    async def cancel_job(self, job_id: int) -> Optional[str]:
+        """Drop a waiting job or interrupt a running one.
+        
+        Returns "queued" or "running" for what was cancelled, None for an unknown job.
+        """
+        session, job = self.find_job(job_id)
+        if job is None:
+            return None
+        if job is not session.queue.running:
+            session.queue.cancel(job_id)
+            return "queued"
+        if not await session.cancel() and job.task:
+            # Between Cline turns (tracking or sending files) - nothing to signal
+            job.task.cancel()
+        return "running"
+    
+    async def make_room(self, keep: ClineSession):
+        """Stop idle persistent processes, least recently used first, so that
+        keep can run one without exceeding CLINE_MAX_PROCESSES.
+        
+        Sessions with a turn in progress are never touched; the call is made
+        with keep's lock held, so two sessions never wait on each other.
+        """
+        live = [session for session in self.all() if session is not keep and session.is_alive()]
+        idle = sorted((session for session in live if not session.lock.locked()), key=lambda session: session.last_used)
+        while len(live) >= max(CLINE_MAX_PROCESSES, 1) and idle:
+            session = idle.pop(0)
+            live.remove(session)
+            if session.lock.locked():
+                continue
+            async with session.lock:
+                logger.info(f"Stopping idle Cline process for {session.working_dir} (CLINE_MAX_PROCESSES={CLINE_MAX_PROCESSES})")
+                await session.stop()
+    
+    async def stop(self):
+        """Stop every session's queue, process and file index."""
+        for session in self.all():
+            await session.queue.stop()
+            await session.stop()
+            if session.file_index:
+                session.file_index.stop()
+
+
+class TokenBucket:
+    """Token bucket rate limiter."""
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+    
+    def delay(self) -> float:
+        """Seconds until a token is available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+    
+    def take(self):
+        self.tokens -= 1
+
+
+class TelegramScheduler:
+    """Central pacing for Telegram sends and edits.
+    
+    Every call waits for a per-chat and a global token, honours flood waits
+    (RetryAfter) and retries. Preview edits are merged per message so only
+    the latest text is sent, at an interval that grows with the output rate
+    and with recent flood waits.
+    """
+    
+    def __init__(self):
+        self.global_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_RATE)
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self.flood_until: Dict[int, float] = {}
+        self.backoff: Dict[int, float] = {}  # Edit interval multiplier after flood waits
+        self.pending_edits: Dict[Tuple[int, int], tuple] = {}  # Latest (render, parse_mode) per message
+        self.edit_workers: Dict[Tuple[int, int], asyncio.Task] = {}
+        self.last_edit_at: Dict[Tuple[int, int], float] = {}
+        self.last_edit_text: Dict[Tuple[int, int], str] = {}
+        self.output_rate: Dict[Tuple[int, int], Tuple[float, float]] = {}  # (bytes/s EWMA, last update)
+    
+    async def acquire(self, chat_id: int):
+        """Wait until the chat and the bot both have budget for one call."""
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST)
+        while True:
+            wait = max(
+                bucket.delay(),
+                self.global_bucket.delay(),
+                self.flood_until.get(chat_id, 0) - time.monotonic()
+            )
+            if wait <= 0:
+                bucket.take()
+                self.global_bucket.take()
+                return
+            await asyncio.sleep(wait)
+    
+    async def _call_once(self, chat_id: int, func, /, *args, **kwargs):
+        """One paced Bot API call; records flood waits before re-raising them."""
+        await self.acquire(chat_id)
+        try:
+            result = await func(*args, **kwargs)
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            if hasattr(retry_after, "total_seconds"):
+                retry_after = retry_after.total_seconds()
+            logger.warning(f"Telegram flood wait for chat {chat_id}: {retry_after}s")
+            self.flood_until[chat_id] = time.monotonic() + float(retry_after)
+            self.backoff[chat_id] = min(self.backoff.get(chat_id, 1.0) * 2, 8.0)
+            raise
+        self.backoff[chat_id] = max(1.0, self.backoff.get(chat_id, 1.0) * 0.9)
+        return result
+    
+    async def call(self, chat_id: int, func, /, *args, **kwargs):
+        """Run a Bot API call within the rate budget, retrying after flood waits."""
+        for attempt in range(TELEGRAM_MAX_RETRIES + 1):
+            try:
+                return await self._call_once(chat_id, func, *args, **kwargs)
+            except RetryAfter:
+                if attempt == TELEGRAM_MAX_RETRIES:
+                    raise
+    
+    def note_output(self, chat_id: int, message_id: int, size: int):
+        """Record output arriving for a streamed message."""
+        key = (chat_id, message_id)
+        now = time.monotonic()
+        rate, updated = self.output_rate.get(key, (0.0, now))
+        elapsed = max(now - updated, 0.05)
+        # Exponentially weighted bytes per second
+        rate = 0.7 * rate + 0.3 * (size / elapsed)
+        self.output_rate[key] = (rate, now)
+    
+    def edit_interval(self, key: Tuple[int, int]) -> float:
+        """Preview edit interval: slower for fast output and after flood waits."""
+        rate = self.output_rate.get(key, (0.0, 0))[0]
+        interval = TELEGRAM_EDIT_MIN_INTERVAL * (1 + rate / 2048)
+        interval *= self.backoff.get(key[0], 1.0)
+        return min(interval, TELEGRAM_EDIT_MAX_INTERVAL)
+    
+    def schedule_edit(self, bot, chat_id: int, message_id: int, render: Callable[[], str], parse_mode: str = None):
+        """Queue an edit; replaces any edit of the same message not yet sent."""
+        key = (chat_id, message_id)
+        self.pending_edits[key] = (render, parse_mode)
+        if key not in self.edit_workers:
+            self.edit_workers[key] = asyncio.create_task(self._edit_worker(bot, key))
+    
+    async def _edit_worker(self, bot, key: Tuple[int, int]):
+        """Send the latest pending edit of one message at the adaptive interval."""
+        try:
+            while key in self.pending_edits:
+                wait = max(
+                    self.last_edit_at.get(key, 0) + self.edit_interval(key),
+                    self.flood_until.get(key[0], 0)
+                ) - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                render, parse_mode = self.pending_edits.pop(key)
+                text = render()
+                if not text or text == self.last_edit_text.get(key):
+                    continue
+                try:
+                    await self._call_once(key[0], bot.edit_message_text,
+                                          chat_id=key[0], message_id=key[1], text=text, parse_mode=parse_mode)
+                    self.last_edit_text[key] = text
+                except RetryAfter:
+                    # Re-render after the flood wait instead of sending stale text
+                    self.pending_edits.setdefault(key, (render, parse_mode))
+                except BadRequest as e:
+                    if "not modified" not in str(e).lower():
+                        logger.warning(f"Preview edit rejected: {e}")
+                except Exception as e:
+                    logger.warning(f"Preview edit failed: {e}")
+                self.last_edit_at[key] = time.monotonic()
+        finally:
+            self.edit_workers.pop(key, None)
+    
+    async def cancel_edits(self, chat_id: int, message_id: int):
+        """Drop pending edits of a message and forget its state."""
+        key = (chat_id, message_id)
+        self.pending_edits.pop(key, None)
+        worker = self.edit_workers.pop(key, None)
+        if worker:
+            worker.cancel()
+            try:
+                await worker
+            except (asyncio.CancelledError, Exception):
+                pass
+        for state in (self.last_edit_at, self.last_edit_text, self.output_rate):
+            state.pop(key, None)
+
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+INOTIFY_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+                | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def _load_inotify():
+    """Return libc if it provides inotify, else None."""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+        libc.inotify_rm_watch
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+def _gitignore_regex(pattern: str) -> str:
+    """Translate one .gitignore glob to a regex over '/'-separated paths."""
+    out = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            out.append('.*')
+            i += 2
+            continue
+        if c == '*':
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            end = pattern.find(']', i + 1)
+            if end == -1:
+                out.append('\\[')
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append('[' + body.replace('\\', '\\\\') + ']')
+                i = end
+        elif c == '\\' and i + 1 < len(pattern):
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
+
+
+class IgnoreRules:
+    """Which workspace paths the file index skips.
+    
+    Hidden entries and FILE_INDEX_IGNORE directory names are always skipped;
+    .gitignore files are honoured per directory (globs, **, negation,
+    directory-only and anchored patterns).
+    """
+    
+    def __init__(self):
+        self.rules: Dict[str, List[Tuple[re.Pattern, bool, bool]]] = {}  # Dir -> (regex, negate, dir_only)
+    
+    def load(self, rel_dir: str, gitignore_path: str):
+        """(Re)load the .gitignore of one directory."""
+        rules = []
+        try:
+            with open(gitignore_path, 'r', errors='replace') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            lines = []
+        for line in lines:
+            line = line.rstrip()
+            if not line or line.startswith('#'):
+                continue
+            negate = line.startswith('!')
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            if not line:
+                continue
+            anchored = '/' in line
+            regex = _gitignore_regex(line.lstrip('/'))
+            if not anchored:
+                regex = '(?:.*/)?' + regex
+            rules.append((re.compile(regex + r'\Z'), negate, dir_only))
+        if rules:
+            self.rules[rel_dir] = rules
+        else:
+            self.rules.pop(rel_dir, None)
+    
+    def is_ignored(self, rel_path: str, is_dir: bool) -> bool:
+        """Check a path relative to the workspace root ('/'-separated)."""
+        name = rel_path.rsplit('/', 1)[-1]
+        if name.startswith('.') or (is_dir and name in FILE_INDEX_IGNORE):
+            return True
+        if not self.rules:
+            return False
+        ignored = False
+        parts = rel_path.split('/')
+        # Rules of each ancestor apply to the path relative to that ancestor; last match wins
+        for depth in range(len(parts)):
+            rules = self.rules.get('/'.join(parts[:depth]))
+            if not rules:
+                continue
+            sub = '/'.join(parts[depth:])
+            for regex, negate, dir_only in rules:
+                if (is_dir or not dir_only) and regex.match(sub):
+                    ignored = not negate
+        return ignored
+
+
+def walk_workspace(root: str, ignore: IgnoreRules = None, start: str = None,
+                   on_dir: Callable[[str], None] = None, extensions: List[str] = None) -> set:
+    """Collect files under root in a single os.scandir pass.
+    
+    Ignored directories are pruned rather than filtered, depth and visited
+    entries are capped, and extensions are matched against a set. Meant to
+    run in a worker thread.
+    """
+    ignore = ignore or IgnoreRules()
+    suffixes = frozenset(extensions) if extensions else None
+    start = start or root
+    rel_start = os.path.relpath(start, root).replace(os.sep, '/')
+    rel_start = '' if rel_start == '.' else rel_start
+    found = set()
+    visited = 0
+    stack = [(start, rel_start, rel_start.count('/') + 1 if rel_start else 0)]
+    
+    while stack:
+        directory, rel_dir, depth = stack.pop()
+        if on_dir:
+            on_dir(directory)
+        try:
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        
+        if any(entry.name == '.gitignore' for entry in entries):
+            ignore.load(rel_dir, os.path.join(directory, '.gitignore'))
+        
+        for entry in entries:
+            visited += 1
+            if visited > FILE_INDEX_MAX_ENTRIES:
+                logger.warning(f"Workspace scan stopped after {FILE_INDEX_MAX_ENTRIES} entries: {root}")
+                return found
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            if ignore.is_ignored(rel, is_dir):
+                continue
+            if is_dir:
+                if depth < FILE_INDEX_MAX_DEPTH:
+                    stack.append((entry.path, rel, depth + 1))
+            elif suffixes is None or os.path.splitext(entry.name)[1] in suffixes:
+                found.add(entry.path)
+    
+    return found
+
+
+class FileSnapshot:
+    """Per-file (size, mtime_ns, inode) with a lazily computed content hash.
+    
+    A file is only re-hashed when its stat key changes, so unchanged files
+    cost one stat per check and touched-but-identical files are not
+    reported as modified.
+    """
+    
+    def __init__(self):
+        self.entries: Dict[str, Tuple[tuple, Optional[str]]] = {}  # Path -> (stat key, sha256 or None)
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def stat_key(path: str) -> tuple:
+        st = os.stat(path)
+        return (st.st_size, st.st_mtime_ns, st.st_ino)
+    
+    @staticmethod
+    def hash_file(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+    
+    def record(self, paths: List[str]):
+        """Remember the stat key of files, keeping known hashes of unchanged ones."""
+        for path in paths:
+            try:
+                key = self.stat_key(path)
+            except OSError:
+                continue
+            with self.lock:
+                old = self.entries.get(path)
+                if not old or old[0] != key:
+                    self.entries[path] = (key, None)
+    
+    def changed(self, path: str) -> Optional[bool]:
+        """Whether content differs from the recorded state; None if the file is gone."""
+        try:
+            key = self.stat_key(path)
+        except OSError:
+            self.forget(path)
+            return None
+        with self.lock:
+            old = self.entries.get(path)
+        if old and old[0] == key:
+            return False
+        try:
+            digest = self.hash_file(path)
+        except OSError:
+            return None
+        with self.lock:
+            self.entries[path] = (key, digest)
+        # Without a previous hash the stat change is all we know
+        return not (old and old[1] == digest)
+    
+    def digest(self, path: str) -> str:
+        """Content hash of a file, computed only if its stat key changed."""
+        key = self.stat_key(path)
+        with self.lock:
+            old = self.entries.get(path)
+        if old and old[0] == key and old[1]:
+            return old[1]
+        digest = self.hash_file(path)
+        with self.lock:
+            self.entries[path] = (key, digest)
+        return digest
+    
+    def forget(self, path: str):
+        with self.lock:
+            self.entries.pop(path, None)
+
+
+class FileIndex:
+    """Live in-memory index of workspace files.
+    
+    Kept current by inotify where available (through libc via ctypes), with
+    a throttled rescan as fallback. Files created since mark() are tracked
+    as they appear, so new-file detection costs O(changes).
+    """
+    
+    def __init__(self, root: str, on_change: Callable[[Optional[str]], None] = None):
+        self.root = root
+        self.on_change = on_change  # Told about every changed path (None: anything may have changed)
+        self.paths: set = set()
+        self.created: set = set()  # New since mark()
+        self.deleted: set = set()  # Existed at mark() and removed since
+        self.touched: set = set()  # Written since mark() (inotify only)
+        self.snapshot = FileSnapshot()
+        self.lock = threading.Lock()  # Terminal thread reads the index too
+        self.ignore = IgnoreRules()
+        self.libc = None
+        self.fd = None
+        self.watches: Dict[int, str] = {}  # Watch descriptor -> directory
+        self.pending: set = set()  # New directories waiting to be scanned
+        self.scanning: Optional[asyncio.Task] = None
+        self.last_scan = 0.0
+    
+    @property
+    def watching(self) -> bool:
+        return self.fd is not None
+    
+    async def start(self):
+        """Build the index and start watching for changes."""
+        if FILE_INDEX_WATCH:
+            self.libc = _load_inotify()
+        if self.libc:
+            fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd >= 0:
+                self.fd = fd
+        
+        paths, ok, _ = await asyncio.to_thread(self._scan_and_watch, self.root)
+        with self.lock:
+            self.paths = paths
+        self.last_scan = time.monotonic()
+        if not ok:
+            logger.warning("File watch limit reached, falling back to polling")
+            self.stop()
+        elif self.fd is not None:
+            # Events queued during the scan are applied on top of it
+            asyncio.get_running_loop().add_reader(self.fd, self._drain)
+        logger.info(f"File index ready: {len(paths)} files ({'inotify' if self.watching else 'polling'})")
+    
+    def stop(self):
+        """Stop watching."""
+        if self.fd is not None:
+            try:
+                asyncio.get_running_loop().remove_reader(self.fd)
+            except Exception:
+                pass
+            os.close(self.fd)
+            self.fd = None
+        if self.scanning:
+            self.scanning.cancel()
+            self.scanning = None
+        self.pending.clear()
+        self.watches.clear()
+    
+    def _add_watch(self, directory: str) -> bool:
+        if self.fd is None:
+            return True
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), INOTIFY_MASK)
+        if wd < 0:
+            return False
+        self.watches[wd] = directory
+        return True
+    
+    def _remove_watches(self, unwanted: Callable[[str], bool]):
+        """Stop watching the directories unwanted() picks."""
+        for wd, directory in list(self.watches.items()):
+            if unwanted(directory):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                self.watches.pop(wd, None)
+    
+    def _scan_and_watch(self, start: str) -> Tuple[set, bool, set]:
+        """Walk a directory tree, adding a watch per directory. Returns (files, all_watched, directories)."""
+        ok = True
+        directories = set()
+        
+        def watch(directory: str):
+            nonlocal ok
+            directories.add(directory)
+            if ok and not self._add_watch(directory):
+                ok = False
+        
+        found = walk_workspace(self.root, self.ignore, start=start, on_dir=watch)
+        return found, ok, directories
+    
+    def _relative(self, path: str) -> str:
+        return os.path.relpath(path, self.root).replace(os.sep, '/')
+    
+    def _added(self, path: str):
+        if path in self.paths:
+            return
+        self.paths.add(path)
+        if path in self.deleted:
+            self.deleted.discard(path)  # Existed at mark, same path again
+        else:
+            self.created.add(path)
+    
+    def _removed(self, path: str):
+        if path not in self.paths:
+            return
+        self.paths.discard(path)
+        if path in self.created:
+            self.created.discard(path)
+        else:
+            self.deleted.add(path)
+    
+    def _drain(self):
+        """Apply all queued inotify events without blocking."""
+        while self.fd is not None:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                logger.error(f"inotify read failed: {e}")
+                return
+            offset = 0
+            with self.lock:
+                while offset < len(data):
+                    wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                    offset += INOTIFY_EVENT.size
+                    name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                    offset += length
+                    self._handle_event(wd, mask, name)
+    
+    async def _scan_pending(self):
+        """Scan queued new directories in a worker thread, watching each subtree."""
+        while self.pending and self.fd is not None:
+            directory = self.pending.pop()
+            found, ok, _ = await asyncio.to_thread(self._scan_and_watch, directory)
+            with self.lock:
+                for f in found:
+                    self._added(f)
+            if not ok:
+                logger.warning("File watch limit reached, falling back to polling")
+                self.stop()
+                self.last_scan = 0.0
+                return
+    
+    def _handle_event(self, wd: int, mask: int, name: str):
+        if mask & IN_Q_OVERFLOW:
+            # Events were lost - resync on next query
+            self.last_scan = 0.0
+            if self.on_change:
+                self.on_change(None)
+            return
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+        directory = self.watches.get(wd)
+        if directory is None or not name:
+            return
+        path = os.path.join(directory, name)
+        if self.on_change:
+            self.on_change(path)
+        
+        if name == '.gitignore':
+            # Ignore rules changed - resync on next query
+            self.last_scan = 0.0
+            return
+        if self.ignore.is_ignored(self._relative(path), bool(mask & IN_ISDIR)):
+            return
+        
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                # Pick up files created before the watch was in place, off the event loop
+                self.pending.add(path)
+                if self.scanning is None or self.scanning.done():
+                    self.scanning = asyncio.get_running_loop().create_task(self._scan_pending())
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                prefix = path + os.sep
+                for f in [f for f in self.paths if f.startswith(prefix)]:
+                    self._removed(f)
+                # A moved directory's watches would keep reporting under this old path
+                self._remove_watches(lambda d: d == path or d.startswith(prefix))
+                self.pending = {d for d in self.pending if d != path and not d.startswith(prefix)}
+            return
+        
+        if mask & (IN_CREATE | IN_MOVED_TO | IN_CLOSE_WRITE):
+            self._added(path)
+            self.touched.add(path)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            self._removed(path)
+    
+    async def refresh(self, force: bool = False):
+        """Bring the index up to date (drain events, or rescan when polling)."""
+        if self.watching and self.last_scan:
+            self._drain()
+            if self.scanning:
+                await asyncio.wait([self.scanning])
+            if self.watching:
+                return
+        if not force and time.monotonic() - self.last_scan < FILE_INDEX_POLL_INTERVAL:
+            return
+        if self.watching:
+            # Resync after lost events or changed ignore rules: rebuild the watch set too,
+            # so directories created meanwhile or no longer ignored are watched from now on
+            self.last_scan = time.monotonic()  # Cleared again if events are lost during the scan
+            current, ok, directories = await asyncio.to_thread(self._scan_and_watch, self.root)
+            if not ok:
+                logger.warning("File watch limit reached, falling back to polling")
+                self.stop()
+                self.last_scan = 0.0
+            elif self.fd is not None:
+                self._remove_watches(lambda d: d not in directories)
+        else:
+            current = await asyncio.to_thread(walk_workspace, self.root, self.ignore)
+            self.last_scan = time.monotonic()
+        with self.lock:
+            for path in self.paths - current:
+                self._removed(path)
+            for path in current - self.paths:
+                self._added(path)
+    
+    def mark(self):
+        """Start tracking changes from now."""
+        with self.lock:
+            self.created.clear()
+            self.deleted.clear()
+            self.touched.clear()
+    
+    def files(self, extensions: List[str] = None) -> List[str]:
+        """Indexed files, optionally filtered by extension."""
+        with self.lock:
+            paths = list(self.paths)
+        if extensions:
+            suffixes = frozenset(extensions)
+            paths = [p for p in paths if os.path.splitext(p)[1] in suffixes]
+        return sorted(paths)
+    
+    def changes(self, extensions: List[str] = None) -> dict:
+        """Files created, modified and deleted since mark().
+        
+        With inotify only written paths are checked; when polling every
+        indexed file is stat'ed against the snapshot. Blocking - run in a
+        worker thread.
+        """
+        with self.lock:
+            created = set(self.created)
+            deleted = set(self.deleted)
+            candidates = (self.touched if self.watching else self.paths) - created
+        
+        suffixes = frozenset(extensions) if extensions else None
+        
+        def wanted(path: str) -> bool:
+            return suffixes is None or os.path.splitext(path)[1] in suffixes
+        
+        modified = []
+        for path in candidates:
+            if wanted(path) and self.snapshot.changed(path):
+                modified.append(path)
+        created = [p for p in created if wanted(p) and os.path.exists(p)]
+        self.snapshot.record(created)
+        for path in deleted:
+            self.snapshot.forget(path)
+        
+        return {
+            "created": sorted(created),
+            "modified": sorted(modified),
+            "deleted": sorted(p for p in deleted if wanted(p))
+        }
+
+
+class FileIdCache:
+    """Persistent map of (content hash, kind, file name) to Telegram file_id.
+    
+    Telegram lets a file that was uploaded once be sent again by file_id, so
+    identical artifacts are never uploaded twice, even across restarts. At
+    most FILE_ID_CACHE_SIZE entries are kept, least recently used first out,
+    so the file and each save stay small.
+    """
+    
+    def __init__(self, path: str = None, size: int = None):
+        self.path = path or FILE_ID_CACHE_PATH
+        self.size = FILE_ID_CACHE_SIZE if size is None else size
+        self.ids: OrderedDict = OrderedDict()  # Key -> file_id, least recently used first
+        self.save_lock = threading.Lock()  # Saves run in worker threads and share the .tmp file
+        try:
+            with open(self.path, 'r') as f:
+                self.ids = OrderedDict(json.load(f))
+            self._evict()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Could not load file_id cache: {e}")
+    
+    @staticmethod
+    def key(digest: str, kind: str, name: str) -> str:
+        return f"{kind}:{digest}:{name}"
+    
+    def get(self, digest: str, kind: str, name: str) -> Optional[str]:
+        key = self.key(digest, kind, name)
+        file_id = self.ids.get(key)
+        if file_id is not None:
+            self.ids.move_to_end(key)
+        return file_id
+    
+    def set(self, digest: str, kind: str, name: str, file_id: str):
+        """Record a file_id in memory; call save() to persist."""
+        key = self.key(digest, kind, name)
+        self.ids[key] = file_id
+        self.ids.move_to_end(key)
+        self._evict()
+    
+    def _evict(self):
+        while len(self.ids) > max(self.size, 0):
+            self.ids.popitem(last=False)
+    
+    async def put(self, digest: str, kind: str, name: str, file_id: str):
+        self.set(digest, kind, name, file_id)
+        await self.save()
+    
+    async def save(self):
+        await asyncio.to_thread(self._save)
+    
+    async def forget(self, digest: str, kind: str, name: str):
+        if self.ids.pop(self.key(digest, kind, name), None):
+            await asyncio.to_thread(self._save)
+    
+    def _save(self):
+        """Write atomically so a crash never leaves a truncated cache.
+        
+        Saves are serialized; each writes a fresh snapshot, so the last one
+        to finish holds every file_id recorded before it started.
+        """
+        try:
+            with self.save_lock:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp = self.path + ".tmp"
+                with open(tmp, 'w') as f:
+                    json.dump(dict(self.ids), f)
+                os.replace(tmp, self.path)
+        except Exception as e:
+            logger.warning(f"Could not save file_id cache: {e}")
+
+
+class TurnStore:
+    """SQLite history of every Cline turn, searchable with FTS5.
+    
+    Each turn's prompt, cleaned output, timings, task ID, workspace and
+    changed files go into BRIDGE_STATE_DIR/turns.db (WAL mode, so reads never
+    wait on the writer). /tasks, /search and /resume answer from it instead
+    of asking Cline. Queries run in a worker thread; the store disables
+    itself if the database cannot be opened.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS turns (
+            id INTEGER PRIMARY KEY,
+            task_id TEXT,
+            workspace TEXT NOT NULL,
+            source TEXT NOT NULL,
+            model TEXT,
+            prompt TEXT NOT NULL,
+            output TEXT NOT NULL,
+            files TEXT NOT NULL,
+            started_at REAL NOT NULL,
+            duration REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS turns_task ON turns (task_id, id);
+        CREATE INDEX IF NOT EXISTS turns_workspace ON turns (workspace, id);
+    """
+    FTS_SCHEMA = """
+        CREATE VIRTUAL TABLE IF NOT EXISTS turns_fts USING fts5(
+            prompt, output, content='turns', content_rowid='id'
+        );
+        CREATE TRIGGER IF NOT EXISTS turns_fts_insert AFTER INSERT ON turns BEGIN
+            INSERT INTO turns_fts (rowid, prompt, output) VALUES (new.id, new.prompt, new.output);
+        END;
+        CREATE TRIGGER IF NOT EXISTS turns_fts_delete AFTER DELETE ON turns BEGIN
+            INSERT INTO turns_fts (turns_fts, rowid, prompt, output) VALUES ('delete', old.id, old.prompt, old.output);
+        END;
+    """
+    
+    def __init__(self, path: str = None):
+        self.path = path or TURN_DB_PATH
+        self.lock = threading.Lock()  # One connection shared by the worker threads
+        self.db: Optional[sqlite3.Connection] = None
+        self.fts = False
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self.db.row_factory = sqlite3.Row
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")  # Durable enough for a history, no fsync per turn
+            self.db.executescript(self.SCHEMA)
+        except sqlite3.Error as e:
+            logger.warning(f"Turn history disabled, could not open {self.path}: {e}")
+            self.db = None
+            return
+        try:
+            self.db.executescript(self.FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError as e:
+            logger.info(f"SQLite has no FTS5 ({e}), /search falls back to substring matching")
+    
+    def _run(self, func: Callable, *args):
+        if self.db is None:
+            return None
+        with self.lock:
+            try:
+                return func(*args)
+            except sqlite3.Error as e:
+                logger.warning(f"Turn history query failed: {e}")
+                return None
+    
+    @staticmethod
+    def transcript(store: Optional[OutputStore]) -> str:
+        """The turn's cleaned output, head and tail only when it is very long."""
+        if not store:
+            return ""
+        if store.memory is not None and store.size <= TURN_OUTPUT_CHARS:
+            return store.text()
+        return f"{store.head(OUTPUT_HEAD_CHARS)}\n…\n{store.tail(OUTPUT_TAIL_CHARS)}"
+    
+    async def record(self, session: ClineSession, source: str, prompt: str, task_id: Optional[str],
+                     started_at: float, changes: dict = None):
+        files = {key: [os.path.relpath(f, session.working_dir) for f in (changes or {}).get(key, [])]
+                 for key in ("created", "modified", "deleted")}
+        row = (
+            task_id, session.working_dir, source, session.model, prompt,
+            self.transcript(session.last_output), json.dumps(files),
+            started_at, time.time() - started_at,
+        )
+        await asyncio.to_thread(self._run, self._insert, row)
+    
+    def _insert(self, row: tuple):
+        self.db.execute(
+            "INSERT INTO turns (task_id, workspace, source, model, prompt, output, files, started_at, duration)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row
+        )
+    
+    async def tasks(self, workspace: str = None, limit: int = 20) -> List[sqlite3.Row]:
+        """Most recently active tasks: task_id, workspace, model, turns, first prompt, last activity."""
+        return await asyncio.to_thread(self._run, self._tasks, workspace, limit) or []
+    
+    def _tasks(self, workspace: Optional[str], limit: int) -> List[sqlite3.Row]:
+        where = "task_id IS NOT NULL" + (" AND workspace = ?" if workspace else "")
+        params = (workspace, limit) if workspace else (limit,)
+        return self.db.execute(f"""
+            SELECT task_id, workspace, model, COUNT(*) AS turns, MAX(started_at) AS last_at,
+                   (SELECT prompt FROM turns first WHERE first.task_id = turns.task_id ORDER BY id LIMIT 1) AS prompt
+            FROM turns WHERE {where}
+            GROUP BY task_id ORDER BY MAX(id) DESC LIMIT ?
+        """, params).fetchall()
+    
+    async def task(self, task_id: str) -> Optional[sqlite3.Row]:
+        """The latest turn of a task, or None when it was never recorded."""
+        return await asyncio.to_thread(self._run, self._task, task_id)
+    
+    def _task(self, task_id: str) -> Optional[sqlite3.Row]:
+        return self.db.execute(
+            "SELECT task_id, workspace, model, prompt, started_at FROM turns WHERE task_id = ? ORDER BY id DESC LIMIT 1",
+            (task_id,)
+        ).fetchone()
+    
+    async def search(self, query: str, limit: int = 10) -> List[sqlite3.Row]:
+        """Best matching turns: id, task_id, workspace, started_at, prompt, snippet."""
+        return await asyncio.to_thread(self._run, self._search, query, limit) or []
+    
+    def _search(self, query: str, limit: int) -> List[sqlite3.Row]:
+        if self.fts:
+            # Every word quoted, so user text is never read as FTS syntax
+            match = " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+            return self.db.execute("""
+                SELECT turns.id, turns.task_id, turns.workspace, turns.started_at, turns.prompt,
+                       snippet(turns_fts, -1, '[', ']', '…', 12) AS snippet
+                FROM turns_fts JOIN turns ON turns.id = turns_fts.rowid
+                WHERE turns_fts MATCH ? ORDER BY bm25(turns_fts) LIMIT ?
+            """, (match, limit)).fetchall()
+        pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        return self.db.execute("""
+            SELECT id, task_id, workspace, started_at, prompt, substr(output, 1, 120) AS snippet
+            FROM turns WHERE prompt LIKE ?1 ESCAPE '\\' OR output LIKE ?1 ESCAPE '\\'
+            ORDER BY id DESC LIMIT ?2
+        """, (pattern, limit)).fetchall()
+    
+    def close(self):
+        if self.db is not None:
+            with self.lock:
+                self.db.close()
+                self.db = None
+
+
+TOKEN_APPROX_RE = re.compile(r'\w{1,4}|[^\w\s]')  # ~BPE granularity: word pieces of up to 4 chars
+DATE_HEADING_RE = re.compile(r'^#+\s*(\d{4}-\d{2}-\d{2})')
+PRIORITY_HEADING_RE = re.compile(r'rule|instruction|identity|preference|important|style|note', re.I)
+
+
+def approx_token_count(text: str) -> int:
+    """Dependency-free token estimate."""
+    return len(TOKEN_APPROX_RE.findall(text))
+
 
-# Silence httpx INFO logs (they're very verbose)
-logging.getLogger("httpx").setLevel(logging.WARNING)
-logging.getLogger("httpcore").setLevel(logging.WARNING)
-logging.getLogger("telegram.ext.Application").setLevel(logging.WARNING)
-logging.getLogger("telegram.ext.Updater").setLevel(logging.WARNING)
+def load_tokenizer(name: str = None) -> Callable[[str], int]:
+    """Token counter: approx, tiktoken, auto (tiktoken if installed) or a module:function path."""
+    name = name or CONTEXT_TOKENIZER
+    if ':' in name:
+        module, _, attr = name.partition(':')
+        try:
+            return getattr(importlib.import_module(module), attr)
+        except Exception as e:
+            logger.warning(f"Could not load tokenizer {name}, using estimate: {e}")
+            return approx_token_count
+    if name in ("auto", "tiktoken") and tiktoken is not None:
+        try:
+            encoding = tiktoken.get_encoding(CONTEXT_TIKTOKEN_ENCODING)
+            return lambda text: len(encoding.encode(text, disallowed_special=()))
+        except Exception as e:
+            logger.warning(f"tiktoken unavailable, using estimate: {e}")
+    elif name == "tiktoken":
+        logger.warning("tiktoken is not installed, using token estimate")
+    return approx_token_count
 
 
-class ClineSession:
-    """Manages Cline execution with persistent session support."""
+class ContextAssembler:
+    """Fits whole Markdown sections of the context files into a token budget.
     
-    def __init__(self, working_dir: str = None, model: str = None):
-        self.lock = asyncio.Lock()
-        self.working_dir = working_dir or CLINE_WORKING_DIR
-        self.model = model or CLINE_MODEL
-        self.task_id = None  # For resuming tasks
-        self.process = None  # Persistent Cline process
-        self.reader_task = None
-        self.output_buffer = ""
-        self.session_active = False
-        self.total_tokens = 0
-        self.messages_sent = 0
-        self.session_start_time = None
+    Sections are ranked (file intros, rule/preference style headings and the
+    most recent dated entries first), added greedily while they fit, and
+    emitted in their original order. Nothing is cut mid-line.
+    """
     
-    def is_alive(self) -> bool:
-        """Check if Cline process is running."""
-        return self.process is not None and self.process.returncode is None
+    def __init__(self, count_tokens: Callable[[str], int] = None, budget: int = None):
+        self.count_tokens = count_tokens or load_tokenizer()
+        self.budget = CONTEXT_TOKEN_BUDGET if budget is None else budget
     
-    def get_stats(self) -> dict:
-        """Get session statistics."""
-        import time
-        uptime = 0
-        if self.session_start_time:
-            uptime = int(time.time() - self.session_start_time)
+    @staticmethod
+    def split_sections(text: str) -> List[str]:
+        """Split Markdown at headings; text before the first heading is its own section."""
+        sections, current = [], []
+        for line in text.splitlines():
+            if line.startswith('#') and current:
+                sections.append('\n'.join(current).strip())
+                current = []
+            current.append(line)
+        if current:
+            sections.append('\n'.join(current).strip())
+        return [section for section in sections if section]
+    
+    @staticmethod
+    def score(position: int, section: str, dates: List[str]) -> float:
+        heading = section.split('\n', 1)[0]
+        score = 2.0 if position == 0 else 1.0 - 0.02 * position
+        if PRIORITY_HEADING_RE.search(heading):
+            score += 0.5
+        date = DATE_HEADING_RE.match(heading)
+        if date:
+            # Newest dated entry gets the full bonus
+            score += 0.5 * (dates.index(date.group(1)) + 1) / len(dates)
+        return score
+    
+    def fit_lines(self, section: str, budget: int) -> str:
+        """Leading whole lines of a section that fit the budget."""
+        kept = []
+        used = 0
+        for line in section.split('\n'):
+            cost = self.count_tokens(line + '\n')
+            if used + cost > budget:
+                break
+            kept.append(line)
+            used += cost
+        return '\n'.join(kept) if len(kept) > 1 else ""
+    
+    def assemble(self, sources: List[Tuple[str, str]]) -> str:
+        """Build the preamble from (header, file text) pairs."""
+        candidates = []
+        for file_number, (header, text) in enumerate(sources):
+            sections = self.split_sections(text)
+            dates = sorted(m.group(1) for m in (DATE_HEADING_RE.match(s) for s in sections) if m)
+            for position, section in enumerate(sections):
+                candidates.append((self.score(position, section, dates), file_number, position, section))
         
-        return {
-            "active": self.is_alive(),
-            "task_id": self.task_id,
-            "tokens": self.total_tokens,
-            "messages": self.messages_sent,
-            "uptime_seconds": uptime,
-            "model": self.model,
-            "working_dir": self.working_dir
-        }
+        remaining = self.budget - sum(self.count_tokens(f"\n\n{header}\n") for header, _ in sources)
+        chosen = {}
+        for _, file_number, position, section in sorted(candidates, key=lambda c: -c[0]):
+            cost = self.count_tokens(section + '\n\n')
+            if cost > remaining:
+                section = self.fit_lines(section, remaining)
+                if not section:
+                    continue
+                cost = self.count_tokens(section + '\n\n')
+            chosen[(file_number, position)] = section
+            remaining -= cost
+        
+        context_preamble = ""
+        for file_number, (header, _) in enumerate(sources):
+            parts = [chosen[key] for key in sorted(chosen) if key[0] == file_number]
+            if parts:
+                context_preamble += f"\n\n{header}\n" + '\n\n'.join(parts)
+        return context_preamble
+
+
+CONTEXT_FILES = (
+    ("CLINE_MEMORY.md", "[MEMORY CONTEXT - Read this first:]"),
+    ("CLINE_AGENTS.md", "[AGENT INSTRUCTIONS:]"),
+)
+
+
+class ContextCache:
+    """Prebuilt context preamble per working directory.
     
-    async def start_interactive(self) -> bool:
-        """Start Cline in interactive mode for persistent session."""
+    Source files are keyed by (mtime_ns, size) and only re-read when that
+    changes. When the file index watches the directory, the preamble is
+    served without touching the disk until a notification invalidates it.
+    """
+    
+    def __init__(self, assembler: ContextAssembler = None):
+        self.assembler = assembler or ContextAssembler()
+        self.entries: Dict[str, Tuple[tuple, str]] = {}  # Working dir -> (source keys, preamble)
+        self.valid: set = set()  # Working dirs known current through file notifications
+    
+    def invalidate(self, path: Optional[str] = None):
+        """Called by the file index for changed paths (None drops everything)."""
+        if path is None:
+            self.valid.clear()
+        elif os.path.basename(path) in (name for name, _ in CONTEXT_FILES):
+            self.valid.discard(os.path.realpath(os.path.dirname(path)))
+    
+    @staticmethod
+    def source_key(path: str) -> Optional[tuple]:
         try:
-            cmd = [CLINE_PATH]
-            if CLINE_YOLO:
-                cmd.append("--yolo")
-            cmd.extend(["--model", self.model])
-            cmd.extend(["--cwd", self.working_dir])
-            
-            logger.info(f"Starting Cline interactive: {' '.join(cmd[:4])}")
-            
-            self.process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdin=asyncio.subprocess.PIPE,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                cwd=self.working_dir
-            )
-            self.session_active = True
-            self.session_start_time = time.time() if 'time' in dir() else 0
-            import time
-            self.session_start_time = time.time()
-            
-            logger.info("Cline interactive session started")
-            return True
-        except Exception as e:
-            logger.error(f"Failed to start Cline: {e}")
-            return False
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
     
-    async def stop(self):
-        """Stop the Cline process."""
-        if self.process:
+    def load(self, working_dir: str) -> Tuple[tuple, str]:
+        """Rebuild the preamble if a source file changed. Blocking - run in a worker thread."""
+        keys = tuple(self.source_key(os.path.join(working_dir, name)) for name, _ in CONTEXT_FILES)
+        cached = self.entries.get(working_dir)
+        if cached and cached[0] == keys:
+            return cached
+        
+        sources = []
+        for (name, header), key in zip(CONTEXT_FILES, keys):
+            if key is None:
+                continue
             try:
-                self.process.terminate()
-                await asyncio.wait_for(self.process.wait(), timeout=5)
-            except:
-                try:
-                    self.process.kill()
-                except:
-                    pass
-        self.process = None
-        self.session_active = False
+                with open(os.path.join(working_dir, name), 'r') as f:
+                    sources.append((header, f.read()))
+            except Exception:
+                pass
+        
+        self.entries[working_dir] = (keys, self.assembler.assemble(sources))
+        return self.entries[working_dir]
     
-    def restart(self) -> str:
-        """Reset session state."""
-        self.task_id = None
-        self.total_tokens = 0
-        self.messages_sent = 0
-        return "Cline session reset. Next message will start fresh."
+    async def get(self, working_dir: str, watched: bool = False) -> Tuple[tuple, str]:
+        """Current (source keys, preamble) for a working directory."""
+        working_dir = os.path.realpath(working_dir)  # Same key as the paths invalidate() sees
+        if watched and working_dir in self.valid and working_dir in self.entries:
+            return self.entries[working_dir]
+        if watched:
+            # Marked first so a change during the load invalidates it again
+            self.valid.add(working_dir)
+        return await asyncio.to_thread(self.load, working_dir)
+
+
+class TelegramClineBridge:
+    """Bridge between Telegram and Cline."""
+    
+    def __init__(self):
+        self.pool = ClinePool()
+        self.sessions = SessionRegistry(self.pool)
+        self.scheduler = TelegramScheduler()
+        self.file_ids = FileIdCache()
+        self.turns = TurnStore()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None  # Set once the bot is running
+        self.context_cache = ContextCache()
+        self.pagers: OrderedDict = OrderedDict()  # Pager ID -> Pager behind "More" buttons, oldest first
+        self.pager_ids = itertools.count(1)
+    
+    def session_for(self, chat_id: Optional[int] = None) -> "ClineSession":
+        """The session for a chat's current workspace (None for the terminal)."""
+        return self.sessions.get(chat_id)
+    
+    async def refresh_file_index(self, session: ClineSession) -> FileIndex:
+        """Make sure the file index follows the working directory and is current."""
+        if session.file_index is None or session.file_index.root != session.working_dir:
+            if session.file_index:
+                session.file_index.stop()
+            session.file_index = FileIndex(session.working_dir, on_change=self.context_cache.invalidate)
+            await session.file_index.start()
+        else:
+            await session.file_index.refresh()
+        return session.file_index
+    
+    def scan_files(self, session: ClineSession, extensions: List[str] = None) -> List[str]:
+        """List files in the working directory, from the index when it is built."""
+        if extensions is None:
+            extensions = DEFAULT_EXTENSIONS
+        
+        if session.file_index and session.file_index.root == session.working_dir:
+            return session.file_index.files(extensions)
+        
+        return sorted(walk_workspace(session.working_dir, extensions=extensions))
+    
+    async def get_file_changes(self, session: ClineSession, extensions: List[str] = None) -> dict:
+        """Find files created, modified or deleted since last check."""
+        index = await self.refresh_file_index(session)
+        if not index.watching:
+            await index.refresh(force=True)
+        changes = await asyncio.to_thread(index.changes, extensions or DEFAULT_EXTENSIONS)
+        index.mark()
+        return changes
+    
+    async def track_current_files(self, session: ClineSession):
+        """Remember current files to detect changes later."""
+        index = await self.refresh_file_index(session)
+        if not index.watching:
+            await index.refresh(force=True)
+            # Without events every file is a candidate, so record what it looks like now
+            await asyncio.to_thread(index.snapshot.record, index.files(DEFAULT_EXTENSIONS))
+        index.mark()
+    
+    def file_digest(self, file_path: str) -> str:
+        """Content hash of a file, cached by the file index when it covers the path."""
+        for session in self.sessions.all():
+            index = session.file_index
+            if index and file_path.startswith(index.root + os.sep):
+                return index.snapshot.digest(file_path)
+        return FileSnapshot.hash_file(file_path)
     
     @staticmethod
-    def clean_output(text: str) -> str:
-        """Remove ANSI escape sequences and clean up output."""
-        if not text:
-            return ""
+    def media_kind(file_path: str) -> Tuple[str, str]:
+        """Return (photo|document, caption) for a file."""
+        ext = os.path.splitext(file_path)[1].lower()
+        file_name = os.path.basename(file_path)
+        
+        # Images - send as photo, code and other files as document
+        if ext in IMAGE_EXTENSIONS:
+            return "photo", f"📷 `{file_name}`"
+        if ext in CODE_EXTENSIONS:
+            return "document", f"📄 `{file_name}`"
+        return "document", f"📁 `{file_name}`"
+    
+    @staticmethod
+    def read_file(file_path: str) -> bytes:
+        with open(file_path, 'rb') as f:
+            return f.read()
+    
+    async def send_file(self, message, file_path: str):
+        """Reply with a file, reusing its Telegram file_id if this content was sent before."""
+        file_name = os.path.basename(file_path)
+        kind, caption = self.media_kind(file_path)
+        send = message.reply_photo if kind == "photo" else message.reply_document
+        
+        digest = await asyncio.to_thread(self.file_digest, file_path)
+        file_id = self.file_ids.get(digest, kind, file_name)
+        if file_id:
+            try:
+                await self.scheduler.call(message.chat_id, send, **{kind: file_id}, caption=caption, parse_mode="Markdown")
+                return
+            except BadRequest as e:
+                logger.warning(f"Cached file_id rejected for {file_name}, uploading again: {e}")
+                await self.file_ids.forget(digest, kind, file_name)
         
-        # Remove ANSI escape sequences
-        ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-        text = ansi_escape.sub('', text)
+        data = await asyncio.to_thread(self.read_file, file_path)
+        sent = await self.scheduler.call(
+            message.chat_id, send,
+            **{kind: InputFile(data, filename=file_name)},
+            caption=caption,
+            parse_mode="Markdown"
+        )
         
-        # Remove cursor movement codes
-        cursor_codes = re.compile(r'\x1b\[[0-9;]*[A-Za-z]')
-        text = cursor_codes.sub('', text)
+        file_id = sent.photo[-1].file_id if kind == "photo" else sent.document.file_id
+        await self.file_ids.put(digest, kind, file_name, file_id)
+    
+    async def send_media_group(self, message, file_paths: List[str]):
+        """Send 2-10 files of the same kind as one media group."""
+        media = []
+        entries = []
+        for file_path in file_paths:
+            file_name = os.path.basename(file_path)
+            kind, caption = self.media_kind(file_path)
+            digest = await asyncio.to_thread(self.file_digest, file_path)
+            file_id = self.file_ids.get(digest, kind, file_name)
+            source = file_id or InputFile(await asyncio.to_thread(self.read_file, file_path), filename=file_name)
+            media_class = InputMediaPhoto if kind == "photo" else InputMediaDocument
+            media.append(media_class(media=source, caption=caption, parse_mode="Markdown"))
+            entries.append((digest, kind, file_name, file_id))
         
-        # Remove screen clearing codes
-        text = re.sub(r'\x1b\[2J', '', text)
-        text = re.sub(r'\x1b\[H', '', text)
+        sent = await self.scheduler.call(message.chat_id, message.reply_media_group, media=media)
         
-        # Remove other control characters but keep newlines
-        text = re.sub(r'[\x00-\x09\x0b\x0c\x0e-\x1f]', '', text)
+        for msg, (digest, kind, file_name, cached) in zip(sent, entries):
+            if not cached:
+                file_id = msg.photo[-1].file_id if kind == "photo" else msg.document.file_id
+                self.file_ids.set(digest, kind, file_name, file_id)
+        await self.file_ids.save()
+    
+    async def send_files(self, message, file_paths: List[str]) -> List[Tuple[str, str]]:
+        """Send files with bounded concurrency, batching photos and documents into media groups.
         
-        # Strip excessive blank lines
-        text = re.sub(r'\n{3,}', '\n\n', text)
+        Returns (path, reason) for every file that could not be sent.
+        """
+        failed = []
+        photos, documents = [], []
+        for file_path in file_paths:
+            try:
+                # Skip large files (> 50MB)
+                file_size = os.path.getsize(file_path)
+            except OSError as e:
+                failed.append((file_path, str(e)))
+                continue
+            if file_size > TELEGRAM_UPLOAD_LIMIT:
+                failed.append((file_path, f"too large ({file_size // (1024*1024)}MB)"))
+                continue
+            kind, _ = self.media_kind(file_path)
+            (photos if kind == "photo" else documents).append(file_path)
         
-        # Remove lines that are just UI decorations
-        lines = text.split('\n')
-        cleaned_lines = []
-        for line in lines:
-            # Skip lines that are mostly special characters (UI borders)
-            stripped = line.strip()
-            if stripped and not all(c in '─│┌┐└┘├┤┬┴┼═║╔╗╚╝╠╣╦╩╬─━│┃┄┅┆┇┈┉┊┋' for c in stripped):
-                cleaned_lines.append(line)
+        batches = [group[i:i + TELEGRAM_MEDIA_GROUP_SIZE]
+                   for group in (photos, documents)
+                   for i in range(0, len(group), TELEGRAM_MEDIA_GROUP_SIZE)]
+        semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
         
-        text = '\n'.join(cleaned_lines)
+        async def send_one(file_path: str):
+            try:
+                await self.send_file(message, file_path)
+                logger.info(f"Sent file: {os.path.basename(file_path)}")
+            except Exception as e:
+                logger.error(f"Failed to send file {file_path}: {e}")
+                failed.append((file_path, str(e)))
         
-        # Truncate if too long for Telegram (4000 char limit)
-        if len(text) > 4000:
-            text = text[:3997] + "..."
+        async def deliver(batch: List[str]):
+            async with semaphore:
+                if len(batch) == 1:
+                    await send_one(batch[0])
+                    return
+                try:
+                    await self.send_media_group(message, batch)
+                    logger.info(f"Sent media group of {len(batch)} files")
+                except Exception as e:
+                    # One bad item fails the whole group - retry the files one by one
+                    logger.warning(f"Media group failed, sending files individually: {e}")
+                    for file_path in batch:
+                        await send_one(file_path)
         
-        return text.strip()
-
-
-class TelegramClineBridge:
-    """Bridge between Telegram and Cline."""
+        await asyncio.gather(*(deliver(batch) for batch in batches))
+        return failed
     
-    def __init__(self):
-        self.cline = ClineSession()
-        self.tracked_files: set = set()  # Track files before/after
+    def should_bundle(self, file_paths: List[str]) -> bool:
+        """Whether changed files should go out as one archive instead of one by one."""
+        if len(file_paths) > BUNDLE_MIN_FILES:
+            return True
+        total = 0
+        for file_path in file_paths:
+            try:
+                total += os.path.getsize(file_path)
+            except OSError:
+                pass
+        return total > BUNDLE_MIN_BYTES
     
-    def scan_files(self, extensions: List[str] = None) -> List[str]:
-        """Scan working directory for files."""
-        if extensions is None:
-            extensions = ['.html', '.css', '.js', '.py', '.json', '.md', '.txt', '.png', '.jpg', '.gif']
+    def build_bundles(self, file_paths: List[str], root: str) -> Tuple[list, list]:
+        """Zip files into spooled temp files, starting a new part before the upload limit.
+        
+        Returns ([(archive, file_count)], [(path, reason)]). Blocking - run in a worker thread.
+        """
+        parts, failed = [], []
+        spool = archive = None
+        count = 0
+        
+        for file_path in file_paths:
+            try:
+                size = os.path.getsize(file_path)
+            except OSError as e:
+                failed.append((file_path, str(e)))
+                continue
+            if size > TELEGRAM_UPLOAD_LIMIT:
+                failed.append((file_path, f"too large ({size // (1024*1024)}MB)"))
+                continue
+            
+            # Leave room for compression overhead and the central directory
+            if archive and spool.tell() + size > TELEGRAM_UPLOAD_LIMIT - 1024 * 1024:
+                archive.close()
+                parts.append((spool, count))
+                archive = None
+            if archive is None:
+                spool = tempfile.SpooledTemporaryFile(max_size=BUNDLE_SPOOL_BYTES)
+                archive = zipfile.ZipFile(spool, 'w', compression=zipfile.ZIP_DEFLATED)
+                count = 0
+            
+            if file_path.startswith(root + os.sep):
+                arcname = os.path.relpath(file_path, root)
+            else:
+                arcname = os.path.basename(file_path)
+            try:
+                # ZipFile.write streams the file in blocks
+                archive.write(file_path, arcname)
+                count += 1
+            except OSError as e:
+                failed.append((file_path, str(e)))
         
-        files = []
-        for ext in extensions:
-            pattern = os.path.join(self.cline.working_dir, f'**/*{ext}')
-            files.extend(glob.glob(pattern, recursive=True))
+        if archive:
+            archive.close()
+            parts.append((spool, count))
+        return parts, failed
+    
+    async def send_bundle(self, message, file_paths: List[str], root: str) -> List[Tuple[str, str]]:
+        """Send files as zip archive(s), named relative to root. Returns (path, reason) for files left out."""
+        parts, failed = await asyncio.to_thread(self.build_bundles, file_paths, root)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        
+        for number, (spool, count) in enumerate(parts, 1):
+            name = f"cline-files-{stamp}.zip" if len(parts) == 1 else f"cline-files-{stamp}-part{number}.zip"
+            try:
+                spool.seek(0)
+                # InputFile reads the whole file when constructed
+                document = await asyncio.to_thread(InputFile, spool, filename=name)
+                await self.scheduler.call(
+                    message.chat_id, message.reply_document,
+                    document=document,
+                    caption=f"🗜 `{name}` - {count} files",
+                    parse_mode="Markdown"
+                )
+                logger.info(f"Sent bundle {name} with {count} files")
+            except Exception as e:
+                logger.error(f"Failed to send bundle {name}: {e}")
+                failed.append((name, str(e)))
+            finally:
+                spool.close()
         
-        return sorted(files)
+        return failed
+    
+    def register_pager(self, pager: Pager) -> int:
+        """Keep a pager for its buttons, dropping the oldest beyond PAGER_CACHE_SIZE."""
+        pager_id = next(self.pager_ids)
+        self.pagers[pager_id] = pager
+        while len(self.pagers) > PAGER_CACHE_SIZE:
+            self.pagers.popitem(last=False)
+        return pager_id
     
-    def get_new_files(self, extensions: List[str] = None) -> List[str]:
-        """Find files that were created since last check."""
-        current = set(self.scan_files(extensions))
-        new = current - self.tracked_files
-        self.tracked_files = current
-        return sorted(list(new))
+    def page_buttons(self, pager_id: int, following: Optional[int]) -> InlineKeyboardMarkup:
+        """"More" (when there is a next page) and "Full log" buttons."""
+        buttons = []
+        if following is not None:
+            number = self.pagers[pager_id].numbers[following]
+            buttons.append(InlineKeyboardButton(f"⬇️ More (page {number})", callback_data=f"more:{pager_id}:{following}"))
+        buttons.append(InlineKeyboardButton("📜 Full log", callback_data=f"log:{pager_id}"))
+        return InlineKeyboardMarkup([buttons])
+    
+    async def reply_output(self, message, text: str, footer_html: str = "", footer_plain: str = "", reply_markup=None):
+        """Reply with Cline output rendered as HTML, resent as plain text if Telegram still rejects it."""
+        try:
+            return await self.scheduler.call(
+                message.chat_id, message.reply_text, render_html(text) + footer_html,
+                parse_mode="HTML", reply_markup=reply_markup
+            )
+        except BadRequest as e:
+            if "entit" not in str(e).lower() and "parse" not in str(e).lower():
+                raise
+            logger.warning(f"Reply rejected as HTML, sending plain text: {e}")
+            return await self.scheduler.call(
+                message.chat_id, message.reply_text, text + footer_plain, reply_markup=reply_markup
+            )
     
-    def track_current_files(self):
-        """Remember current files to detect new ones later."""
-        self.tracked_files = set(self.scan_files())
+    async def send_transcript(self, message, store: Optional[OutputStore]):
+        """Reply with a turn's full transcript as a document."""
+        if not store or not store.size:
+            await message.reply_text("📜 No output yet in this workspace.")
+            return
+        if not store.complete:
+            await message.reply_text("❌ The full transcript could not be kept (log not writable).")
+            return
+        
+        if store.path:
+            if not os.path.exists(store.path):
+                await message.reply_text("❌ This transcript's log has been pruned (see OUTPUT_LOG_KEEP).")
+                return
+            if os.path.getsize(store.path) > TELEGRAM_UPLOAD_LIMIT:
+                await message.reply_text(f"❌ Transcript too large to send. It is at `{store.path}`", parse_mode="Markdown")
+                return
+            data = await asyncio.to_thread(self.read_file, store.path)
+            document = InputFile(data, filename=os.path.basename(store.path))
+        else:
+            document = InputFile(store.text().encode('utf-8'), filename=f"cline-{store.name}.log")
+        
+        await self.scheduler.call(
+            message.chat_id, message.reply_document,
+            document=document,
+            caption=f"📜 Full transcript - {store.line_count} lines"
+        )
     
-    async def send_to_cline(self, message: str, chat_id: int = None, context = None, stream_message_id: int = None) -> tuple:
+    async def send_to_cline(self, session: ClineSession, message: str, chat_id: int = None, context = None,
+                            stream_message_id: int = None, on_text: Callable[[str], None] = None) -> tuple:
         """Send a message to Cline and return (response, task_id, message_id).
         
-        Streams output in real-time by editing a Telegram message.
+        Uses the persistent interactive process when available, otherwise runs
+        one Cline process per message. Streams output in real-time by editing
+        a Telegram message, and passes cleaned lines to on_text as they complete.
         """
-        async with self.cline.lock:
+        async with session.lock, self.sessions.slots:
+            session.idle.clear()
+            session.last_used = time.time()
             try:
-                import time
-                
-                # Read memory files for context
-                context_preamble = ""
-                memory_file = os.path.join(self.cline.working_dir, "CLINE_MEMORY.md")
-                agents_file = os.path.join(self.cline.working_dir, "CLINE_AGENTS.md")
-                
-                if os.path.exists(memory_file):
-                    try:
-                        with open(memory_file, 'r') as f:
-                            context_preamble += f"\n\n[MEMORY CONTEXT - Read this first:]\n{f.read()[:2000]}"
-                    except:
-                        pass
-                
-                if os.path.exists(agents_file):
-                    try:
-                        with open(agents_file, 'r') as f:
-                            context_preamble += f"\n\n[AGENT INSTRUCTIONS:]\n{f.read()[:1500]}"
-                    except:
-                        pass
-                
-                # Build Cline command with context
-                cmd = [CLINE_PATH]  # Use configured path to cline
+                # Memory files for context - skipped when this process or resumed task has them
+                context_keys, full_preamble = await self.build_context_preamble(session)
                 
-                if CLINE_YOLO:
-                    cmd.append("--yolo")
-                
-                # Resume existing task if available
-                if self.cline.task_id:
-                    cmd.extend(["--taskId", self.cline.task_id])
-                    logger.info(f"Resuming task: {self.cline.task_id}")
-                else:
-                    cmd.extend(["--model", self.cline.model])
+                # Without bracketed paste, multi-line prompts run per message; decide before starting a process
+                per_message = CLINE_MULTILINE != "paste" and (
+                    "\n" in message.strip() or (bool(full_preamble) and session.expected_context() != context_keys)
+                )
+                persistent = False
+                if not per_message:
+                    if CLINE_PERSISTENT and not session.persistent_failed and not session.prompt_unmatched():
+                        await self.sessions.make_room(session)
+                    persistent = await session.ensure_interactive()
+                if session.cancel_requested:
+                    return ("⏹ Cancelled before Cline started.", None, None)
                 
-                cmd.extend(["--timeout", str(CLINE_TIMEOUT)])
-                cmd.extend(["--cwd", self.cline.working_dir])
+                context_preamble = full_preamble if self.context_needed(session, context_keys, persistent) else ""
                 
                 # Prepend context if available
                 if context_preamble:
-                    cmd.append(f"Context:{context_preamble}\n\nUser message: {message}")
+                    prompt = f"Context:{context_preamble}\n\nUser message: {message}"
                 else:
-                    cmd.append(message)
-                
-                logger.info(f"Running Cline: {' '.join(cmd[:4])}... (message)")
+                    prompt = message
                 
                 # Create initial streaming message if we have context
                 stream_msg_id = stream_message_id
                 if context and chat_id and not stream_msg_id:
                     try:
-                        msg = await context.bot.send_message(
+                        msg = await self.scheduler.call(
+                            chat_id,
+                            context.bot.send_message,
                             chat_id=chat_id,
                             text="🔄 *Cline is working...*\n\n`Starting...`",
                             parse_mode="Markdown"
@@ -281,129 +3002,261 @@ class TelegramClineBridge:
                     except Exception as e:
                         logger.warning(f"Could not create stream message: {e}")
                 
-                # Run Cline and capture output in real-time
-                process = await asyncio.create_subprocess_exec(
-                    *cmd,
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE,
-                    cwd=self.cline.working_dir
-                )
-                
-                # Collect output in real-time with live updates
-                output = ""
-                last_edit_time = 0
-                last_edit_text = ""
+                # Live update state shared with the output callback
+                cleaner = VirtualTerminal() if CLINE_VT else OutputCleaner()
+                session.last_output = cleaner.store
+                session.last_pager = None
+                last_edit_version = 0
                 task_id = None
-                edit_interval = 1.5  # Edit message every 1.5 seconds max
                 
-                while True:
-                    try:
-                        # Read a chunk of output
-                        chunk = await asyncio.wait_for(
-                            process.stdout.read(512),
-                            timeout=0.5
-                        )
-                        
-                        if chunk:
-                            chunk_str = chunk.decode('utf-8', errors='replace')
-                            output += chunk_str
-                            
-                            # Log to terminal prominently
-                            if chunk_str.strip():
-                                # Clean and print to terminal for visibility
-                                clean_chunk = self.cline.clean_output(chunk_str)
-                                if clean_chunk:
-                                    print("\n" + "="*60)
-                                    print("🤖 CLINE OUTPUT:")
-                                    print("-"*60)
-                                    print(clean_chunk[:500])
-                                    print("="*60 + "\n")
-                                    logger.info(f"Cline: {clean_chunk[:100]}...")
-                            
-                            # Try to extract task ID
-                            if not task_id:
-                                task_match = re.search(r'Task started:\s*(\d+)', output)
-                                if task_match:
-                                    task_id = task_match.group(1)
-                                    logger.info(f"Task ID: {task_id}")
-                            
-                            # Edit the streaming message periodically
-                            current_time = time.time()
-                            if context and chat_id and stream_msg_id and (current_time - last_edit_time) > edit_interval:
-                                # Prepare preview text
-                                preview = self.cline.clean_output(output)
-                                if preview and preview != last_edit_text:
-                                    # Add status header
-                                    status_text = f"🔄 *Cline working...*\n\n```\n{preview[:3500]}\n```"
-                                    try:
-                                        await context.bot.edit_message_text(
-                                            chat_id=chat_id,
-                                            message_id=stream_msg_id,
-                                            text=status_text,
-                                            parse_mode="Markdown"
-                                        )
-                                        last_edit_time = current_time
-                                        last_edit_text = preview
-                                    except Exception as e:
-                                        # Message not changed or other error
-                                        pass
-                        
-                        # Check if process finished
-                        if process.returncode is not None:
-                            break
-                            
-                    except asyncio.TimeoutError:
-                        # No output for 0.5 seconds, check if process is done
-                        if process.returncode is not None:
-                            break
-                        # Continue waiting
-                            
-                    except Exception as e:
-                        logger.error(f"Error reading output: {e}")
-                        break
+                def render_preview() -> str:
+                    # Rendered when the scheduler actually sends, so merged edits cost nothing
+                    preview = cleaner.tail(3500)
+                    if not preview:
+                        return ""
+                    # Add status header
+                    return f"🔄 <b>Cline working...</b>\n\n<pre>{html.escape(preview, quote=False)}</pre>"
                 
-                # Get any remaining stderr
-                stderr = await process.stderr.read()
-                error = stderr.decode('utf-8', errors='replace')
+                async def on_output(chunk_str: str, output: str):
+                    nonlocal last_edit_version, task_id
+                    
+                    # Clean once and print completed lines to terminal for visibility
+                    completed = cleaner.feed(chunk_str)
+                    if on_text and completed:
+                        on_text(completed)
+                    clean_chunk = completed.strip()
+                    if clean_chunk:
+                        print("\n" + "="*60)
+                        print("🤖 CLINE OUTPUT:")
+                        print("-"*60)
+                        print(clean_chunk[:500])
+                        print("="*60 + "\n")
+                        logger.info(f"Cline: {clean_chunk[:100]}...")
+                    
+                    # Try to extract task ID
+                    if not task_id:
+                        task_match = TASK_STARTED_RE.search(output[-len(chunk_str) - 64:])
+                        if task_match:
+                            task_id = task_match.group(1)
+                            logger.info(f"Task ID: {task_id}")
+                    
+                    # Queue a preview edit; the scheduler merges and paces them
+                    if context and chat_id and stream_msg_id:
+                        self.scheduler.note_output(chat_id, stream_msg_id, len(chunk_str))
+                        if cleaner.version != last_edit_version:
+                            last_edit_version = cleaner.version
+                            self.scheduler.schedule_edit(
+                                context.bot, chat_id, stream_msg_id, render_preview, parse_mode="HTML"
+                            )
                 
-                if process.returncode != 0 and error:
-                    logger.error(f"Cline error: {error}")
+                output = None
+                restarted = False
+                interactive = False
+                if persistent:
+                    logger.info(f"Sending to persistent Cline session... (message)")
+                    output = await session.send_interactive(prompt, on_output)
+                    if output is not None:
+                        interactive = True
+                        session.context_sent = context_keys
+                        session.process_task_id = task_id or session.process_task_id
+                        if session.process_task_id:
+                            session.task_context = (session.process_task_id, context_keys)
+                        restarted = not session.is_alive()
                 
-                logger.info(f"Cline completed. Output length: {len(output)} chars")
+                if output is None and session.cancel_requested:
+                    output = ""
+                elif output is None:
+                    # Per-message run (process exited or refused the prompt) needs context unless the task has it
+                    if persistent and not context_preamble and self.context_needed(session, context_keys, False):
+                        context_preamble = full_preamble
+                        if context_preamble:
+                            prompt = f"Context:{context_preamble}\n\nUser message: {message}"
+                    output = await self.run_oneshot(session, prompt, on_output)
+                    if task_id or session.task_id:
+                        session.task_context = (task_id or session.task_id, context_keys)
+                    # The task moved on without the persistent process; it restarts on the task next turn
+                    session.process_task_id = None
                 
                 # Try to delete the streaming message
                 if context and chat_id and stream_msg_id:
+                    await self.scheduler.cancel_edits(chat_id, stream_msg_id)
                     try:
-                        await context.bot.delete_message(chat_id=chat_id, message_id=stream_msg_id)
-                    except:
-                        pass
+                        await self.scheduler.call(
+                            chat_id, context.bot.delete_message, chat_id=chat_id, message_id=stream_msg_id
+                        )
+                    except Exception as e:
+                        logger.warning(f"Could not delete stream message: {e}")
                 
-                return (self.cline.clean_output(output) or "✅ Cline completed.", task_id, None)
+                final_lines = cleaner.finish()
+                if on_text and final_lines:
+                    on_text(final_lines)
+                cleaner.store.close()  # Complete the log so pages can be read from it
+                logger.info(f"Cline completed. Output length: {cleaner.store.size} chars")
+                
+                # First page now, the rest on demand; the persistent prompt ends the last page
+                pager = Pager(cleaner.store, strip=session.prompt_pattern if interactive else None)
+                response, following = await asyncio.to_thread(pager.page)
+                if following is not None:
+                    session.last_pager = (pager, following)
+                if session.cancel_requested:
+                    response = f"⏹ Cancelled. Partial output:\n\n{response}" if response else "⏹ Cancelled."
+                    return (response, task_id, None)
+                if session.timed_out:
+                    response = f"⏱ Cline ran past {CLINE_TIMEOUT}s and was interrupted. Output:\n\n{response}"
+                response = response or "✅ Cline completed."
+                if restarted:
+                    response += "\n\n⚠️ Cline exited. Cline restarted on next message."
+                return (response, task_id, None)
                 
             except FileNotFoundError:
                 return ("❌ Cline CLI not found. Make sure it's installed and in PATH.", None, None)
             except Exception as e:
                 logger.error(f"Error communicating with Cline: {e}")
                 return (f"Error: {str(e)}", None, None)
+            finally:
+                if session.last_output:
+                    session.last_output.close()
+                session.cancel_requested = False
+                session.timed_out = False
+                session.idle.set()
+    
+    def context_needed(self, session: ClineSession, context_keys: tuple, persistent: bool) -> bool:
+        """Whether the preamble must be sent, i.e. the files changed since the process or task saw them."""
+        if persistent:
+            return session.context_sent != context_keys
+        if session.task_id:
+            return session.task_context != (session.task_id, context_keys)
+        return True
+    
+    async def build_context_preamble(self, session: ClineSession) -> Tuple[tuple, str]:
+        """(source keys, preamble) of the memory and agent files, from the cache when unchanged."""
+        index = session.file_index
+        watched = bool(index and index.watching and index.root == session.working_dir)
+        return await self.context_cache.get(session.working_dir, watched)
+    
+    async def run_oneshot(self, session: ClineSession, prompt: str, on_output: Callable[[str, str], Awaitable[None]] = None) -> str:
+        """Run one Cline process for a single message and return its output."""
+        # Build Cline command with context
+        cmd = [CLINE_PATH]  # Use configured path to cline
+        
+        if CLINE_YOLO:
+            cmd.append("--yolo")
+        
+        # Resume existing task if available
+        if session.task_id:
+            cmd.extend(["--taskId", session.task_id])
+            logger.info(f"Resuming task: {session.task_id}")
+        else:
+            cmd.extend(["--model", session.model])
+        
+        cmd.extend(["--timeout", str(CLINE_TIMEOUT)])
+        cmd.extend(["--cwd", session.working_dir])
+        cmd.append(prompt)
+        
+        logger.info(f"Running Cline: {' '.join(cmd[:4])}... (message)")
+        
+        # Run Cline and capture output in real-time
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=session.working_dir,
+            start_new_session=True  # Own process group, so cancel() reaches its children
+        )
+        session.oneshot_process = process
+        session.messages_sent += 1
+        try:
+            return await self.read_oneshot(process, on_output)
+        finally:
+            session.oneshot_process = None
+    
+    async def read_oneshot(self, process, on_output: Callable[[str, str], Awaitable[None]] = None) -> str:
+        """Collect a per-message process's output until it exits."""
+        pump = OutputPump(process)
+        pump.start()
+        output = ""  # Recent raw output; the full text goes through on_output
+        
+        while True:
+            chunk = await pump.queue.get()
+            if chunk is None:
+                break
+            output = output[-RAW_CONTEXT_CHARS:] + chunk
+            if on_output:
+                await on_output(chunk, output)
+        
+        await process.wait()
+        if process.returncode != 0 and pump.stderr:
+            logger.error(f"Cline error: {pump.stderr}")
+        
+        return output
 
 
 # Global bridge instance
 bridge: Optional[TelegramClineBridge] = None
 
 
-def is_authorized(user_id: int) -> bool:
-    """Check if user is authorized to use the bot."""
-    return user_id == AUTHORIZED_USER_ID
+def is_authorized(user_id: int, chat_id: int = None) -> bool:
+    """Check if user, or the chat they write in, is authorized to use the bot."""
+    return user_id in AUTHORIZED_USER_IDS or chat_id in AUTHORIZED_CHAT_IDS
 
 
-async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle /start command."""
-    user_id = update.effective_user.id
+class AuthGate:
+    """Pre-dispatch filter that runs before every handler (group -1).
     
-    if not is_authorized(user_id):
-        await update.message.reply_text("Unauthorized access.")
-        return
+    Updates from outside the allow lists, and updates beyond an allowed
+    sender's token bucket, end here with ApplicationHandlerStop: no handler
+    runs and, by default, nothing is sent back. With UNAUTHORIZED_REPLY a
+    stranger gets at most one reply per UNAUTHORIZED_REPLY_INTERVAL.
+    """
     
+    def __init__(self):
+        self.senders: OrderedDict = OrderedDict()  # Sender ID -> update TokenBucket, least recent first
+        self.strangers: OrderedDict = OrderedDict()  # Sender ID -> reply TokenBucket
+        self.dropped = 0
+    
+    @staticmethod
+    def bucket(buckets: OrderedDict, sender_id: int, rate: float, capacity: float) -> TokenBucket:
+        """The sender's bucket, created on first sight; the table stays bounded under spam."""
+        bucket = buckets.get(sender_id)
+        if bucket is None:
+            bucket = buckets[sender_id] = TokenBucket(rate, capacity)
+            if len(buckets) > AUTH_TRACKED_SENDERS:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(sender_id)
+        return bucket
+    
+    async def __call__(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        user, chat = update.effective_user, update.effective_chat
+        sender_id = user.id if user else (chat.id if chat else None)
+        
+        if sender_id is not None and is_authorized(sender_id, chat.id if chat else None):
+            bucket = self.bucket(self.senders, sender_id, SENDER_RATE, SENDER_BURST)
+            if bucket.delay() == 0:
+                bucket.take()
+                return  # On to the handlers
+            self.dropped += 1
+            logger.debug(f"Dropped update from {sender_id}: over {SENDER_RATE}/s")
+            raise ApplicationHandlerStop
+        
+        self.dropped += 1
+        if UNAUTHORIZED_REPLY and sender_id is not None:
+            bucket = self.bucket(self.strangers, sender_id, 1 / max(UNAUTHORIZED_REPLY_INTERVAL, 1), 1)
+            if bucket.delay() == 0:
+                bucket.take()
+                logger.info(f"Unauthorized update from {sender_id}")
+                try:
+                    if update.callback_query:
+                        await update.callback_query.answer("Unauthorized access.")
+                    elif update.effective_message:
+                        await update.effective_message.reply_text("Unauthorized access.")
+                except Exception as e:
+                    logger.debug(f"Could not answer unauthorized update: {e}")
+        raise ApplicationHandlerStop
+
+
+async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /start command."""
     await update.message.reply_text(
         "🤖 *Welcome to Cline Bridge!*\n\n"
         "Send any message to interact with Cline.\n\n"
@@ -415,6 +3268,13 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         "/model <name> - Change AI model\n"
         "/files - List files in working directory\n"
         "/get <filename> - Download a specific file\n"
+        "/queue - Show queued messages\n"
+        "/cancel [id] - Stop the running message or drop a queued one\n"
+        "/sessions - List workspace sessions\n"
+        "/log - Download the full output of the last message\n"
+        "/tasks - List recent tasks\n"
+        "/search <text> - Search past messages and replies\n"
+        "/resume [taskId] - Continue a task (default: the latest here)\n"
         "/kill - Kill and restart session\n\n"
         "*💡 Tip:* Ask Cline to create HTML/CSS/JS files and they'll be sent to you automatically!",
         parse_mode="Markdown"
@@ -423,13 +3283,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
 async def info_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /info command - show current Cline context."""
-    user_id = update.effective_user.id
-    
-    if not is_authorized(user_id):
-        await update.message.reply_text("Unauthorized access.")
-        return
-    
-    cline = bridge.cline
+    cline = bridge.session_for(update.effective_chat.id)
     status = "🟢 Running" if cline.is_alive() else "🔴 Stopped"
     
     info = (
@@ -445,19 +3299,22 @@ async def info_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
 async def tasks_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /tasks command - list recent tasks."""
-    user_id = update.effective_user.id
-    
-    if not is_authorized(user_id):
-        await update.message.reply_text("Unauthorized access.")
+    session = bridge.session_for(update.effective_chat.id)
+    tasks = await bridge.turns.tasks(session.working_dir)
+    if tasks:
+        await update.message.reply_text((
+            "📋 Recent tasks in this workspace:\n\n" + "\n".join(describe_tasks(tasks)) +
+            "\n\nUse /resume <taskId> to continue a task, /search <text> to find one."
+        )[:4000])
         return
     
-    # Run cline history to get task list
+    # Nothing recorded here yet - ask Cline for its history
     try:
         process = await asyncio.create_subprocess_exec(
             CLINE_PATH, "history",
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
-            cwd=bridge.cline.working_dir
+            cwd=session.working_dir
         )
         stdout, stderr = await process.communicate()
         output = stdout.decode('utf-8', errors='replace')
@@ -483,49 +3340,95 @@ async def tasks_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         await update.message.reply_text(f"❌ Error listing tasks: {str(e)}")
 
 
-async def resume_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle /resume command - resume a specific task."""
-    user_id = update.effective_user.id
-    
-    if not is_authorized(user_id):
-        await update.message.reply_text("Unauthorized access.")
-        return
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /search command - full-text search over past messages and output."""
+    if not context.args:
+        await update.message.reply_text("Usage: /search <text>\nSearches every recorded message and Cline reply.")
+        return
+    
+    query = " ".join(context.args)
+    hits = await bridge.turns.search(query)
+    if not hits:
+        await update.message.reply_text(f"🔍 Nothing matches: {query}")
+        return
+    await update.message.reply_text((
+        f"🔍 Matches for: {query}\n\n" + "\n".join(describe_hits(hits)) +
+        "\n\nUse /resume <taskId> to continue a task."
+    )[:4000])
+
+
+async def resume_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /resume command - resume a specific task, or the workspace's latest."""
+    lines = await resume_task(update.effective_chat.id, context.args[0] if context.args else None)
+    if lines is None:
+        await update.message.reply_text("Usage: /resume <taskId>\nUse /tasks to list available tasks.")
+        return
+    await update.message.reply_text("\n".join(lines))
+
+
+def describe_tasks(tasks: List[sqlite3.Row]) -> List[str]:
+    """Two lines per recorded task: ID and activity, then its first message."""
+    lines = []
+    for task in tasks:
+        when = time.strftime("%Y-%m-%d %H:%M", time.localtime(task["last_at"]))
+        lines.append(f"• {task['task_id']} - {task['turns']} turns, last {when}")
+        lines.append(f"   {' '.join(task['prompt'].split())[:70]}")
+    return lines
+
+
+def describe_hits(hits: List[sqlite3.Row]) -> List[str]:
+    """Two lines per search hit: when, task and workspace, then the matching text."""
+    lines = []
+    for hit in hits:
+        when = time.strftime("%Y-%m-%d %H:%M", time.localtime(hit["started_at"]))
+        workspace = os.path.basename(hit["workspace"].rstrip(os.sep)) or hit["workspace"]
+        lines.append(f"• {when} task {hit['task_id'] or '-'} in {workspace}: {' '.join(hit['prompt'].split())[:50]}")
+        lines.append(f"   {' '.join(hit['snippet'].split())[:160]}")
+    return lines
+
+
+async def resume_task(chat_id: Optional[int], task_id: str = None) -> Optional[List[str]]:
+    """Point the chat's session at a task, by default the workspace's latest.
     
-    if not context.args:
-        await update.message.reply_text("Usage: /resume <taskId>\nUse /tasks to list available tasks.", parse_mode="Markdown")
-        return
-    
-    task_id = context.args[0]
-    bridge.cline.task_id = task_id
+    Recorded tasks also bring the chat back to their workspace. Returns the
+    lines to show, or None when there is no task to resume.
+    """
+    session = bridge.session_for(chat_id)
+    if task_id:
+        record = await bridge.turns.task(task_id)
+    else:
+        latest = await bridge.turns.tasks(session.working_dir, limit=1)
+        if not latest:
+            return None
+        record = latest[0]
+        task_id = record["task_id"]
     
-    await update.message.reply_text(
-        f"✅ Task set to: `{task_id}`\n"
-        f"Next message will continue this task.",
-        parse_mode="Markdown"
-    )
+    lines = [f"✅ Task set to: {task_id}"]
+    if record:
+        if record["workspace"] != session.working_dir and os.path.isdir(record["workspace"]):
+            session = bridge.sessions.switch(chat_id, record["workspace"])
+            lines.append(f"📁 Switched to: {record['workspace']}")
+        lines.append(f"💬 Last message: {' '.join(record['prompt'].split())[:80]}")
+    else:
+        lines.append("⚠️ Not in the local history - Cline will look it up.")
+    session.task_id = task_id
+    lines.append("Next message will continue this task.")
+    return lines
 
 
 async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /reset command."""
-    user_id = update.effective_user.id
-    
-    if not is_authorized(user_id):
-        await update.message.reply_text("Unauthorized access.")
-        return
-    
-    result = bridge.cline.restart()
+    session = bridge.session_for(update.effective_chat.id)
+    await session.stop()
+    result = session.restart()
+    bridge.pool.prewarm(session.working_dir, session.model)
     await update.message.reply_text(result)
 
 
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /status command - show detailed session stats."""
-    user_id = update.effective_user.id
-    
-    if not is_authorized(user_id):
-        await update.message.reply_text("Unauthorized access.")
-        return
-    
-    stats = bridge.cline.get_stats()
+    session = bridge.session_for(update.effective_chat.id)
+    stats = session.get_stats()
     
     status_emoji = "🟢" if stats["active"] else "🔴"
     uptime_mins = stats["uptime_seconds"] // 60
@@ -547,27 +3450,20 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 async def kill_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /kill command."""
-    user_id = update.effective_user.id
-    
-    if not is_authorized(user_id):
-        await update.message.reply_text("Unauthorized access.")
-        return
-    
-    result = bridge.cline.restart()
+    session = bridge.session_for(update.effective_chat.id)
+    await session.cancel()
+    await session.stop()
+    result = session.restart()
+    bridge.pool.prewarm(session.working_dir, session.model)
     await update.message.reply_text(f"Session killed and restarted.\n{result}")
 
 
 async def cd_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /cd command - change working directory."""
-    user_id = update.effective_user.id
-    
-    if not is_authorized(user_id):
-        await update.message.reply_text("Unauthorized access.")
-        return
-    
+    session = bridge.session_for(update.effective_chat.id)
     if not context.args:
         await update.message.reply_text(
-            f"Current directory: `{bridge.cline.working_dir}`\n"
+            f"Current directory: `{session.working_dir}`\n"
             f"Usage: /cd <path>",
             parse_mode="Markdown"
         )
@@ -575,36 +3471,33 @@ async def cd_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     
     new_dir = " ".join(context.args)
     
-    # Handle relative paths
-    if not os.path.isabs(new_dir):
-        new_dir = os.path.abspath(os.path.join(bridge.cline.working_dir, new_dir))
+    # Handle relative paths; normalized so /repo and /repo/ are the same workspace
+    new_dir = os.path.realpath(os.path.join(session.working_dir, os.path.expanduser(new_dir)))
     
     # Validate directory
     if not os.path.isdir(new_dir):
         await update.message.reply_text(f"❌ Directory not found: `{new_dir}`", parse_mode="Markdown")
         return
     
-    # Update working directory and restart
-    bridge.cline.working_dir = new_dir
-    result = bridge.cline.restart()
+    # Switch this chat to the workspace's session; the previous one keeps running
+    session = bridge.sessions.switch(update.effective_chat.id, new_dir)
+    if not session.is_alive():
+        bridge.pool.prewarm(new_dir, session.model)
     
+    status = f"task `{session.task_id}`" if session.task_id else "new session"
     await update.message.reply_text(
-        f"📁 Changed to: `{new_dir}`\n{result}",
+        f"📁 Changed to: `{new_dir}` ({status})\n"
+        f"Other workspaces keep running - see /sessions",
         parse_mode="Markdown"
     )
 
 
 async def model_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /model command - change or show model."""
-    user_id = update.effective_user.id
-    
-    if not is_authorized(user_id):
-        await update.message.reply_text("Unauthorized access.")
-        return
-    
+    session = bridge.session_for(update.effective_chat.id)
     if not context.args:
         await update.message.reply_text(
-            f"Current model: `{bridge.cline.model}`\n"
+            f"Current model: `{session.model}`\n"
             f"Usage: /model <model_name>\n\n"
             f"Common models:\n"
             f"• `claude-3-5-sonnet-20241022`\n"
@@ -615,7 +3508,8 @@ async def model_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         return
     
     new_model = " ".join(context.args)
-    bridge.cline.model = new_model
+    session.model = new_model
+    bridge.pool.prewarm(session.working_dir, new_model)
     
     await update.message.reply_text(
         f"🧠 Model set to: `{new_model}`\n"
@@ -626,13 +3520,9 @@ async def model_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
 async def files_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /files command - list files in working directory."""
-    user_id = update.effective_user.id
-    
-    if not is_authorized(user_id):
-        await update.message.reply_text("Unauthorized access.")
-        return
-    
-    files = bridge.scan_files()
+    session = bridge.session_for(update.effective_chat.id)
+    await bridge.refresh_file_index(session)
+    files = bridge.scan_files(session)
     
     if not files:
         await update.message.reply_text("📂 No files found in working directory.")
@@ -647,7 +3537,7 @@ async def files_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         by_ext[ext].append(os.path.basename(f))
     
     # Build message
-    msg = f"📂 *Files in* `{bridge.cline.working_dir}`:\n\n"
+    msg = f"📂 *Files in* `{session.working_dir}`:\n\n"
     for ext, names in sorted(by_ext.items()):
         msg += f"*{ext}:*\n"
         for name in names[:10]:  # Max 10 per type
@@ -665,12 +3555,7 @@ async def files_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
 async def get_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /get command - download a specific file."""
-    user_id = update.effective_user.id
-    
-    if not is_authorized(user_id):
-        await update.message.reply_text("Unauthorized access.")
-        return
-    
+    session = bridge.session_for(update.effective_chat.id)
     if not context.args:
         await update.message.reply_text("Usage: /get <filename>", parse_mode="Markdown")
         return
@@ -678,7 +3563,8 @@ async def get_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     file_name = " ".join(context.args)
     
     # Search for the file
-    files = bridge.scan_files()
+    await bridge.refresh_file_index(session)
+    files = bridge.scan_files(session)
     matches = [f for f in files if os.path.basename(f).lower() == file_name.lower()]
     
     if not matches:
@@ -693,131 +3579,404 @@ async def get_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         await update.message.reply_text(f"⚠️ Too many matches ({len(matches)}). Be more specific.", parse_mode="Markdown")
         return
     
-    for file_path in matches:
-        try:
-            file_size = os.path.getsize(file_path)
-            if file_size > 50 * 1024 * 1024:
-                await update.message.reply_text(f"⚠️ File too large: `{os.path.basename(file_path)}` ({file_size // (1024*1024)}MB)", parse_mode="Markdown")
-                continue
-            
-            ext = os.path.splitext(file_path)[1].lower()
-            actual_name = os.path.basename(file_path)
-            
-            if ext in ['.png', '.jpg', '.jpeg', '.gif', '.webp']:
-                with open(file_path, 'rb') as f:
-                    await update.message.reply_photo(
-                        photo=InputFile(f, filename=actual_name),
-                        caption=f"📷 `{actual_name}`",
-                        parse_mode="Markdown"
-                    )
-            else:
-                with open(file_path, 'rb') as f:
-                    await update.message.reply_document(
-                        document=InputFile(f, filename=actual_name),
-                        caption=f"📄 `{actual_name}`",
-                        parse_mode="Markdown"
-                    )
-        except Exception as e:
-            await update.message.reply_text(f"❌ Failed to send `{os.path.basename(file_path)}`: {str(e)}", parse_mode="Markdown")
+    failed = await bridge.send_files(update.message, matches)
+    for file_path, reason in failed:
+        await update.message.reply_text(f"❌ Failed to send `{os.path.basename(file_path)}`: {reason}", parse_mode="Markdown")
+
+
+def describe_queue(queue: JobQueue) -> List[str]:
+    """One line per running or waiting job."""
+    lines = []
+    if queue.running:
+        elapsed = time.time() - (queue.running.started_at or time.time())
+        lines.append(f"▶️ {queue.running.describe()} (running {format_duration(elapsed)})")
+    for job in queue.pending:
+        lines.append(f"{queue.position(job)}. {job.describe()} (ETA ~{format_duration(queue.eta(job))})")
+    return lines
+
+
+def describe_sessions(chat_id: Optional[int] = None) -> List[str]:
+    """One line per workspace session, marking the chat's current one."""
+    current = bridge.session_for(chat_id)
+    lines = []
+    for session in bridge.sessions.all():
+        queue = session.queue
+        state = "running" if queue.running else ("alive" if session.is_alive() else "idle")
+        marker = "👉" if session is current else "•"
+        lines.append(f"{marker} {session.working_dir} - {state}, {len(queue.pending)} queued")
+    return lines
+
+
+async def sessions_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /sessions command - list workspace sessions."""
+    lines = describe_sessions(update.effective_chat.id)
+    running = sum(1 for session in bridge.sessions.all() if session.lock.locked())
+    await update.message.reply_text(
+        f"🗂 Sessions ({running} of max {CLINE_MAX_RUNNING} running):\n" + "\n".join(lines)
+    )
+
+
+async def log_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /log command - send the full transcript of the last Cline turn."""
+    session = bridge.session_for(update.effective_chat.id)
+    await bridge.send_transcript(update.message, session.last_output)
+
+
+async def page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle the "More" and "Full log" buttons under long replies."""
+    query = update.callback_query
+    
+    kind, pager_id, *rest = query.data.split(":")
+    pager = bridge.pagers.get(int(pager_id))
+    if pager is None:
+        await query.answer("This reply is no longer cached - use /log.", show_alert=True)
+        return
+    
+    if kind == "log":
+        await query.answer()
+        await bridge.send_transcript(query.message, pager.store)
+        return
+    
+    chat_id = query.message.chat_id
+    try:
+        text, following = await asyncio.to_thread(pager.page, int(rest[0]))
+    except OSError:
+        # The transcript's log was pruned (OUTPUT_LOG_KEEP) since the reply was sent
+        bridge.pagers.pop(int(pager_id), None)
+        await query.answer("This reply is no longer cached - use /log.", show_alert=True)
+        return
+    await query.answer()
+    try:
+        # The buttons move down to the newest page
+        await bridge.scheduler.call(chat_id, query.edit_message_reply_markup, reply_markup=None)
+    except BadRequest as e:
+        logger.warning(f"Could not remove page buttons: {e}")
+    await bridge.reply_output(query.message, text or "…", reply_markup=bridge.page_buttons(int(pager_id), following))
+
+
+async def queue_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /queue command - show running and waiting jobs."""
+    session = bridge.session_for(update.effective_chat.id)
+    lines = describe_queue(session.queue)
+    if not lines:
+        await update.message.reply_text("📭 Queue is empty.")
+        return
+    await update.message.reply_text("📋 Queue:\n" + "\n".join(lines))
+
+
+async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /cancel command - drop a waiting job or stop the running one."""
+    if context.args and context.args[0].lstrip("#").isdigit():
+        job_id = int(context.args[0].lstrip("#"))
+    elif not context.args and bridge.session_for(update.effective_chat.id).queue.running:
+        # Bare /cancel stops whatever this chat's workspace is running
+        job_id = bridge.session_for(update.effective_chat.id).queue.running.id
+    else:
+        await update.message.reply_text("Usage: /cancel [job id]\nWithout an ID stops the running job. See /queue for IDs.")
+        return
+    
+    # Job IDs are unique, so this looks in every workspace
+    _, job = bridge.sessions.find_job(job_id)
+    if job and job.started_at:
+        # The escalation can take a while; the job itself replies with the partial output
+        asyncio.create_task(bridge.sessions.cancel_job(job_id))
+        await update.message.reply_text(f"⏹ Stopping job #{job_id}...")
+        return
+    result = await bridge.sessions.cancel_job(job_id)
+    if result == "queued":
+        await update.message.reply_text(f"🗑 Job #{job_id} cancelled.")
+    elif result is None:
+        await update.message.reply_text(f"❌ No job #{job_id}.")
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle incoming text messages."""
+    """Handle incoming text messages by queueing them for Cline."""
     user_id = update.effective_user.id
-    chat_id = update.effective_chat.id
     
-    if not is_authorized(user_id):
-        await update.message.reply_text("Unauthorized access.")
+    session = bridge.session_for(update.effective_chat.id)
+    user_message = update.message.text
+    logger.info(f"Message from {user_id}: {user_message[:50]}...")
+    
+    queue = session.queue
+    busy = queue.running is not None or bool(queue.pending)
+    job = queue.submit("telegram", user_message, lambda job: run_telegram_job(update, context, session))
+    if job is None:
+        await update.message.reply_text(f"🚫 Queue is full ({QUEUE_MAX_JOBS} jobs). Try again later or /cancel some.")
         return
     
+    # Only acknowledge when the job has to wait; otherwise streaming starts right away
+    if busy:
+        await update.message.reply_text(
+            f"📥 Queued as job #{job.id} (position {queue.position(job)}, "
+            f"ETA ~{format_duration(queue.eta(job))}). /queue to check, /cancel {job.id} to drop."
+        )
+
+
+async def run_telegram_job(update: Update, context: ContextTypes.DEFAULT_TYPE, session: ClineSession) -> None:
+    """Run one queued Telegram message through its session and reply."""
+    chat_id = update.effective_chat.id
     user_message = update.message.text
-    logger.info(f"Message from {user_id}: {user_message[:50]}...")
     
     # Track existing files before running Cline
-    bridge.track_current_files()
+    await bridge.track_current_files(session)
     
     # Send initial "processing" message
     await context.bot.send_chat_action(chat_id=chat_id, action="typing")
     
     # Send to Cline and get response (with live streaming)
-    response, task_id, _ = await bridge.send_to_cline(user_message, chat_id=chat_id, context=context)
+    started = time.time()
+    response, task_id, _ = await bridge.send_to_cline(session, user_message, chat_id=chat_id, context=context)
     
     # Store task ID for resume
     if task_id:
-        bridge.cline.task_id = task_id
+        session.task_id = task_id
     
-    # Check for new files created by Cline
-    new_files = bridge.get_new_files()
+    # Check for files created or modified by Cline
+    changes = await bridge.get_file_changes(session)
+    await bridge.turns.record(session, "telegram", user_message, task_id or session.task_id, started, changes)
+    new_files = changes["created"] + changes["modified"]
     
     # Send response back to user
     if not response or not response.strip():
         response = "✅ Cline completed."
     
     # Add task ID if available
+    footer_html = footer_plain = ""
     if task_id:
-        response += f"\n\n📋 Task ID: `{task_id}`\n_Resume with: continue_"
+        footer_html = f"\n\n📋 Task ID: <code>{html.escape(task_id)}</code>\n<i>Resume with: continue</i>"
+        footer_plain = f"\n\n📋 Task ID: {task_id}\nResume with: continue"
+    
+    markup = None
+    if session.last_pager:
+        pager, following = session.last_pager
+        markup = bridge.page_buttons(bridge.register_pager(pager), following)
     
-    await update.message.reply_text(response, parse_mode="Markdown")
+    await bridge.reply_output(update.message, response, footer_html, footer_plain, reply_markup=markup)
     
     # Send any new files to the user
-    if new_files:
-        await update.message.reply_text(f"📎 *New files created:* {len(new_files)}", parse_mode="Markdown")
+    if new_files or changes["deleted"]:
+        summary = f"📎 *Files changed:* {len(changes['created'])} new, {len(changes['modified'])} modified"
+        if changes["deleted"]:
+            deleted_names = ", ".join(f"`{os.path.basename(f)}`" for f in changes["deleted"][:10])
+            summary += f"\n🗑 *Deleted:* {deleted_names}"
+        await bridge.scheduler.call(chat_id, update.message.reply_text, summary, parse_mode="Markdown")
         
-        for file_path in new_files:
-            try:
-                # Skip large files (> 50MB)
-                file_size = os.path.getsize(file_path)
-                if file_size > 50 * 1024 * 1024:
-                    await update.message.reply_text(f"⚠️ File too large to send: `{os.path.basename(file_path)}` ({file_size // (1024*1024)}MB)", parse_mode="Markdown")
-                    continue
-                
-                # Check file type
-                ext = os.path.splitext(file_path)[1].lower()
-                file_name = os.path.basename(file_path)
-                
-                # Images - send as photo
-                if ext in ['.png', '.jpg', '.jpeg', '.gif', '.webp']:
-                    with open(file_path, 'rb') as f:
-                        await update.message.reply_photo(
-                            photo=InputFile(f, filename=file_name),
-                            caption=f"📷 `{file_name}`",
-                            parse_mode="Markdown"
-                        )
-                # Code files - send as document
-                elif ext in ['.html', '.css', '.js', '.py', '.json', '.md', '.txt', '.xml', '.yaml', '.yml']:
-                    with open(file_path, 'rb') as f:
-                        await update.message.reply_document(
-                            document=InputFile(f, filename=file_name),
-                            caption=f"📄 `{file_name}`",
-                            parse_mode="Markdown"
-                        )
-                else:
-                    # Other files as generic document
-                    with open(file_path, 'rb') as f:
-                        await update.message.reply_document(
-                            document=InputFile(f, filename=file_name),
-                            caption=f"📁 `{file_name}`",
-                            parse_mode="Markdown"
-                        )
-                
-                logger.info(f"Sent file: {file_name}")
-                
-            except Exception as e:
-                logger.error(f"Failed to send file {file_path}: {e}")
-                await update.message.reply_text(f"❌ Failed to send: `{os.path.basename(file_path)}` - {str(e)}", parse_mode="Markdown")
+        if bridge.should_bundle(new_files):
+            failed = await bridge.send_bundle(update.message, new_files, session.working_dir)
+        else:
+            failed = await bridge.send_files(update.message, new_files)
+        if failed:
+            lines = [f"• `{os.path.basename(f)}` - {reason}" for f, reason in failed[:20]]
+            await bridge.scheduler.call(chat_id, update.message.reply_text, "❌ *Failed to send:*\n" + "\n".join(lines), parse_mode="Markdown")
+
+
+class TerminalInput:
+    """Asyncio-native terminal front end.
+    
+    stdin is watched with loop.add_reader, so nothing runs while idle and a
+    finished line is dispatched at once. On a TTY the terminal is switched
+    to cbreak mode for line editing (arrows, Home/End, Backspace/Delete,
+    Ctrl-A/E/U/W) and history (Up/Down, kept across restarts). Piped stdin
+    is read line by line; where add_reader is unsupported, a worker thread
+    reads lines instead.
+    """
+    
+    KEYS = {
+        '\x1b[A': 'up', '\x1b[B': 'down', '\x1b[C': 'right', '\x1b[D': 'left',
+        '\x1bOA': 'up', '\x1bOB': 'down', '\x1bOC': 'right', '\x1bOD': 'left',
+        '\x1b[H': 'home', '\x1b[F': 'end', '\x1bOH': 'home', '\x1bOF': 'end',
+        '\x1b[1~': 'home', '\x1b[4~': 'end', '\x1b[3~': 'delete',
+    }
+    
+    def __init__(self, prompt: str = "💬 You: "):
+        self.prompt = prompt
+        self.lines: asyncio.Queue = asyncio.Queue()  # Submitted lines, None at EOF
+        self.fd = sys.stdin.fileno()
+        self.editing = bool(termios) and sys.stdin.isatty()
+        self.saved_mode = None
+        self.reader_installed = False
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.partial = ""  # Piped input not yet terminated by a newline
+        self.buffer: List[str] = []  # Line being edited
+        self.cursor = 0
+        self.escape = ""  # Escape sequence being collected
+        self.history_lines = 0  # Lines in the history file, which may run ahead of self.history
+        self.history: List[str] = self.load_history()
+        self.history_index = len(self.history)
+    
+    def load_history(self) -> List[str]:
+        try:
+            with open(TERMINAL_HISTORY_PATH, 'r', encoding='utf-8') as f:
+                lines = [line.rstrip("\n") for line in f]
+        except OSError:
+            return []
+        self.history_lines = len(lines)
+        return lines[-TERMINAL_HISTORY_SIZE:]
+    
+    def start(self):
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_reader(self.fd, self._on_readable)
+            self.reader_installed = True
+        except (NotImplementedError, ValueError, OSError) as e:
+            logger.info(f"stdin not watchable ({e}), reading terminal lines in a thread")
+            self.editing = False
+            asyncio.create_task(self._read_lines_in_thread())
+            return
+        if self.editing:
+            self.saved_mode = termios.tcgetattr(self.fd)
+            tty.setcbreak(self.fd)  # Keys arrive one by one; Ctrl-C still interrupts
+    
+    def stop(self):
+        """Stop reading and give the terminal back its original mode."""
+        if self.reader_installed:
+            asyncio.get_running_loop().remove_reader(self.fd)
+            self.reader_installed = False
+        if self.saved_mode is not None:
+            termios.tcsetattr(self.fd, termios.TCSADRAIN, self.saved_mode)
+            self.saved_mode = None
+    
+    async def get(self) -> Optional[str]:
+        return await self.lines.get()
+    
+    async def _read_lines_in_thread(self):
+        while True:
+            line = await asyncio.to_thread(sys.stdin.readline)
+            if not line:
+                self.lines.put_nowait(None)
+                return
+            self.lines.put_nowait(line.rstrip("\n"))
+    
+    def _on_readable(self):
+        try:
+            data = os.read(self.fd, 4096)
+        except OSError:
+            data = b""
+        if not data:
+            self.stop()
+            self.lines.put_nowait(None)
+            return
+        
+        text = self.decoder.decode(data)
+        if not self.editing:
+            parts = (self.partial + text).split("\n")
+            self.partial = parts.pop()
+            for line in parts:
+                self.lines.put_nowait(line.rstrip("\r"))
+            return
+        
+        for char in text:
+            self._key(char)
+        self.redraw()
+    
+    def _key(self, char: str):
+        if self.escape or char == '\x1b':
+            self.escape += char
+            key = self.KEYS.get(self.escape)
+            if key:
+                self.escape = ""
+                self._special(key)
+            elif len(self.escape) > 1 and (self.escape[-1].isalpha() or self.escape[-1] == '~'):
+                self.escape = ""  # Unknown sequence
+            return
+        
+        if char in '\r\n':
+            self._submit()
+        elif char in '\x7f\b':
+            if self.cursor:
+                self.cursor -= 1
+                del self.buffer[self.cursor]
+        elif char == '\x01':
+            self.cursor = 0
+        elif char == '\x05':
+            self.cursor = len(self.buffer)
+        elif char == '\x15':
+            del self.buffer[:self.cursor]
+            self.cursor = 0
+        elif char == '\x17':
+            start = self.cursor
+            while start and self.buffer[start - 1] == ' ':
+                start -= 1
+            while start and self.buffer[start - 1] != ' ':
+                start -= 1
+            del self.buffer[start:self.cursor]
+            self.cursor = start
+        elif char == '\x04' and not self.buffer:
+            self.stop()
+            self.lines.put_nowait(None)
+        elif char.isprintable():
+            self.buffer.insert(self.cursor, char)
+            self.cursor += 1
+    
+    def _special(self, key: str):
+        if key == 'left':
+            self.cursor = max(self.cursor - 1, 0)
+        elif key == 'right':
+            self.cursor = min(self.cursor + 1, len(self.buffer))
+        elif key == 'home':
+            self.cursor = 0
+        elif key == 'end':
+            self.cursor = len(self.buffer)
+        elif key == 'delete':
+            if self.cursor < len(self.buffer):
+                del self.buffer[self.cursor]
+        elif key in ('up', 'down') and self.history:
+            step = -1 if key == 'up' else 1
+            self.history_index = min(max(self.history_index + step, 0), len(self.history))
+            line = self.history[self.history_index] if self.history_index < len(self.history) else ""
+            self.buffer = list(line)
+            self.cursor = len(self.buffer)
+    
+    def _submit(self):
+        line = "".join(self.buffer)
+        self.buffer, self.cursor = [], 0
+        sys.stdout.write("\n")
+        if line.strip() and (not self.history or self.history[-1] != line):
+            self.history.append(line)
+            del self.history[:-TERMINAL_HISTORY_SIZE]
+            self.save_history(line)
+        self.history_index = len(self.history)
+        self.lines.put_nowait(line)
+    
+    def save_history(self, line: str):
+        """Append a line; once the file holds twice TERMINAL_HISTORY_SIZE lines, rewrite it trimmed."""
+        try:
+            os.makedirs(BRIDGE_STATE_DIR, exist_ok=True)
+            if self.history_lines < 2 * max(TERMINAL_HISTORY_SIZE, 1):
+                with open(TERMINAL_HISTORY_PATH, 'a', encoding='utf-8') as f:
+                    f.write(line + "\n")
+                self.history_lines += 1
+                return
+            tmp = TERMINAL_HISTORY_PATH + ".tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.writelines(entry + "\n" for entry in self.history)
+            os.replace(tmp, TERMINAL_HISTORY_PATH)
+            self.history_lines = len(self.history)
+        except OSError as e:
+            logger.warning(f"Could not save terminal history: {e}")
+    
+    def redraw(self):
+        """Repaint the prompt and the line being edited."""
+        if not self.editing:
+            return
+        line = "".join(self.buffer)
+        back = len(self.buffer) - self.cursor
+        sys.stdout.write(f"\r\x1b[2K{self.prompt}{line}" + (f"\x1b[{back}D" if back else ""))
+        sys.stdout.flush()
 
 
-def handle_terminal_command(message: str) -> bool:
+async def handle_terminal_command(message: str) -> bool:
     """Handle terminal commands locally. Returns True if command was handled."""
     global bridge
     
+    session = bridge.session_for(None)
     msg = message.strip().lower()
     args = message.strip().split(maxsplit=1)
     arg = args[1] if len(args) > 1 else None
     
     # /status or /info
     if msg in ['/status', '/info']:
-        stats = bridge.cline.get_stats()
+        stats = session.get_stats()
         print(f"\n📊 Session Status:")
         print(f"   Task ID: {stats['task_id'] or 'None'}")
         print(f"   Model: {stats['model']}")
@@ -827,43 +3986,61 @@ def handle_terminal_command(message: str) -> bool:
     
     # /reset
     if msg == '/reset':
-        bridge.cline.restart()
+        await session.stop()
+        session.restart()
+        bridge.pool.prewarm(session.working_dir, session.model)
         print("\n✅ Session reset. Next message starts fresh.\n")
         return True
     
     # /tasks
     if msg == '/tasks':
-        print("\n📋 Run 'cline history' in a separate terminal to see tasks.")
-        print("   Then use /resume <taskId> to continue.\n")
+        tasks = await bridge.turns.tasks(session.working_dir)
+        if tasks:
+            print("\n📋 Recent tasks in this workspace:\n   " + "\n   ".join(describe_tasks(tasks)) + "\n")
+        else:
+            print("\n📋 No tasks recorded here yet. Run 'cline history' in a separate terminal to see Cline's.")
+        print("   Use /resume <taskId> to continue.\n")
         return True
     
-    # /resume <id>
-    if msg.startswith('/resume '):
-        task_id = arg
-        if task_id:
-            bridge.cline.task_id = task_id
-            print(f"\n✅ Task set to: {task_id}")
-            print("   Next message will continue this task.\n")
+    # /search <text>
+    if msg == '/search' or msg.startswith('/search '):
+        if not arg:
+            print("\nUsage: /search <text>\n")
+            return True
+        hits = await bridge.turns.search(arg)
+        if hits:
+            print(f"\n🔍 Matches for: {arg}\n   " + "\n   ".join(describe_hits(hits)) + "\n")
         else:
+            print(f"\n🔍 Nothing matches: {arg}\n")
+        return True
+    
+    # /resume [id]
+    if msg == '/resume' or msg.startswith('/resume '):
+        lines = await resume_task(None, arg)
+        if lines is None:
             print("\nUsage: /resume <taskId>\n")
+        else:
+            print("\n" + "\n   ".join(lines) + "\n")
         return True
     
     # /model
     if msg == '/model':
-        print(f"\n🧠 Current model: {bridge.cline.model}")
+        print(f"\n🧠 Current model: {session.model}")
         print("   Usage: /model <model_name>\n")
         return True
     
     if msg.startswith('/model '):
         if arg:
-            bridge.cline.model = arg
+            session.model = arg
+            bridge.pool.prewarm(session.working_dir, arg)
             print(f"\n✅ Model set to: {arg}")
             print("   Use /reset to apply.\n")
         return True
     
     # /files
     if msg == '/files':
-        files = bridge.scan_files()
+        await bridge.refresh_file_index(session)
+        files = bridge.scan_files(session)
         if files:
             print(f"\n📂 Files ({len(files)}):")
             for f in files[:20]:
@@ -874,16 +4051,62 @@ def handle_terminal_command(message: str) -> bool:
             print("\n📂 No files found.\n")
         return True
     
+    # /queue
+    if msg == '/queue':
+        lines = describe_queue(session.queue)
+        print("\n📋 Queue:\n   " + "\n   ".join(lines) + "\n" if lines else "\n📭 Queue is empty.\n")
+        return True
+    
+    # /cancel <id>
+    if msg.startswith('/cancel'):
+        if arg and arg.lstrip('#').isdigit():
+            job_id = int(arg.lstrip('#'))
+        elif not arg and session.queue.running:
+            job_id = session.queue.running.id
+        else:
+            print("\nUsage: /cancel [job id]\n")
+            return True
+        print(f"\n⏹ Cancelling job #{job_id}...\n")
+        result = await bridge.sessions.cancel_job(job_id)
+        if result is None:
+            print(f"❌ No job #{job_id}.\n")
+        elif result == "queued":
+            print(f"🗑 Job #{job_id} cancelled.\n")
+        return True
+    
+    # /log
+    if msg == '/log':
+        store = session.last_output
+        if not store or not store.size:
+            print("\n📜 No output yet.\n")
+        elif store.path:
+            print(f"\n📜 Full transcript: {store.path}\n")
+        elif store.complete:
+            print("\n" + store.text() + "\n")
+        else:
+            print("\n❌ The full transcript could not be kept.\n")
+        return True
+    
+    # /sessions
+    if msg == '/sessions':
+        print("\n🗂 Sessions:\n   " + "\n   ".join(describe_sessions()) + "\n")
+        return True
+    
     # /help
     if msg in ['/help', '/start']:
         print("""
 🖥️  TERMINAL COMMANDS:
    /status, /info  - Show session status
    /reset          - Start new session
-   /tasks          - Show task info
-   /resume <id>    - Resume a task
+   /tasks          - List recent tasks
+   /search <text>  - Search past messages and replies
+   /resume [id]    - Resume a task (default: the latest here)
    /model [name]   - Show/set model
    /files          - List files
+   /queue          - Show queued jobs
+   /cancel [id]    - Stop running or drop queued job
+   /sessions       - List workspace sessions
+   /log            - Full output of the last message
    /help           - Show this help
    
 💬 Any other message goes to Cline!
@@ -893,65 +4116,534 @@ def handle_terminal_command(message: str) -> bool:
     return False
 
 
-def terminal_input_thread():
-    """Thread to read terminal input and queue it for Cline."""
+async def run_terminal_job(message: str, session: ClineSession) -> None:
+    """Run one queued terminal message through its session and print the result."""
+    print(f"\n🤖 Processing terminal message: {message[:50]}...")
+    
+    # Track files
+    await bridge.track_current_files(session)
+    
+    # Send to Cline
+    started = time.time()
+    response, task_id, _ = await bridge.send_to_cline(session, message, chat_id=None, context=None)
+    
+    # Store task ID for resume
+    if task_id:
+        session.task_id = task_id
+    
+    # Show response
+    print("\n" + "="*60)
+    print("🤖 CLINE RESPONSE:")
+    print("-"*60)
+    print(response or "✅ Completed")
+    print("="*60 + "\n")
+    if session.last_pager:
+        print("📜 Output continues - /log for the full transcript\n")
+    
+    # Check for new files
+    changes = await bridge.get_file_changes(session)
+    await bridge.turns.record(session, "terminal", message, task_id or session.task_id, started, changes)
+    for label, key in (("New files created", "created"), ("Files modified", "modified"), ("Files deleted", "deleted")):
+        if changes[key]:
+            print(f"📎 {label}: {len(changes[key])}")
+            for f in changes[key]:
+                print(f"  • {os.path.basename(f)}")
+            print()
+
+
+async def terminal_loop(terminal: "TerminalInput"):
+    """Dispatch terminal lines: commands run here, messages go onto the session job queue."""
     print("\n" + "="*60)
     print("🖥️  TERMINAL INPUT MODE")
     print("="*60)
-    print("Commands: /status /reset /tasks /resume /model /files /help")
+    print("Commands: /status /reset /tasks /search /resume /model /files /queue /cancel /sessions /log /help")
     print("Any other message goes to Cline.")
     print("="*60 + "\n")
+    terminal.redraw()
     
     while True:
-        try:
-            user_input = input("💬 You: ")
-            if user_input.strip():
-                # Check if it's a local command
-                if user_input.strip().startswith('/'):
-                    handle_terminal_command(user_input)
-                else:
-                    terminal_input_queue.put(user_input)
-                    print("🔄 Sending to Cline...\n")
-        except EOFError:
-            break
-        except KeyboardInterrupt:
+        user_input = await terminal.get()
+        if user_input is None:
             print("\n👋 Exiting terminal input mode...")
             break
+        try:
+            if not user_input.strip():
+                continue
+            # Check if it's a local command
+            if user_input.strip().startswith('/'):
+                await handle_terminal_command(user_input)
+                continue
+            
+            session = bridge.session_for(None)
+            queue = session.queue
+            job = queue.submit("terminal", user_input, lambda job, message=user_input, session=session: run_terminal_job(message, session))
+            if job is None:
+                print(f"\n🚫 Queue is full ({QUEUE_MAX_JOBS} jobs), message dropped.\n")
+            elif queue.position(job) > 1 or queue.running:
+                print(f"\n📥 Queued as job #{job.id} (position {queue.position(job)}, ETA ~{format_duration(queue.eta(job))})\n")
+            else:
+                print("🔄 Sending to Cline...\n")
+        except Exception as e:
+            logger.error(f"Error processing terminal input: {e}")
+        finally:
+            terminal.redraw()
+    terminal.stop()
 
 
-async def process_terminal_input(context):
-    """Process terminal input and send to Cline."""
-    while True:
+async def run_control_job(job: Job, session: ClineSession) -> None:
+    """Run one control API message through its session and publish the result."""
+    await bridge.track_current_files(session)
+    
+    def on_text(text: str):
+        job.publish({"event": "output", "job": job.id, "text": text})
+    
+    started = time.time()
+    response, task_id, _ = await bridge.send_to_cline(session, job.text, on_text=on_text)
+    if task_id:
+        session.task_id = task_id
+    
+    changes = await bridge.get_file_changes(session)
+    await bridge.turns.record(session, "control", job.text, session.task_id, started, changes)
+    files = {key: [os.path.relpath(f, session.working_dir) for f in changes[key]]
+             for key in ("created", "modified", "deleted")}
+    job.result = {
+        "event": "done",
+        "job": job.id,
+        "response": response,
+        "task_id": task_id or session.task_id,
+        "more": session.last_pager is not None,
+        "files": files,
+    }
+
+
+async def read_http_request(reader: asyncio.StreamReader) -> Tuple[str, str, dict, dict, bytes]:
+    """Parse one HTTP/1.1 request into (method, path, query, headers, body).
+    
+    Raises ValueError for malformed or oversized requests.
+    """
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+        raise ValueError("incomplete or oversized request head") from e
+    request_line, *header_lines = head.decode("latin-1").split("\r\n")
+    parts = request_line.split(" ")
+    if len(parts) != 3:
+        raise ValueError(f"bad request line: {request_line[:80]}")
+    method, target, _ = parts
+    
+    headers = {}
+    for line in header_lines:
+        name, sep, value = line.partition(":")
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    
+    length = headers.get("content-length", "0")
+    if not length.isdigit() or int(length) > HTTP_MAX_BODY:
+        raise ValueError(f"bad content length: {length[:20]}")
+    body = await reader.readexactly(int(length)) if int(length) else b""
+    
+    url = urlsplit(target)
+    query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+    return method, url.path, query, headers, body
+
+
+def http_response(status: int, body: bytes = b"", content_type: str = "application/json",
+                  keep_alive: bool = False) -> bytes:
+    """A complete HTTP/1.1 response; the connection closes after it unless kept alive."""
+    head = (
+        f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    return head.encode("latin-1") + body
+
+
+class ControlServer:
+    """Local control API on a Unix socket and, optionally, localhost HTTP.
+    
+    Requests submit messages to the same session job queues Telegram and the
+    terminal use, follow a job's output, cancel jobs, list workspace files and
+    report stats. On the socket every request and event is one JSON line; over
+    HTTP, streams are server-sent events and everything else is JSON.
+    """
+    
+    STREAMING_OPS = ("submit", "stream")
+    
+    def __init__(self, socket_path: str = None, http_port: int = None):
+        self.socket_path = CONTROL_SOCKET if socket_path is None else socket_path
+        self.http_port = CONTROL_HTTP_PORT if http_port is None else http_port
+        self.servers: List[asyncio.AbstractServer] = []
+    
+    async def start(self):
+        if self.socket_path:
+            try:
+                os.makedirs(os.path.dirname(self.socket_path) or ".", exist_ok=True)
+                if os.path.exists(self.socket_path) and stat.S_ISSOCK(os.stat(self.socket_path).st_mode):
+                    os.unlink(self.socket_path)  # Left over from an earlier run
+                server = await asyncio.start_unix_server(self._serve_socket, path=self.socket_path)
+                os.chmod(self.socket_path, 0o600)  # Only this user may drive Cline
+                self.servers.append(server)
+                logger.info(f"Control socket listening on {self.socket_path}")
+            except (OSError, NotImplementedError, AttributeError) as e:
+                logger.warning(f"Control socket unavailable: {e}")
+        if self.http_port and not CONTROL_TOKEN:
+            # Any local process or browser-driven request could otherwise drive Cline
+            logger.warning("Control HTTP disabled: set CONTROL_TOKEN to enable CONTROL_HTTP_PORT")
+        elif self.http_port:
+            try:
+                server = await asyncio.start_server(self._serve_http, "127.0.0.1", self.http_port)
+                self.servers.append(server)
+                logger.info(f"Control HTTP listening on 127.0.0.1:{self.http_port}")
+            except OSError as e:
+                logger.warning(f"Control HTTP unavailable: {e}")
+    
+    async def stop(self):
+        for server in self.servers:
+            server.close()
+        self.servers = []
+        if self.socket_path and os.path.exists(self.socket_path):
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+    
+    @staticmethod
+    def error(message: str, status: int = 400) -> dict:
+        return {"event": "error", "error": message, "status": status}
+    
+    @staticmethod
+    def session_for(request: dict) -> Optional[ClineSession]:
+        """The request's workspace session, by default the terminal's current one."""
+        current = bridge.session_for(None)
+        workspace = request.get("workspace")
+        if not workspace:
+            return current
+        working_dir = os.path.abspath(os.path.join(current.working_dir, os.path.expanduser(str(workspace))))
+        if not os.path.isdir(working_dir):
+            return None
+        return bridge.sessions.get(None, working_dir=working_dir, model=current.model)
+    
+    async def handle(self, request) -> AsyncIterator[dict]:
+        """Events answering one request; streaming ops yield until the job ends."""
+        if not isinstance(request, dict):
+            yield self.error("Request must be a JSON object")
+            return
+        op = request.get("op")
+        
+        if op == "stats":
+            yield self.stats()
+        elif op == "files":
+            session = self.session_for(request)
+            if session is None:
+                yield self.error(f"Directory not found: {request.get('workspace')}", 404)
+                return
+            await bridge.refresh_file_index(session)
+            extensions = request.get("extensions")
+            if isinstance(extensions, str):
+                extensions = [e for e in extensions.split(",") if e]
+            if extensions is not None and not (
+                isinstance(extensions, list) and all(isinstance(e, str) for e in extensions)
+            ):
+                yield self.error("extensions must be a string or a list of strings")
+                return
+            files = bridge.scan_files(session, extensions or None)
+            yield {
+                "event": "files",
+                "workspace": session.working_dir,
+                "files": [os.path.relpath(f, session.working_dir) for f in files],
+            }
+        elif op == "submit":
+            text = request.get("text")
+            if not isinstance(text, str) or not text.strip():
+                yield self.error("submit needs a non-empty text")
+                return
+            session = self.session_for(request)
+            if session is None:
+                yield self.error(f"Directory not found: {request.get('workspace')}", 404)
+                return
+            queue = session.queue
+            job = queue.submit("control", text, lambda job, session=session: run_control_job(job, session))
+            if job is None:
+                yield self.error(f"Queue is full ({QUEUE_MAX_JOBS} jobs)", 429)
+                return
+            listener = job.subscribe() if request.get("stream") else None
+            yield {
+                "event": "queued",
+                "job": job.id,
+                "workspace": session.working_dir,
+                "position": queue.position(job),
+                "eta_seconds": round(queue.eta(job), 1),
+            }
+            if listener:
+                async for event in self.follow(job, listener):
+                    yield event
+        elif op == "stream":
+            _, job = bridge.sessions.find_job(self.job_id(request))
+            if job is None:
+                yield self.error("No such running or queued job", 404)
+                return
+            async for event in self.follow(job, job.subscribe()):
+                yield event
+        elif op == "cancel":
+            job_id = self.job_id(request)
+            result = await bridge.sessions.cancel_job(job_id) if job_id else None
+            if result is None:
+                yield self.error("No such running or queued job", 404)
+            else:
+                yield {"event": "cancel", "job": job_id, "cancelled": result}
+        else:
+            yield self.error(f"Unknown op: {op}")
+    
+    @staticmethod
+    def job_id(request: dict) -> Optional[int]:
+        value = str(request.get("job", "")).lstrip("#")
+        return int(value) if value.isdigit() else None
+    
+    @staticmethod
+    async def follow(job: Job, listener: asyncio.Queue) -> AsyncIterator[dict]:
+        """A job's events until it finishes."""
         try:
-            if not terminal_input_queue.empty():
-                message = terminal_input_queue.get()
-                print(f"\n🤖 Processing terminal message: {message[:50]}...")
-                
-                # Track files
-                bridge.track_current_files()
-                
-                # Send to Cline
-                response, task_id, _ = await bridge.send_to_cline(message, chat_id=None, context=None)
+            while True:
+                event = await listener.get()
+                if event is None:
+                    return
+                yield event
+        finally:
+            job.unsubscribe(listener)
+    
+    @staticmethod
+    def stats() -> dict:
+        sessions = []
+        for session in bridge.sessions.all():
+            queue = session.queue
+            sessions.append({
+                **session.get_stats(),
+                "running_job": queue.running.id if queue.running else None,
+                "queued_jobs": [job.id for job in queue.pending],
+                "avg_job_seconds": round(queue.avg_duration, 1),
+            })
+        return {
+            "event": "stats",
+            "sessions": sessions,
+            "running": sum(1 for session in bridge.sessions.all() if session.lock.locked()),
+            "max_running": CLINE_MAX_RUNNING,
+            "standby": bridge.pool.count(),
+        }
+    
+    async def _serve_socket(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """JSON lines in, JSON lines out, several requests per connection."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    request = None
+                events = self.handle(request)
+                try:
+                    async for event in events:
+                        writer.write(json.dumps(event).encode() + b"\n")
+                        await writer.drain()
+                finally:
+                    await events.aclose()  # Stops following the job if the client left
+        except (ConnectionError, ValueError) as e:
+            logger.debug(f"Control socket client dropped: {e}")
+        finally:
+            writer.close()
+    
+    def route(self, method: str, path: str, query: dict, body: bytes) -> dict:
+        """Map an HTTP request onto a control request."""
+        parts = [part for part in path.split("/") if part]
+        if method == "GET" and parts == ["stats"]:
+            return {"op": "stats"}
+        if method == "GET" and parts == ["files"]:
+            return {**query, "op": "files"}
+        if method == "POST" and parts == ["submit"]:
+            try:
+                request = json.loads(body or b"{}")
+            except ValueError:
+                return self.error("Body must be JSON")
+            if not isinstance(request, dict):
+                return self.error("Body must be a JSON object")
+            stream = request.get("stream") or query.get("stream") in ("1", "true")
+            return {**request, "op": "submit", "stream": bool(stream)}
+        if len(parts) >= 2 and parts[0] == "jobs":
+            if method == "GET" and parts[2:] == ["stream"]:
+                return {"op": "stream", "job": parts[1]}
+            if (method == "POST" and parts[2:] == ["cancel"]) or (method == "DELETE" and len(parts) == 2):
+                return {"op": "cancel", "job": parts[1]}
+        return self.error(f"No route for {method} {path}", 404)
+    
+    async def _serve_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """One request per connection; streaming ops answer with server-sent events."""
+        events = None
+        try:
+            try:
+                method, path, query, headers, body = await read_http_request(reader)
+            except ValueError as e:
+                writer.write(http_response(400, json.dumps(self.error(str(e))).encode()))
+                return
+            
+            request = self.check_http(method, headers) or self.route(method, path, query, body)
+            events = self.handle(request) if request.get("op") else None
+            first = await events.__anext__() if events else request
+            if first.get("event") == "error":
+                writer.write(http_response(first.get("status", 400), json.dumps(first).encode()))
+                return
+            if request.get("op") not in self.STREAMING_OPS or (request["op"] == "submit" and not request.get("stream")):
+                status = 202 if first.get("event") == "queued" else 200
+                writer.write(http_response(status, json.dumps(first).encode()))
+                return
+            
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n"
+            )
+            event = first
+            while True:
+                writer.write(f"event: {event['event']}\ndata: {json.dumps(event)}\n\n".encode())
+                await writer.drain()
+                try:
+                    event = await events.__anext__()
+                except StopAsyncIteration:
+                    break
+        except ConnectionError as e:
+            logger.debug(f"Control HTTP client dropped: {e}")
+        finally:
+            if events:
+                await events.aclose()
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+            writer.close()
+    
+    @classmethod
+    def check_http(cls, method: str, headers: dict) -> Optional[dict]:
+        """Refuse requests a browser page could forge; None when the request may proceed."""
+        host = headers.get("host", "")
+        if not host.endswith("]"):
+            host = host.rsplit(":", 1)[0]  # Drop the port
+        if host not in ("127.0.0.1", "localhost", "[::1]"):
+            return cls.error("Host must be localhost", 403)  # DNS rebinding
+        if method == "POST" and not headers.get("content-type", "").startswith("application/json"):
+            return cls.error("Content-Type must be application/json", 415)  # Cross-site form posts
+        scheme, _, token = headers.get("authorization", "").partition(" ")
+        if (not CONTROL_TOKEN or scheme.lower() != "bearer"
+                or not hmac.compare_digest(token.encode(), CONTROL_TOKEN.encode())):
+            return cls.error("Missing or wrong bearer token", 401)
+        return None
+
+
+class WebhookServer:
+    """Receives Telegram updates over HTTP and hands them to the application.
+    
+    Telegram posts each update to TELEGRAM_WEBHOOK_URL and a TLS proxy
+    forwards it here. Requests without the secret token are refused before
+    any parsing, and the reply goes out as soon as the update is queued, so
+    deliveries never wait on handlers. Connections are kept alive between
+    deliveries.
+    """
+    
+    def __init__(self, application: Application, url: str = None, secret: str = None):
+        self.application = application
+        self.url = url or TELEGRAM_WEBHOOK_URL
+        self.path = urlsplit(self.url).path or "/"
+        self.secret = (secret or TELEGRAM_WEBHOOK_SECRET).encode()
+        self.server: Optional[asyncio.AbstractServer] = None
+    
+    async def start(self, host: str = None, port: int = None):
+        host = host or TELEGRAM_WEBHOOK_LISTEN
+        port = port or TELEGRAM_WEBHOOK_PORT
+        self.server = await asyncio.start_server(self._serve, host, port)
+        logger.info(f"Webhook server listening on {host}:{port}{self.path}")
+    
+    async def register(self):
+        """Point Telegram at the webhook, asking only for the updates we handle."""
+        await self.application.bot.set_webhook(
+            url=self.url,
+            secret_token=self.secret.decode(),
+            allowed_updates=ALLOWED_UPDATES,
+            max_connections=TELEGRAM_WEBHOOK_MAX_CONNECTIONS,
+        )
+    
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            self.server = None
+    
+    def check(self, method: str, path: str, headers: dict) -> int:
+        """HTTP status for a delivery before its body is looked at; 200 to accept."""
+        token = headers.get("x-telegram-bot-api-secret-token", "").encode()
+        if not hmac.compare_digest(token, self.secret):
+            return 403
+        if path != self.path:
+            return 404
+        if method != "POST":
+            return 405
+        return 200
+    
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    method, path, _, headers, body = await asyncio.wait_for(
+                        read_http_request(reader), WEBHOOK_IDLE_TIMEOUT
+                    )
+                except (ValueError, asyncio.TimeoutError):
+                    break  # Closed, idle or malformed
                 
-                # Show response
-                print("\n" + "="*60)
-                print("🤖 CLINE RESPONSE:")
-                print("-"*60)
-                print(response or "✅ Completed")
-                print("="*60 + "\n")
+                status = self.check(method, path, headers)
+                if status == 200:
+                    try:
+                        data = json.loads(body)
+                        update = Update.de_json(data, self.application.bot) if isinstance(data, dict) else None
+                    except ValueError:
+                        update = None
+                    if update is None:
+                        status = 400
+                    else:
+                        await self.application.update_queue.put(update)
                 
-                # Check for new files
-                new_files = bridge.get_new_files()
-                if new_files:
-                    print(f"📎 New files created: {len(new_files)}")
-                    for f in new_files:
-                        print(f"  • {os.path.basename(f)}")
-                    print()
-                    
-            await asyncio.sleep(0.1)
-        except Exception as e:
-            logger.error(f"Error processing terminal input: {e}")
-            await asyncio.sleep(1)
+                keep_alive = status == 200 and headers.get("connection", "").lower() != "close"
+                writer.write(http_response(status, keep_alive=keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError as e:
+            logger.debug(f"Webhook connection dropped: {e}")
+        finally:
+            writer.close()
+
+
+async def run_webhook(application: Application):
+    """Serve updates through the webhook until SIGINT or SIGTERM."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    server = WebhookServer(application)
+    # The same lifecycle run_polling follows, with the webhook in place of the poller
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await server.start()
+        await server.register()
+        logger.info("Receiving updates via webhook")
+        try:
+            await stop.wait()
+        finally:
+            await server.stop()
+            await application.stop()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
 
 
 def main() -> None:
@@ -963,19 +4655,25 @@ def main() -> None:
         logger.error("TELEGRAM_BOT_TOKEN not set in environment")
         return
     
-    if AUTHORIZED_USER_ID == 0:
+    if not AUTHORIZED_USER_IDS and not AUTHORIZED_CHAT_IDS:
         logger.error("AUTHORIZED_USER_ID not set in environment")
         return
     
     # Initialize bridge
     bridge = TelegramClineBridge()
-    
-    # Start terminal input thread
-    input_thread = threading.Thread(target=terminal_input_thread, daemon=True)
-    input_thread.start()
+    terminal = TerminalInput()
+    control = ControlServer()
     
     # Create application
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(max(TELEGRAM_CONCURRENT_UPDATES, 1))
+        .build()
+    )
+    
+    # Unauthorized and flooding senders stop here, before any handler
+    application.add_handler(TypeHandler(Update, AuthGate()), group=-1)
     
     # Register handlers
     application.add_handler(CommandHandler("start", start_command))
@@ -989,6 +4687,12 @@ def main() -> None:
     application.add_handler(CommandHandler("get", get_command))
     application.add_handler(CommandHandler("tasks", tasks_command))
     application.add_handler(CommandHandler("resume", resume_command))
+    application.add_handler(CommandHandler("search", search_command))
+    application.add_handler(CommandHandler("queue", queue_command))
+    application.add_handler(CommandHandler("cancel", cancel_command))
+    application.add_handler(CommandHandler("sessions", sessions_command))
+    application.add_handler(CommandHandler("log", log_command))
+    application.add_handler(CallbackQueryHandler(page_callback, pattern=r"^(more|log):"))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     
     # Start bot with terminal input processing
@@ -996,10 +4700,28 @@ def main() -> None:
     
     async def post_init(application):
         """Start terminal input processing after bot initializes."""
-        asyncio.create_task(process_terminal_input(application))
+        bridge.loop = asyncio.get_running_loop()
+        bridge.pool.start()
+        session = bridge.session_for(None)
+        bridge.pool.prewarm(session.working_dir, session.model)
+        terminal.start()
+        asyncio.create_task(terminal_loop(terminal))
+        await control.start()
+    
+    async def post_shutdown(application):
+        """Stop every session's Cline process and the standbys on exit."""
+        terminal.stop()
+        await control.stop()
+        await bridge.sessions.stop()
+        await bridge.pool.stop()
+        bridge.turns.close()
     
     application.post_init = post_init
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    application.post_shutdown = post_shutdown
+    if TELEGRAM_WEBHOOK_URL:
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,84 @@
+"""AuthGate: allow lists and per-sender rate limits ahead of every handler."""
+
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+from telegram.ext import ApplicationHandlerStop
+
+import telegram_bridge as tb
+
+OWNER = 1001
+STRANGER = 666
+
+
+@pytest.fixture(autouse=True)
+def allow_lists(monkeypatch):
+    monkeypatch.setattr(tb, "AUTHORIZED_USER_IDS", {OWNER})
+    monkeypatch.setattr(tb, "AUTHORIZED_CHAT_IDS", set())
+    monkeypatch.setattr(tb, "UNAUTHORIZED_REPLY", False)
+
+
+def make_update(user_id, chat_id=None, callback=False):
+    message = SimpleNamespace(reply_text=AsyncMock())
+    query = SimpleNamespace(answer=AsyncMock()) if callback else None
+    return SimpleNamespace(
+        effective_user=SimpleNamespace(id=user_id) if user_id is not None else None,
+        effective_chat=SimpleNamespace(id=chat_id if chat_id is not None else user_id),
+        effective_message=message,
+        callback_query=query,
+    )
+
+
+def passes(gate, update) -> bool:
+    try:
+        asyncio.run(gate(update, None))
+    except ApplicationHandlerStop:
+        return False
+    return True
+
+
+@pytest.mark.parametrize("callback", [False, True])
+def test_unauthorized_update_stops_silently(callback):
+    gate = tb.AuthGate()
+    update = make_update(STRANGER, callback=callback)
+    assert not passes(gate, update)
+    update.effective_message.reply_text.assert_not_called()
+    if callback:
+        update.callback_query.answer.assert_not_called()
+    assert gate.dropped == 1
+
+
+def test_update_without_sender_is_stopped():
+    update = make_update(None)
+    update.effective_chat = None
+    assert not passes(tb.AuthGate(), update)
+
+
+def test_authorized_user_and_chat_pass(monkeypatch):
+    monkeypatch.setattr(tb, "AUTHORIZED_CHAT_IDS", {-500})
+    gate = tb.AuthGate()
+    assert passes(gate, make_update(OWNER))
+    assert passes(gate, make_update(STRANGER, chat_id=-500))  # Anyone in an allowed group
+    assert not passes(gate, make_update(STRANGER, chat_id=-501))
+
+
+def test_allowed_sender_is_rate_limited(monkeypatch):
+    monkeypatch.setattr(tb, "SENDER_RATE", 0.001)
+    monkeypatch.setattr(tb, "SENDER_BURST", 2)
+    gate = tb.AuthGate()
+    update = make_update(OWNER)
+    assert [passes(gate, update) for _ in range(3)] == [True, True, False]
+    update.effective_message.reply_text.assert_not_called()
+    assert passes(tb.AuthGate(), make_update(OWNER))  # Buckets are per gate and sender
+
+
+def test_unauthorized_reply_is_throttled(monkeypatch):
+    monkeypatch.setattr(tb, "UNAUTHORIZED_REPLY", True)
+    gate = tb.AuthGate()
+    first, second = make_update(STRANGER), make_update(STRANGER)
+    assert not passes(gate, first)
+    assert not passes(gate, second)
+    first.effective_message.reply_text.assert_awaited_once_with("Unauthorized access.")
+    second.effective_message.reply_text.assert_not_called()
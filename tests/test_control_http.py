@@ -0,0 +1,125 @@
+"""HTTP front of the local control API: request parsing, checks and routing."""
+
+import asyncio
+import json
+
+import pytest
+
+import telegram_bridge as tb
+from telegram_bridge import ControlServer, read_http_request
+
+TOKEN = "s3cret"
+GOOD = {"host": "127.0.0.1:8765", "authorization": f"Bearer {TOKEN}"}
+
+
+@pytest.fixture(autouse=True)
+def token(monkeypatch):
+    monkeypatch.setattr(tb, "CONTROL_TOKEN", TOKEN)
+
+
+def status(result):
+    return result and result["status"]
+
+
+def test_valid_request_passes():
+    assert ControlServer.check_http("GET", GOOD) is None
+    assert ControlServer.check_http("POST", {**GOOD, "content-type": "application/json; charset=utf-8"}) is None
+
+
+@pytest.mark.parametrize("authorization", ["", "Bearer", "Bearer wrong", f"Basic {TOKEN}", TOKEN])
+def test_missing_or_wrong_token_is_401(authorization):
+    assert status(ControlServer.check_http("GET", {**GOOD, "authorization": authorization})) == 401
+
+
+def test_no_configured_token_refuses_everything(monkeypatch):
+    monkeypatch.setattr(tb, "CONTROL_TOKEN", "")
+    assert status(ControlServer.check_http("GET", {**GOOD, "authorization": "Bearer "})) == 401
+
+
+@pytest.mark.parametrize("host", ["localhost:8765", "[::1]:8765", "127.0.0.1"])
+def test_local_hosts_are_accepted(host):
+    assert ControlServer.check_http("GET", {**GOOD, "host": host}) is None
+
+
+@pytest.mark.parametrize("host", ["", "evil.example:8765", "127.0.0.1.evil.example", "localhost.evil.example:80"])
+def test_foreign_host_is_403(host):
+    assert status(ControlServer.check_http("GET", {**GOOD, "host": host})) == 403
+
+
+@pytest.mark.parametrize("content_type", [None, "text/plain", "application/x-www-form-urlencoded", "multipart/form-data"])
+def test_non_json_post_is_415(content_type):
+    headers = dict(GOOD)
+    if content_type:
+        headers["content-type"] = content_type
+    assert status(ControlServer.check_http("POST", headers)) == 415
+
+
+def test_routes():
+    server = ControlServer(socket_path="", http_port=0)
+    assert server.route("GET", "/stats", {}, b"") == {"op": "stats"}
+    assert server.route("GET", "/files", {"workspace": "src"}, b"") == {"workspace": "src", "op": "files"}
+    assert server.route("POST", "/submit", {"stream": "1"}, b'{"text": "hi"}') == {
+        "text": "hi", "op": "submit", "stream": True
+    }
+    assert server.route("POST", "/jobs/7/cancel", {}, b"") == {"op": "cancel", "job": "7"}
+    assert server.route("GET", "/jobs/7/stream", {}, b"") == {"op": "stream", "job": "7"}
+    assert status(server.route("POST", "/submit", {}, b"not json")) == 400
+    assert status(server.route("POST", "/submit", {}, b"[1, 2]")) == 400
+    assert status(server.route("GET", "/submit", {}, b"")) == 404
+
+
+def parse(raw: bytes):
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw)
+        reader.feed_eof()
+        return await read_http_request(reader)
+    return asyncio.run(run())
+
+
+def test_read_http_request():
+    method, path, query, headers, body = parse(
+        b"POST /submit?stream=1&stream=0 HTTP/1.1\r\nHost: localhost\r\n"
+        b"Content-Type: application/json\r\nContent-Length: 2\r\n\r\n{}"
+    )
+    assert (method, path, query, body) == ("POST", "/submit", {"stream": "0"}, b"{}")
+    assert headers["content-type"] == "application/json" and headers["host"] == "localhost"
+
+
+@pytest.mark.parametrize("raw", [
+    b"GET /stats\r\n\r\n",
+    b"GET /stats HTTP/1.1\r\nHost: localhost\r\n",
+    b"POST /submit HTTP/1.1\r\nContent-Length: -1\r\n\r\n",
+    b"POST /submit HTTP/1.1\r\nContent-Length: 99999999999\r\n\r\n",
+])
+def test_malformed_requests_are_rejected(raw):
+    with pytest.raises(ValueError):
+        parse(raw)
+
+
+def test_refused_requests_over_the_wire():
+    """The checks run before any request reaches the bridge."""
+    async def request(raw: bytes):
+        server = ControlServer(socket_path="", http_port=0)
+        listener = await asyncio.start_server(server._serve_http, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(raw.replace(b"PORT", str(port).encode()))
+            response = await reader.read()
+            writer.close()
+        finally:
+            listener.close()
+        head, _, body = response.partition(b"\r\n\r\n")
+        return int(head.split()[1]), json.loads(body)
+    
+    assert asyncio.run(request(b"GET /stats HTTP/1.1\r\nHost: 127.0.0.1:PORT\r\n\r\n"))[0] == 401
+    assert asyncio.run(request(
+        b"GET /stats HTTP/1.1\r\nHost: attacker.example\r\nAuthorization: Bearer s3cret\r\n\r\n"
+    ))[0] == 403
+    code, body = asyncio.run(request(
+        b"POST /submit HTTP/1.1\r\nHost: localhost:PORT\r\nAuthorization: Bearer s3cret\r\n"
+        b"Content-Type: application/x-www-form-urlencoded\r\nContent-Length: 7\r\n\r\ntext=hi"
+    ))
+    assert code == 415 and body["event"] == "error"
+    assert asyncio.run(request(b"NONSENSE\r\n\r\n"))[0] == 400
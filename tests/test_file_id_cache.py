@@ -0,0 +1,24 @@
+"""Persistent Telegram file_id cache."""
+
+import asyncio
+import json
+
+from telegram_bridge import FileIdCache
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    path = tmp_path / "file_ids.json"
+    cache = FileIdCache(str(path), size=2)
+    
+    async def scenario():
+        await cache.put("a", "document", "a.txt", "id-a")
+        await cache.put("b", "document", "b.txt", "id-b")
+        assert cache.get("a", "document", "a.txt") == "id-a"  # a is now the most recent
+        await cache.put("c", "document", "c.txt", "id-c")
+    
+    asyncio.run(scenario())
+    assert cache.get("b", "document", "b.txt") is None
+    assert list(json.loads(path.read_text()).values()) == ["id-a", "id-c"]
+    
+    reloaded = FileIdCache(str(path), size=1)
+    assert list(reloaded.ids.values()) == ["id-c"]
@@ -0,0 +1,69 @@
+"""FileIndex kept current by inotify: moved directories and resyncs."""
+
+import asyncio
+import os
+
+import pytest
+
+import telegram_bridge as tb
+
+pytestmark = pytest.mark.skipif(tb._load_inotify() is None, reason="inotify not available")
+
+
+async def settle(index):
+    await asyncio.sleep(0.2)
+    await index.refresh()
+
+
+def test_directory_moved_out_stops_reporting(tmp_path):
+    workspace = tmp_path / "ws"
+    outside = tmp_path / "outside"
+    workspace.mkdir()
+    outside.mkdir()
+    
+    async def scenario():
+        index = tb.FileIndex(str(workspace))
+        await index.start()
+        try:
+            assert index.watching
+            os.makedirs(workspace / "new" / "deep")
+            (workspace / "new" / "deep" / "a.js").write_text("")
+            await settle(index)
+            assert str(workspace / "new" / "deep" / "a.js") in index.files()
+            
+            os.rename(workspace / "new", outside / "new")
+            await settle(index)
+            (outside / "new" / "deep" / "zz.js").write_text("")
+            await settle(index)
+            return index.files(), set(index.watches.values())
+        finally:
+            index.stop()
+    
+    files, watched = asyncio.run(scenario())
+    assert files == []
+    assert watched == {str(workspace)}
+
+
+def test_resync_after_overflow_watches_new_directories(tmp_path):
+    workspace = tmp_path / "ws"
+    workspace.mkdir()
+    
+    async def scenario():
+        index = tb.FileIndex(str(workspace))
+        await index.start()
+        try:
+            loop = asyncio.get_running_loop()
+            loop.remove_reader(index.fd)
+            os.makedirs(workspace / "lost")
+            os.read(index.fd, 64 * 1024)  # The events are lost...
+            loop.add_reader(index.fd, index._drain)
+            index._handle_event(0, tb.IN_Q_OVERFLOW, "")  # ...and the kernel says so
+            await index.refresh()
+            
+            (workspace / "lost" / "a.py").write_text("")
+            await settle(index)
+            return index.files()
+        finally:
+            index.stop()
+    
+    assert asyncio.run(scenario()) == [str(workspace / "lost" / "a.py")]
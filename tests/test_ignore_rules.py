@@ -0,0 +1,91 @@
+"""Translation of .gitignore patterns by IgnoreRules and _gitignore_regex."""
+
+import re
+
+import pytest
+
+from telegram_bridge import IgnoreRules, _gitignore_regex
+
+
+def rules_for(tmp_path, text, rel_dir=''):
+    gitignore = tmp_path / '.gitignore'
+    gitignore.write_text(text)
+    rules = IgnoreRules()
+    rules.load(rel_dir, str(gitignore))
+    return rules
+
+
+@pytest.mark.parametrize("pattern, path, matches", [
+    ("*.log", "debug.log", True),
+    ("*.log", "logs/debug.log", False),  # * stops at /
+    ("a?c", "abc", True),
+    ("a?c", "a/c", False),
+    ("[!a]b", "cb", True),
+    ("[!a]b", "ab", False),
+    ("**/build", "build", True),
+    ("**/build", "x/y/build", True),
+    ("src/**", "src/a/b.py", True),
+    ("a/**/b", "a/b", True),
+    ("a/**/b", "a/x/y/b", True),
+    (r"\#notes", "#notes", True),
+    ("file.py", "filexpy", False),  # Dots are literal
+])
+def test_glob_translation(pattern, path, matches):
+    assert bool(re.match(_gitignore_regex(pattern) + r'\Z', path)) is matches
+
+
+def test_unanchored_pattern_matches_at_any_depth(tmp_path):
+    rules = rules_for(tmp_path, "*.pyc\n")
+    assert rules.is_ignored("a.pyc", False)
+    assert rules.is_ignored("pkg/sub/a.pyc", False)
+    assert not rules.is_ignored("a.py", False)
+
+
+def test_leading_slash_anchors_to_gitignore_directory(tmp_path):
+    rules = rules_for(tmp_path, "/out\n")
+    assert rules.is_ignored("out", True)
+    assert not rules.is_ignored("pkg/out", True)
+
+
+def test_inner_slash_anchors_to_gitignore_directory(tmp_path):
+    rules = rules_for(tmp_path, "docs/*.md\n")
+    assert rules.is_ignored("docs/readme.md", False)
+    assert not rules.is_ignored("site/docs/readme.md", False)
+
+
+def test_nested_gitignore_is_relative_to_its_directory(tmp_path):
+    rules = rules_for(tmp_path, "/out\n", rel_dir="pkg")
+    assert rules.is_ignored("pkg/out", True)
+    assert not rules.is_ignored("out", True)
+    assert not rules.is_ignored("pkg/sub/out", True)
+
+
+def test_directory_only_pattern_skips_files(tmp_path):
+    rules = rules_for(tmp_path, "cache/\n")
+    assert rules.is_ignored("cache", True)
+    assert rules.is_ignored("a/cache", True)
+    assert not rules.is_ignored("cache", False)
+
+
+def test_negation_reincludes_and_last_match_wins(tmp_path):
+    rules = rules_for(tmp_path, "*.log\n!keep.log\n")
+    assert rules.is_ignored("debug.log", False)
+    assert not rules.is_ignored("keep.log", False)
+    assert not rules.is_ignored("sub/keep.log", False)
+    
+    rules = rules_for(tmp_path, "!keep.log\n*.log\n")
+    assert rules.is_ignored("keep.log", False)
+
+
+def test_comments_and_blank_lines_are_skipped(tmp_path):
+    rules = rules_for(tmp_path, "# *.py\n\n   \n")
+    assert not rules.is_ignored("main.py", False)
+    assert rules.rules == {}
+
+
+def test_hidden_and_configured_directories_always_ignored():
+    rules = IgnoreRules()
+    assert rules.is_ignored(".git", True)
+    assert rules.is_ignored("src/.env", False)
+    assert rules.is_ignored("node_modules", True)
+    assert not rules.is_ignored("node_modules", False)
@@ -0,0 +1,91 @@
+"""Page splitting, HTML rendering and blank-line handling of Cline output."""
+
+from telegram_bridge import FENCE_RE, OutputCleaner, paginate_lines, render_html
+
+
+def all_pages(lines, limit):
+    """Split lines into pages the way Pager does, returning the page texts."""
+    pages = []
+    fence = None
+    while True:
+        text, used, fence, more = paginate_lines(iter(lines), limit, fence)
+        pages.append(text)
+        if not more:
+            return pages
+        lines = lines[used:]
+
+
+def fence_count(text):
+    return sum(1 for line in text.split("\n") if FENCE_RE.match(line))
+
+
+def test_short_output_is_one_page():
+    text, used, fence, more = paginate_lines(iter(["one", "two"]), 100)
+    assert (text, used, fence, more) == ("one\ntwo", 2, None, False)
+
+
+def test_open_fence_is_closed_and_reopened():
+    lines = ["```python"] + [f"x = {i}" for i in range(40)] + ["```"]
+    text, used, fence, more = paginate_lines(iter(lines), 120)
+    assert more and fence == "python"
+    assert text.startswith("```python\n") and text.endswith("\n```")
+    
+    text, _, _, _ = paginate_lines(iter(lines[used:]), 120, fence)
+    assert text.startswith("```python\nx = ")
+
+
+def test_every_page_has_balanced_fences_and_fits():
+    lines = []
+    for block in range(6):
+        lines += [f"Paragraph {block} " + "words " * 8, ""]
+        lines += ["```js"] + [f"console.log({i});" for i in range(15)] + ["```"]
+    pages = all_pages(lines, 200)
+    assert len(pages) > 3
+    for page in pages:
+        assert len(page) <= 200
+        assert fence_count(page) % 2 == 0
+
+
+def test_pages_cover_all_lines_in_order():
+    lines = [f"line {i}" for i in range(100)]
+    pages = all_pages(lines, 90)
+    assert "\n".join(pages).split("\n") == lines
+
+
+def test_prefers_break_after_closing_fence():
+    lines = ["intro " * 5, "```", "code()", "```"] + ["after"] * 20
+    text, _, fence, _ = paginate_lines(iter(lines), 80)
+    assert text.endswith("code()\n```") and fence is None
+
+
+def test_prefers_break_at_blank_line():
+    lines = ["a" * 30, "b" * 30, "", "c" * 30, "d" * 30]
+    text, used, _, more = paginate_lines(iter(lines), 100)
+    assert more and used == 3
+
+
+def test_html_is_escaped():
+    assert render_html("if a < b && c > d") == "if a &lt; b &amp;&amp; c &gt; d"
+
+
+def test_code_is_escaped_inside_tags():
+    assert render_html("run `x<y>`") == "run <code>x&lt;y&gt;</code>"
+    assert render_html("```html\n<b>&amp;</b>\n```") == (
+        '<pre><code class="language-html">&lt;b&gt;&amp;amp;&lt;/b&gt;</code></pre>'
+    )
+
+
+def test_bold_and_stray_markdown():
+    assert render_html("**done** with *stars* and _under_") == "<b>done</b> with *stars* and _under_"
+    assert render_html("`**not bold**`") == "<code>**not bold**</code>"
+
+
+def test_unclosed_fence_still_closes_pre():
+    assert render_html("```\n<tag>") == "<pre>&lt;tag&gt;</pre>"
+
+
+def test_blank_runs_collapse_to_paragraph_breaks():
+    cleaner = OutputCleaner()
+    cleaner.feed("\n\nfirst\n\n \n\nsecond\n───\n\nthird\n\n")
+    cleaner.finish()
+    assert list(cleaner.store.memory) == ["first", "", "second", "", "third", ""]
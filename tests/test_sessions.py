@@ -0,0 +1,148 @@
+"""Persistent Cline processes and warm standbys, driven with a stub cline."""
+
+import asyncio
+import os
+import stat
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import telegram_bridge as tb
+
+STUB = '''#!{python}
+import os, sys
+log = open(os.environ["STUB_CLINE_LOG"], "a", buffering=1)
+log.write(f"spawn {{os.getpid()}} {{' '.join(sys.argv[1:])}}\\n".replace("\\n", " ").rstrip() + "\\n")
+if "--timeout" in sys.argv:
+    print("oneshot")
+    sys.exit(0)
+print("booting" if os.environ.get("STUB_CLINE_NO_PROMPT") else "> ", end="", flush=True)
+paste = None
+for line in sys.stdin:
+    if paste is None and line.startswith("\\x1b[200~"):
+        paste = line[6:]
+    elif paste is not None:
+        paste += line
+    if paste is not None:
+        if "\\x1b[201~" not in paste:
+            continue
+        line, paste = paste.replace("\\x1b[201~", ""), None
+    log.write(f"turn {{os.getpid()}} {{line.strip()!r}}\\n")
+    print("stub warning", file=sys.stderr, flush=True)
+    print(f"done\\n> ", end="", flush=True)
+'''
+
+
+@pytest.fixture
+def bridge(tmp_path, monkeypatch):
+    stub = tmp_path / "cline"
+    stub.write_text(STUB.format(python=sys.executable))
+    stub.chmod(stub.stat().st_mode | stat.S_IEXEC)
+    workspace = tmp_path / "workspace"
+    workspace.mkdir()
+    (workspace / "CLINE_MEMORY.md").write_text("# Rules\nBe concise.\n")
+    state = tmp_path / "state"
+    
+    monkeypatch.setenv("STUB_CLINE_LOG", str(tmp_path / "cline.log"))
+    monkeypatch.setattr(tb, "CLINE_PATH", str(stub))
+    monkeypatch.setattr(tb, "CLINE_WORKING_DIR", os.path.realpath(workspace))
+    monkeypatch.setattr(tb, "CLINE_PERSISTENT", True)
+    monkeypatch.setattr(tb, "CLINE_MULTILINE", "paste")
+    monkeypatch.setattr(tb, "CLINE_POOL_SIZE", 1)
+    monkeypatch.setattr(tb, "BRIDGE_STATE_DIR", str(state))
+    monkeypatch.setattr(tb, "FILE_ID_CACHE_PATH", str(state / "file_ids.json"))
+    monkeypatch.setattr(tb, "TURN_DB_PATH", str(state / "turns.db"))
+    monkeypatch.setattr(tb.ClineSession, "no_prompt", set())
+    
+    instance = tb.TelegramClineBridge()
+    monkeypatch.setattr(tb, "bridge", instance, raising=False)
+    return instance
+
+
+def cline_log(tmp_path):
+    return (tmp_path / "cline.log").read_text().splitlines()
+
+
+async def wait_for_standby(pool, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not any(pool.standby.values()):
+        assert time.monotonic() < deadline, "standby never became ready"
+        await asyncio.sleep(0.05)
+
+
+def test_first_message_after_reset_runs_on_adopted_standby(bridge, tmp_path):
+    async def scenario():
+        replies = []
+        update = SimpleNamespace(
+            effective_chat=SimpleNamespace(id=1),
+            message=SimpleNamespace(reply_text=lambda text, **kwargs: asyncio.sleep(0, replies.append(text))),
+        )
+        await tb.reset_command(update, None)
+        await wait_for_standby(bridge.pool)
+        session = bridge.session_for(1)
+        try:
+            response, _, _ = await bridge.send_to_cline(session, "hello")
+        finally:
+            await bridge.sessions.stop()
+            await bridge.pool.stop()
+        return replies, response
+    
+    replies, response = asyncio.run(scenario())
+    assert replies and "reset" in replies[0]
+    assert "done" in response
+    assert "stub warning" not in response  # stderr is logged, not replied
+    
+    log = cline_log(tmp_path)
+    spawns = [line for line in log if line.startswith("spawn")]
+    turns = [line for line in log if line.startswith("turn")]
+    assert len(spawns) == 1 and "--timeout" not in spawns[0]  # Only the standby was started
+    standby_pid = spawns[0].split()[1]
+    assert len(turns) == 1 and turns[0].split()[1] == standby_pid
+    assert "Be concise." in turns[0] and "hello" in turns[0]
+
+
+def test_multiline_message_stays_on_the_live_process(bridge, tmp_path):
+    async def scenario():
+        session = bridge.session_for(None)
+        try:
+            await bridge.send_to_cline(session, "first")
+            await bridge.send_to_cline(session, "def f():\n    return 1")
+            await bridge.send_to_cline(session, "third")
+        finally:
+            await bridge.sessions.stop()
+    
+    asyncio.run(scenario())
+    log = cline_log(tmp_path)
+    assert len([line for line in log if line.startswith("spawn")]) == 1
+    turns = [line for line in log if line.startswith("turn")]
+    assert len(turns) == 3
+    assert "Be concise." in turns[0]
+    assert "def f():\\n    return 1" in turns[1]
+    assert "Be concise." not in turns[2]
+
+
+def test_unmatched_prompt_is_not_retried_after_reset(bridge, tmp_path, monkeypatch):
+    monkeypatch.setenv("STUB_CLINE_NO_PROMPT", "1")
+    monkeypatch.setattr(tb, "CLINE_STARTUP_TIMEOUT", 0.5)
+    
+    async def scenario():
+        session = bridge.session_for(None)
+        try:
+            first, _, _ = await bridge.send_to_cline(session, "first")
+            await session.stop()
+            session.restart()
+            bridge.pool.prewarm(session.working_dir, session.model)
+            second, _, _ = await bridge.send_to_cline(session, "second")
+        finally:
+            await bridge.sessions.stop()
+            await bridge.pool.stop()
+        return first, second
+    
+    first, second = asyncio.run(scenario())
+    assert "oneshot" in first and "oneshot" in second
+    spawns = [line for line in cline_log(tmp_path) if line.startswith("spawn")]
+    interactive = [line for line in spawns if "--timeout" not in line]
+    assert len(interactive) == 1  # No second wait for the prompt, and no standby
+    assert len(spawns) == 3
@@ -0,0 +1,29 @@
+"""Terminal line history persisted across restarts."""
+
+import os
+
+import telegram_bridge as tb
+
+
+def submit_lines(monkeypatch, lines):
+    with open(os.devnull) as stdin:
+        monkeypatch.setattr(tb.sys, "stdin", stdin)
+        terminal = tb.TerminalInput()
+        for line in lines:
+            terminal.buffer = list(line)
+            terminal._submit()
+    return terminal
+
+
+def test_history_file_stays_bounded(tmp_path, monkeypatch):
+    path = tmp_path / "terminal_history"
+    monkeypatch.setattr(tb, "BRIDGE_STATE_DIR", str(tmp_path))
+    monkeypatch.setattr(tb, "TERMINAL_HISTORY_PATH", str(path))
+    monkeypatch.setattr(tb, "TERMINAL_HISTORY_SIZE", 5)
+    
+    for batch in range(4):
+        submit_lines(monkeypatch, [f"line {batch}-{i}" for i in range(7)])
+        assert len(path.read_text().splitlines()) <= 10
+    
+    terminal = submit_lines(monkeypatch, [])
+    assert terminal.history == [f"line 3-{i}" for i in range(2, 7)]